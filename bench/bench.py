@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# Hardware-free benchmark for bridge_controller.py and gyro_impl/gyro_bridge.py
+#
+#   sudo python3 bench/bench.py                       # both bridges, all scenarios
+#   sudo python3 bench/bench.py --bridge main --scenario sweep --duration 10
+#   sudo python3 bench/bench.py --bridge-args="--period 8 --output-mode change"
+#
+# A virtual DS4 is created on uinput (needs /dev/uinput, i.e. root) and each
+# bridge runs as a subprocess writing into a socketpair instead of /dev/hidg0.
+# Latency is measured with probes: the harness moves the right stick X to a
+# unique value and times how long until a report carrying it comes out.
+import argparse
+import json
+import os
+import random
+import select
+import shlex
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_gadget import FakeGadget
+from stats import LogHistogram
+from virtual_ds4 import VirtualDS4, MAIN_BUTTONS
+
+BRIDGES = {
+    'main': os.path.join(ROOT, 'bridge_controller.py'),
+    'gyro': os.path.join(ROOT, 'gyro_impl', 'gyro_bridge.py'),
+}
+SCENARIOS = ('idle', 'mash', 'sweep', 'motion')
+
+PROBE_INTERVAL = 0.05 # s between latency probes
+PROBE_TIMEOUT = 0.5
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def decode_rx(bridge, report):
+    # Raw 0-255 right stick X carried by a report, or None
+    if report[0] != 0x30:
+        return None
+    if bridge == 'main':
+        # Right stick X is the low 12 bits of bytes 9-11 (sticks.py, default
+        # profile: 0-255 spread over 0-0xFFF around 0x800); >> 4 gives back
+        # the raw 0-255 value
+        return (report[9] | ((report[10] & 0x0F) << 8)) >> 4
+    # gyro_bridge: HID joystick layout, 16-bit RX at 7-8, scaled * 257.06
+    return round((report[7] | (report[8] << 8)) / 257.06)
+
+
+def cpu_ticks(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return int(fields[11]) + int(fields[12]) # utime + stime
+
+
+def rss_kb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+class Load:
+    # Scripted input patterns. step(now) writes whatever is due and returns
+    # the number of evdev events written.
+
+    def __init__(self, ds4, scenario):
+        self.ds4 = ds4
+        self.scenario = scenario
+        self.next_at = 0
+        self.phase = 0
+        self.held = set()
+
+    def step(self, now):
+        if self.scenario == 'idle' or now < self.next_at:
+            return 0
+        ds4 = self.ds4
+
+        if self.scenario == 'mash':
+            # ~40 presses/releases per second across the face/shoulder buttons
+            self.next_at = now + 0.025
+            code = random.choice(MAIN_BUTTONS[:8])
+            pressed = code not in self.held
+            if pressed: self.held.add(code)
+            else:       self.held.discard(code)
+            ds4.button(code, pressed)
+            return 2
+
+        if self.scenario == 'sweep':
+            # Left stick circles at 250 Hz (DS4 USB report rate)
+            self.next_at = now + 0.004
+            self.phase = (self.phase + 1) % 256
+            ds4.sticks(ABS_X=self.phase, ABS_Y=255 - self.phase)
+            return 3
+
+        # motion: 1 kHz IMU flood
+        self.next_at = now + 0.001
+        self.phase += 1
+        ds4.motion_sample((0.0, 1.0, 0.0), ((self.phase % 200) - 100, 0.0, 0.0))
+        return 8
+
+
+def run_scenario(bridge, scenario, duration, bridge_args):
+    ds4 = VirtualDS4()
+    gadget = FakeGadget()
+    cmd = [sys.executable, BRIDGES[bridge], '--gadget-fd', str(gadget.fileno())] + bridge_args
+    proc = subprocess.Popen(cmd, pass_fds=(gadget.fileno(),),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    reports = [0]
+    probe = {'value': None, 'sent': 0}
+    latency = LogHistogram()
+    lost = [0]
+
+    def on_report(report):
+        reports[0] += 1
+        if probe['value'] is not None and decode_rx(bridge, report) == probe['value']:
+            latency.record(time.monotonic_ns() - probe['sent'])
+            probe['value'] = None
+    gadget.on_report = on_report
+
+    try:
+        # Wait for the bridge to attach and start streaming
+        deadline = time.monotonic() + 15
+        while not reports[0]:
+            if time.monotonic() > deadline or proc.poll() is not None:
+                raise RuntimeError(f"{bridge} bridge did not start")
+            select.select([gadget.host_end], [], [], 0.1)
+            gadget.drain()
+
+        load = Load(ds4, scenario)
+        events = 0
+        reports[0] = 0
+        probe_value = 0
+        next_probe = 0
+        cpu_start = cpu_ticks(proc.pid)
+        start = time.monotonic()
+        end = start + duration
+
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                break
+            events += load.step(now)
+
+            if now >= next_probe:
+                if probe['value'] is not None:
+                    lost[0] += 1
+                probe_value = 1 + probe_value % 250
+                probe['value'] = probe_value
+                probe['sent'] = time.monotonic_ns()
+                ds4.sticks(ABS_RX=probe_value)
+                events += 2
+                next_probe = now + PROBE_INTERVAL
+
+            wait = min(load.next_at, next_probe, end) - time.monotonic()
+            select.select([gadget.host_end], [], [], max(0, wait))
+            gadget.drain()
+
+        elapsed = time.monotonic() - start
+        cpu = (cpu_ticks(proc.pid) - cpu_start) / CLK_TCK
+        result = {
+            'bridge': bridge,
+            'scenario': scenario,
+            'events_per_s': round(events / elapsed),
+            'reports_per_s': round(reports[0] / elapsed, 1),
+            'latency': latency.summary(),
+            'probes_lost': lost[0],
+            'cpu_percent': round(100 * cpu / elapsed, 1),
+            'rss_kb': rss_kb(proc.pid),
+        }
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        gadget.close()
+        ds4.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bridges with a virtual DS4")
+    parser.add_argument('--bridge', choices=tuple(BRIDGES) + ('all',), default='all')
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument('--duration', type=float, default=5, help="Seconds per scenario")
+    parser.add_argument('--bridge-args', default='', help="Extra arguments for the bridge")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    bridges = BRIDGES if args.bridge == 'all' else (args.bridge,)
+    scenarios = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+    bridge_args = shlex.split(args.bridge_args)
+
+    results = []
+    for bridge in bridges:
+        for scenario in scenarios:
+            result = run_scenario(bridge, scenario, args.duration, bridge_args)
+            results.append(result)
+            if not args.json:
+                lat = result['latency']
+                print(f"{bridge:5} {scenario:7} events/s {result['events_per_s']:6} "
+                      f"reports/s {result['reports_per_s']:6} "
+                      f"latency p50 {lat['p50_us']:7.0f} us p99 {lat['p99_us']:7.0f} us "
+                      f"max {lat['max_us']:7.0f} us  cpu {result['cpu_percent']:5}% "
+                      f"rss {result['rss_kb']} kB")
+
+    if args.json:
+        print(json.dumps(results, indent=1))
+
+
+if __name__ == "__main__":
+    main()
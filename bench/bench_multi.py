@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# CPU and latency of multi_bridge.py against the number of controllers
+#
+#   sudo python3 bench/bench_multi.py                     # 1, 2, 3, 4 controllers, sweep load
+#   sudo python3 bench/bench_multi.py --counts 1,4 --scenario mash --duration 10
+#
+# N virtual DS4s and N fake gadgets; one multi_bridge.py process serves them
+# all. Every pad gets the same scripted load and the same latency probes.
+import argparse
+import json
+import os
+import select
+import shlex
+import subprocess
+import sys
+import time
+
+from bench import Load, SCENARIOS, PROBE_INTERVAL, CLK_TCK, ROOT, cpu_ticks, rss_kb, decode_rx
+from fake_gadget import FakeGadget
+from stats import LogHistogram
+from virtual_ds4 import VirtualDS4
+
+MULTI_BRIDGE = os.path.join(ROOT, 'multi_bridge.py')
+
+
+def run_count(count, scenario, duration, bridge_args):
+    pads = [VirtualDS4(index=i, settle=0) for i in range(count)]
+    time.sleep(0.5) # udev
+    gadgets = [FakeGadget() for _ in range(count)]
+    cmd = [sys.executable, MULTI_BRIDGE]
+    for gadget in gadgets:
+        cmd += ['--gadget-fd', str(gadget.fileno())]
+    proc = subprocess.Popen(cmd + bridge_args, pass_fds=[g.fileno() for g in gadgets],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    reports = [0]
+    probe = {'value': None, 'sent': 0, 'seen': set()}
+    latency = LogHistogram()
+
+    def watch(index):
+        def on_report(report):
+            reports[0] += 1
+            if (probe['value'] is not None and index not in probe['seen']
+                    and decode_rx('main', report) == probe['value']):
+                latency.record(time.monotonic_ns() - probe['sent'])
+                probe['seen'].add(index)
+        return on_report
+    for index, gadget in enumerate(gadgets):
+        gadget.on_report = watch(index)
+    host_ends = [g.host_end for g in gadgets]
+
+    def drain(timeout):
+        ready, _, _ = select.select(host_ends, [], [], max(0, timeout))
+        for gadget in gadgets:
+            if gadget.host_end in ready:
+                gadget.drain()
+
+    try:
+        deadline = time.monotonic() + 15
+        while reports[0] < count:
+            if time.monotonic() > deadline or proc.poll() is not None:
+                raise RuntimeError("multi_bridge did not start")
+            drain(0.1)
+
+        loads = [Load(pad, scenario) for pad in pads]
+        events = 0
+        lost = 0
+        reports[0] = 0
+        probe_value = 0
+        next_probe = 0
+        cpu_start = cpu_ticks(proc.pid)
+        start = time.monotonic()
+        end = start + duration
+
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                break
+            for load in loads:
+                events += load.step(now)
+
+            if now >= next_probe:
+                if probe['value'] is not None:
+                    lost += count - len(probe['seen'])
+                probe_value = 1 + probe_value % 250
+                probe['value'] = probe_value
+                probe['seen'] = set()
+                probe['sent'] = time.monotonic_ns()
+                for pad in pads:
+                    pad.sticks(ABS_RX=probe_value)
+                events += 2 * count
+                next_probe = now + PROBE_INTERVAL
+
+            drain(min(min(l.next_at for l in loads), next_probe, end) - time.monotonic())
+
+        elapsed = time.monotonic() - start
+        cpu = (cpu_ticks(proc.pid) - cpu_start) / CLK_TCK
+        result = {
+            'controllers': count,
+            'scenario': scenario,
+            'events_per_s': round(events / elapsed),
+            'reports_per_s': round(reports[0] / elapsed, 1),
+            'latency': latency.summary(),
+            'probes_lost': lost,
+            'cpu_percent': round(100 * cpu / elapsed, 1),
+            'cpu_percent_per_controller': round(100 * cpu / elapsed / count, 1),
+            'rss_kb': rss_kb(proc.pid),
+        }
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        for gadget in gadgets:
+            gadget.close()
+        for pad in pads:
+            pad.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark multi_bridge.py against controller count")
+    parser.add_argument('--counts', default='1,2,3,4', help="Comma separated controller counts")
+    parser.add_argument('--scenario', choices=SCENARIOS, default='sweep')
+    parser.add_argument('--duration', type=float, default=5, help="Seconds per count")
+    parser.add_argument('--bridge-args', default='', help="Extra arguments for multi_bridge.py")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for count in (int(c) for c in args.counts.split(',')):
+        result = run_count(count, args.scenario, args.duration, shlex.split(args.bridge_args))
+        results.append(result)
+        if not args.json:
+            lat = result['latency']
+            print(f"{count} controllers {args.scenario:7} events/s {result['events_per_s']:6} "
+                  f"reports/s {result['reports_per_s']:7} "
+                  f"latency p50 {lat['p50_us']:7.0f} us p99 {lat['p99_us']:7.0f} us "
+                  f"cpu {result['cpu_percent']:5}% ({result['cpu_percent_per_controller']}%/controller) "
+                  f"rss {result['rss_kb']} kB")
+
+    if args.json:
+        print(json.dumps(results, indent=1))
+
+
+if __name__ == "__main__":
+    main()
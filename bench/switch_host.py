@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# Simulated Switch USB host: handshake conformance and time-to-ready
+#
+#   python3 bench/switch_host.py                         # 20 handshakes against bridge_controller.py
+#   python3 bench/switch_host.py --runs 100 --budget-ms 50 --bridge-args="--output-mode change"
+#
+# Plays the console's side of a wired connection into the bridge over a
+# socketpair (no console, no DS4, no root needed):
+#   80 01, 80 02, 80 04, then 0x01 subcommands: device info, low power,
+#   the SPI reads for serial/colors/calibration, input mode, trigger
+#   elapsed, IMU enable, vibration enable, player lights.
+# Every 0x81/0x21 reply is checked (report id, echoed command, ack code,
+# device info, SPI address echo and payload against the flash image) and
+# each step is timed. Exits non-zero on a failed check, a timeout, or a
+# handshake slower than --budget-ms.
+import argparse
+import json
+import os
+import select
+import shlex
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bridge_controller import SPI_CALIB_DATA, MAC_ADDR
+from fake_gadget import FakeGadget
+from report_encoder import OFS_ACK, OFS_SUBCMD, OFS_REPLY, REPORT_SIZE
+from spi_flash import SpiFlash
+from stats import LogHistogram
+
+BRIDGE = os.path.join(ROOT, 'bridge_controller.py')
+
+REPLY_TIMEOUT = 0.1 # s; the console retries after about this long
+NEUTRAL_RUMBLE = bytes.fromhex('0001404000014040')
+
+# (subcommand, arguments) in the order a console sends them
+SUBCOMMANDS = (
+    (0x02, b''), # Device info
+    (0x08, b'\x00'), # Shipment low power state off
+    (0x10, bytes.fromhex('0060000010')), # Serial number
+    (0x10, bytes.fromhex('506000000d')), # Body/button colors
+    (0x10, bytes.fromhex('8060000018')), # Factory sensor and stick parameters
+    (0x10, bytes.fromhex('9860000012')), # Factory stick parameters 2
+    (0x10, bytes.fromhex('1080000018')), # User stick calibration
+    (0x10, bytes.fromhex('3d60000019')), # Factory stick calibration
+    (0x10, bytes.fromhex('2060000018')), # Factory 6-axis calibration
+    (0x10, bytes.fromhex('2880000018')), # User 6-axis calibration
+    (0x03, b'\x30'), # Input report mode: standard full
+    (0x04, b''), # Trigger buttons elapsed time
+    (0x40, b'\x01'), # IMU enable
+    (0x48, b'\x01'), # Vibration enable
+    (0x30, b'\x01'), # Player lights: player 1
+)
+
+# Ack byte a real Pro Controller answers with
+ACK_CODES = {0x01: 0x81, 0x02: 0x82, 0x04: 0x83, 0x10: 0x90, 0x21: 0xA0}
+
+# Device info: firmware 3.73, Pro Controller, then the MAC and 03 02
+DEVICE_INFO = bytes.fromhex('03490302')
+
+
+class SwitchHost:
+    def __init__(self, gadget, flash):
+        self.gadget = gadget
+        self.flash = flash
+        self.counter = 0
+        self.failures = []
+        self.frames = 0 # 0x30 seen
+
+    def fail(self, step, message):
+        self.failures.append(f"{step}: {message}")
+
+    def write(self, data):
+        self.gadget.write_output(bytes(data) + bytes(REPORT_SIZE - len(data)))
+
+    def next_report(self, deadline, want_frame=False):
+        # Next reply (or 0x30 with want_frame) before deadline, else None
+        sock = self.gadget.host_end
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if not select.select([sock], [], [], remaining)[0]:
+                return None
+            report = sock.recv(REPORT_SIZE)
+            if report[0] == 0x30:
+                self.frames += 1
+                if want_frame:
+                    return report
+                continue
+            return report
+
+    def command(self, subcmd):
+        # 0x80 USB command -> its 0x81 reply (None for 80 04)
+        step = f"80 {subcmd:02x}"
+        self.write(bytes((0x80, subcmd)))
+        deadline = time.monotonic() + REPLY_TIMEOUT
+        if subcmd == 0x04:
+            # No reply; the input stream starts right away
+            if self.next_report(deadline, want_frame=True) is None:
+                self.fail(step, "no 0x30 after start")
+            return
+        report = self.next_report(deadline)
+        if report is None:
+            return self.fail(step, "no reply")
+        if report[0] != 0x81 or report[1] != subcmd:
+            return self.fail(step, f"got {report[:2].hex()}, want 81 {subcmd:02x}")
+        if subcmd == 0x01:
+            if report[2:4] != b'\x00\x03':
+                self.fail(step, f"controller type {report[2:4].hex()}, want 0003")
+            if report[4:10] != bytes.fromhex(MAC_ADDR):
+                self.fail(step, f"MAC {report[4:10].hex()}, want {MAC_ADDR.lower()}")
+
+    def subcommand(self, subcmd, args):
+        step = f"01 {subcmd:02x} {args.hex()}".rstrip()
+        self.counter = (self.counter + 1) & 0x0F
+        self.write(bytes((0x01, self.counter)) + NEUTRAL_RUMBLE + bytes((subcmd,)) + args)
+        report = self.next_report(time.monotonic() + REPLY_TIMEOUT)
+        if report is None:
+            return self.fail(step, "no reply")
+        if len(report) != REPORT_SIZE:
+            self.fail(step, f"reply is {len(report)} bytes")
+        if report[0] != 0x21:
+            return self.fail(step, f"reply id 0x{report[0]:02x}, want 0x21")
+        ack = ACK_CODES.get(subcmd, 0x80)
+        if report[OFS_ACK] != ack:
+            self.fail(step, f"ack 0x{report[OFS_ACK]:02x}, want 0x{ack:02x}")
+        if report[OFS_SUBCMD] != subcmd:
+            self.fail(step, f"echoed subcommand 0x{report[OFS_SUBCMD]:02x}")
+
+        data = report[OFS_REPLY:]
+        if subcmd == 0x02:
+            mac = bytes.fromhex(MAC_ADDR)[::-1]
+            if data[:4] != DEVICE_INFO or data[4:10] != mac:
+                self.fail(step, f"device info {data[:12].hex()}")
+        elif subcmd == 0x10:
+            addr = int.from_bytes(args[:4], 'little')
+            length = args[4]
+            if data[:5] != args:
+                self.fail(step, f"address echo {data[:5].hex()}")
+            want = bytes(self.flash.read(addr, length))
+            if data[5:5 + length] != want:
+                self.fail(step, f"SPI 0x{addr:04x} {data[5:5 + length].hex()}, want {want.hex()}")
+
+    def handshake(self):
+        # -> (handshake s, connect -> first 0x30 after 80 04 s)
+        start = time.monotonic()
+        self.command(0x01)
+        self.command(0x02)
+        self.command(0x04)
+        first_frame = time.monotonic() - start
+        for subcmd, args in SUBCOMMANDS:
+            self.subcommand(subcmd, args)
+        return time.monotonic() - start, first_frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Switch handshake against the bridge")
+    parser.add_argument('--runs', type=int, default=20, help="Handshakes to time (one bridge process)")
+    parser.add_argument('--budget-ms', type=float, default=0,
+                        help="Fail if any handshake takes longer (0 = no budget)")
+    parser.add_argument('--spi-dump', metavar='PATH', help="Passed to the bridge; SPI payloads are checked against it")
+    parser.add_argument('--bridge-args', default='', help="Extra arguments for the bridge")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    gadget = FakeGadget()
+    cmd = [sys.executable, BRIDGE, '--gadget-fd', str(gadget.fileno())] + shlex.split(args.bridge_args)
+    if args.spi_dump:
+        cmd += ['--spi-dump', args.spi_dump]
+    proc = subprocess.Popen(cmd, pass_fds=(gadget.fileno(),),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    host = SwitchHost(gadget, SpiFlash(args.spi_dump, SPI_CALIB_DATA))
+
+    handshake = LogHistogram()
+    first_frame = LogHistogram()
+    try:
+        # The bridge streams 0x30 from startup; wait for it to be up
+        if host.next_report(time.monotonic() + 15, want_frame=True) is None:
+            raise RuntimeError("bridge did not start")
+        for _ in range(args.runs):
+            total, first = host.handshake()
+            handshake.record(int(total * 1e9))
+            first_frame.record(int(first * 1e9))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        gadget.close()
+
+    over_budget = args.budget_ms and handshake.max > args.budget_ms * 1e6
+    result = {
+        'runs': args.runs,
+        'handshake': handshake.summary(),
+        'first_0x30': first_frame.summary(),
+        'failures': host.failures,
+        'over_budget': bool(over_budget),
+    }
+    if args.json:
+        print(json.dumps(result, indent=1))
+    else:
+        for failure in dict.fromkeys(host.failures):
+            print(f"FAIL {failure}")
+        h = result['handshake']
+        f = result['first_0x30']
+        print(f"{args.runs} handshakes: {len(SUBCOMMANDS) + 2} replies each, "
+              f"{len(host.failures)} failed checks")
+        print(f"handshake    p50 {h['p50_us'] / 1000:7.2f} ms p99 {h['p99_us'] / 1000:7.2f} ms "
+              f"max {h['max_us'] / 1000:7.2f} ms")
+        print(f"first 0x30   p50 {f['p50_us'] / 1000:7.2f} ms p99 {f['p99_us'] / 1000:7.2f} ms "
+              f"max {f['max_us'] / 1000:7.2f} ms")
+        if over_budget:
+            print(f"FAIL handshake max over the {args.budget_ms:g} ms budget")
+    sys.exit(1 if host.failures or over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# Loopback client for the UDP input (udp_input.py): latency and loss counters
+#
+#   python3 bench/udp_client.py                               # 1000 packets/s for 5 s
+#   python3 bench/udp_client.py --rate 250 --drop 0.05 --reorder 0.05 --duplicate 0.05
+#   python3 bench/udp_client.py --bridge-args="--output-mode change --period 8"
+#
+# Starts bridge_controller.py with --udp-listen on 127.0.0.1 and a fake
+# gadget (no DS4, no Switch, no root needed) and streams packets at it.
+# Every packet moves the right stick X to a new value; the time from
+# sending a packet to the first 0x30 carrying its value is its latency
+# (packets superseded before the next report never show up, by design).
+# Dropped, reordered and duplicated packets can be injected; the bridge's
+# UDP counters (read from its stats socket) are printed next to what was
+# injected. The packets hold no buttons and a centered hat, so every 0x30
+# must carry 0x08 (hat centered) in byte 5, the startup frames included.
+import argparse
+import json
+import os
+import random
+import select
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_gadget import FakeGadget
+from stats import LogHistogram
+from udp_input import UdpSender, DEFAULT_PORT
+from bench import decode_rx
+
+BRIDGE = os.path.join(ROOT, 'bridge_controller.py')
+NEUTRAL_LEFT_BUTTONS = 0x08 # Byte 5 with nothing pressed: hat centered
+
+
+def read_stats(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(1)
+    sock.connect(path)
+    data = b''
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    sock.close()
+    return json.loads(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP input loopback test against the bridge")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--rate', type=float, default=1000, help="Packets per second")
+    parser.add_argument('--duration', type=float, default=5, help="Seconds to stream")
+    parser.add_argument('--drop', type=float, default=0, help="Fraction of packets not sent")
+    parser.add_argument('--reorder', type=float, default=0, help="Fraction of packets held back one slot")
+    parser.add_argument('--duplicate', type=float, default=0, help="Fraction of packets sent twice")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--bridge-args', default='', help="Extra arguments for the bridge")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stats_path = os.path.join(tempfile.mkdtemp(prefix='udp_client'), 'stats.sock')
+    gadget = FakeGadget()
+    cmd = [sys.executable, BRIDGE, '--gadget-fd', str(gadget.fileno()),
+           '--udp-listen', f"127.0.0.1:{args.port}", '--stats-socket', stats_path,
+           '--rumble-interval', '0', '--no-lightbar'] + shlex.split(args.bridge_args)
+    proc = subprocess.Popen(cmd, pass_fds=(gadget.fileno(),),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    sender = UdpSender(('127.0.0.1', args.port))
+
+    latency = LogHistogram()
+    pending = {} # rx value -> send time of the newest packet carrying it
+    frames = 0
+    not_neutral = 0 # 0x30 frames whose byte 5 is not NEUTRAL_LEFT_BUTTONS
+    injected = {'sent': 0, 'dropped': 0, 'reordered': 0, 'duplicated': 0}
+
+    def on_report(report):
+        nonlocal frames, not_neutral
+        frames += 1
+        if report[0] == 0x30 and report[5] != NEUTRAL_LEFT_BUTTONS:
+            not_neutral += 1
+        sent = pending.pop(decode_rx('main', report), None)
+        if sent is not None:
+            latency.record(time.monotonic_ns() - sent)
+
+    gadget.on_report = on_report
+    try:
+        # The bridge streams 0x30 from startup; wait for it to be up
+        deadline = time.monotonic() + 15
+        while not (frames and os.path.exists(stats_path)):
+            if time.monotonic() > deadline:
+                raise RuntimeError("bridge did not start")
+            select.select([gadget.host_end], [], [], 0.1)
+            gadget.drain()
+        time.sleep(0.2)
+        gadget.drain()
+        frames = 0
+
+        interval = 1 / args.rate
+        held = None # (seq, value, sent_ns) held back for reordering
+        value = 0
+        next_send = time.monotonic()
+        end = next_send + args.duration
+        while next_send < end:
+            wait = next_send - time.monotonic()
+            if wait > 0 and select.select([gadget.host_end], [], [], wait)[0]:
+                gadget.drain()
+                continue
+            next_send += interval
+
+            value = 1 + value % 250
+            seq = (sender.seq + 1) & 0xFFFFFFFF
+            sender.seq = seq
+            sent_ns = time.monotonic_ns()
+            if rng.random() < args.drop:
+                injected['dropped'] += 1
+            elif held is None and rng.random() < args.reorder:
+                held = (seq, value, sent_ns)
+                injected['reordered'] += 1
+                continue
+            else:
+                pending[value] = sent_ns
+                sender.send(rx=value - 128, seq=seq, sent_ns=sent_ns)
+                injected['sent'] += 1
+                if rng.random() < args.duplicate:
+                    sender.send(rx=value - 128, seq=seq, sent_ns=sent_ns)
+                    injected['duplicated'] += 1
+                if held is not None:
+                    # Arrives after a newer packet: the bridge must drop it
+                    sender.send(rx=held[1] - 128, seq=held[0], sent_ns=held[2])
+                    held = None
+        if held is not None:
+            sender.send(rx=held[1] - 128, seq=held[0], sent_ns=held[2])
+
+        # Reports still in flight
+        settle = time.monotonic() + 0.1
+        while time.monotonic() < settle:
+            select.select([gadget.host_end], [], [], settle - time.monotonic())
+            gadget.drain()
+        udp = read_stats(stats_path).get('udp', {})
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        sender.close()
+        gadget.close()
+        try:
+            os.unlink(stats_path)
+        except OSError:
+            pass
+        os.rmdir(os.path.dirname(stats_path))
+
+    result = {'injected': injected, 'frames': frames, 'not_neutral': not_neutral, 'latency': latency.summary(), 'bridge': udp}
+    if args.json:
+        print(json.dumps(result, indent=1))
+    else:
+        lat = result['latency']
+        print(f"sent {injected['sent']} (+{injected['duplicated']} duplicates), dropped {injected['dropped']}, "
+              f"sent late {injected['reordered']}; {frames} frames out")
+        if not_neutral:
+            print(f"{not_neutral} frames with buttons or hat set in byte 5 (expected 0x{NEUTRAL_LEFT_BUTTONS:02x})")
+        print(f"send -> 0x30  p50 {lat['p50_us'] / 1000:7.3f} ms p99 {lat['p99_us'] / 1000:7.3f} ms "
+              f"max {lat['max_us'] / 1000:7.3f} ms ({lat['count']} packets seen in a report)")
+        counters = ('received', 'applied', 'superseded', 'reordered', 'stale', 'lost', 'malformed')
+        print("bridge: " + ", ".join(f"{name} {udp.get(name)}" for name in counters))
+        transit = udp.get('transit', {})
+        if transit.get('count'):
+            print(f"transit       p50 {transit['p50_us'] / 1000:7.3f} ms p99 {transit['p99_us'] / 1000:7.3f} ms")
+    # Every reordered or duplicated packet must have been refused, and
+    # nothing may read as pressed (a zero hat is D-pad up, not centered)
+    late = injected['reordered'] + injected['duplicated']
+    sys.exit(0 if udp.get('reordered') == late and not not_neutral else 1)
+
+
+if __name__ == "__main__":
+    main()
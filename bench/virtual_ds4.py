@@ -0,0 +1,107 @@
+import time
+
+from evdev import ecodes, AbsInfo, UInput
+
+# Virtual DualShock 4 on uinput: the same three nodes hid-sony/hid-playstation
+# create (main, motion sensors, touchpad), with matching names and ids so the
+# bridges' device discovery picks them up.
+DS4_VENDOR = 0x054c
+DS4_PRODUCT = 0x09cc
+DS4_NAME = "Sony Interactive Entertainment Wireless Controller"
+
+# Motion resolution as reported by the kernel driver
+ACCEL_RES_PER_G = 8192
+GYRO_RES_PER_DEG_S = 1024
+
+MAIN_BUTTONS = [
+    ecodes.BTN_SOUTH, ecodes.BTN_EAST, ecodes.BTN_NORTH, ecodes.BTN_WEST,
+    ecodes.BTN_TL, ecodes.BTN_TR, ecodes.BTN_TL2, ecodes.BTN_TR2,
+    ecodes.BTN_SELECT, ecodes.BTN_START, ecodes.BTN_MODE,
+    ecodes.BTN_THUMBL, ecodes.BTN_THUMBR,
+]
+
+STICK = AbsInfo(value=128, min=0, max=255, fuzz=0, flat=0, resolution=0)
+TRIGGER = AbsInfo(value=0, min=0, max=255, fuzz=0, flat=0, resolution=0)
+HAT = AbsInfo(value=0, min=-1, max=1, fuzz=0, flat=0, resolution=0)
+ACCEL = AbsInfo(value=0, min=-32768, max=32768, fuzz=16, flat=0, resolution=ACCEL_RES_PER_G)
+GYRO = AbsInfo(value=0, min=-2097152, max=2097152, fuzz=16, flat=0, resolution=GYRO_RES_PER_DEG_S)
+
+
+def main_capabilities():
+    return {
+        ecodes.EV_KEY: MAIN_BUTTONS,
+        ecodes.EV_ABS: [
+            (ecodes.ABS_X, STICK), (ecodes.ABS_Y, STICK),
+            (ecodes.ABS_RX, STICK), (ecodes.ABS_RY, STICK),
+            (ecodes.ABS_Z, TRIGGER), (ecodes.ABS_RZ, TRIGGER),
+            (ecodes.ABS_HAT0X, HAT), (ecodes.ABS_HAT0Y, HAT),
+        ],
+    }
+
+
+def motion_capabilities():
+    return {
+        ecodes.EV_ABS: [
+            (ecodes.ABS_X, ACCEL), (ecodes.ABS_Y, ACCEL), (ecodes.ABS_Z, ACCEL),
+            (ecodes.ABS_RX, GYRO), (ecodes.ABS_RY, GYRO), (ecodes.ABS_RZ, GYRO),
+        ],
+        ecodes.EV_MSC: [ecodes.MSC_TIMESTAMP],
+    }
+
+
+def touchpad_capabilities():
+    return {
+        ecodes.EV_KEY: [ecodes.BTN_LEFT, ecodes.BTN_TOUCH, ecodes.BTN_TOOL_FINGER],
+        ecodes.EV_ABS: [
+            (ecodes.ABS_X, AbsInfo(0, 0, 1919, 0, 0, 0)),
+            (ecodes.ABS_Y, AbsInfo(0, 0, 942, 0, 0, 0)),
+            (ecodes.ABS_MT_SLOT, AbsInfo(0, 0, 1, 0, 0, 0)),
+            (ecodes.ABS_MT_TRACKING_ID, AbsInfo(0, 0, 65535, 0, 0, 0)),
+            (ecodes.ABS_MT_POSITION_X, AbsInfo(0, 0, 1919, 0, 0, 0)),
+            (ecodes.ABS_MT_POSITION_Y, AbsInfo(0, 0, 942, 0, 0, 0)),
+        ],
+    }
+
+
+class VirtualDS4:
+    def __init__(self, name=DS4_NAME, settle=0.5, index=0):
+        # index keeps several virtual pads apart: the bridges group nodes
+        # into controllers by their phys prefix
+        ids = dict(vendor=DS4_VENDOR, product=DS4_PRODUCT, version=0x8111, bustype=ecodes.BUS_USB)
+        phys = f"virtual-ds4-{index}"
+        self.main = UInput(main_capabilities(), name=name, phys=phys + "/input0", **ids)
+        self.motion = UInput(motion_capabilities(), name=name + " Motion Sensors", phys=phys + "/input1",
+                             input_props=[ecodes.INPUT_PROP_ACCELEROMETER], **ids)
+        self.touchpad = UInput(touchpad_capabilities(), name=name + " Touchpad", phys=phys + "/input2",
+                               input_props=[ecodes.INPUT_PROP_POINTER, ecodes.INPUT_PROP_BUTTONPAD], **ids)
+        self.motion_clock = 0
+        # Give udev time to create the nodes and fix permissions
+        time.sleep(settle)
+
+    def button(self, code, pressed):
+        self.main.write(ecodes.EV_KEY, code, 1 if pressed else 0)
+        self.main.syn()
+
+    def sticks(self, **axes):
+        # sticks(ABS_X=10, ABS_Y=200)
+        for name, value in axes.items():
+            self.main.write(ecodes.EV_ABS, ecodes.ecodes[name], value)
+        self.main.syn()
+
+    def motion_sample(self, accel, gyro, interval_us=1000):
+        # accel in g, gyro in deg/s (kernel units after resolution scaling)
+        self.motion_clock = (self.motion_clock + interval_us) & 0xFFFFFFFF
+        write = self.motion.write
+        write(ecodes.EV_ABS, ecodes.ABS_X, int(accel[0] * ACCEL_RES_PER_G))
+        write(ecodes.EV_ABS, ecodes.ABS_Y, int(accel[1] * ACCEL_RES_PER_G))
+        write(ecodes.EV_ABS, ecodes.ABS_Z, int(accel[2] * ACCEL_RES_PER_G))
+        write(ecodes.EV_ABS, ecodes.ABS_RX, int(gyro[0] * GYRO_RES_PER_DEG_S))
+        write(ecodes.EV_ABS, ecodes.ABS_RY, int(gyro[1] * GYRO_RES_PER_DEG_S))
+        write(ecodes.EV_ABS, ecodes.ABS_RZ, int(gyro[2] * GYRO_RES_PER_DEG_S))
+        write(ecodes.EV_MSC, ecodes.MSC_TIMESTAMP, self.motion_clock)
+        self.motion.syn()
+
+    def close(self):
+        self.main.close()
+        self.motion.close()
+        self.touchpad.close()
@@ -4,88 +4,337 @@ import struct
 import time
 import sys
 import os
+import errno
 import select
 import binascii
+import argparse
+import threading
+from collections import deque
+
+from scheduler import TickScheduler, TICK_PERIODS_MS
+from report_encoder import ReportEncoder
+from recorder import Recorder, REC_MOTION, REC_TOUCHPAD
+from stats import LatencyStats, StatsServer, write_stats_file, use_monotonic_timestamps
+from motion import MotionRing, MotionTimestamp, MotionCalibration, REST_IMU
+from spi_flash import SpiFlash
+from hotplug import InputWatcher
+from sticks import StickTable, load_stick_profile
+from macro import MacroEngine, HAT_MASK, parse_macro, parse_turbo
+from realtime import Realtime, DEFAULT_PRIORITY
+from rumble import RumbleForwarder, RUMBLE_MIN_INTERVAL_MS
+from leds import Lightbar
+from mouse_gyro import MouseGyro, open_mouse, load_mouse_profile
+from udp_input import UdpInput, parse_address, DEFAULT_PORT, SESSION_TIMEOUT_MS, NEUTRAL_STICK
+from hidraw_ds4 import (HIDRAW_DIR, DS4_REPORT, REPORT_OFFSETS, REPORT_MAX, BUTTONS0, BUTTONS1, BUTTONS2,
+                        SensorClock, list_hidraw, open_hidraw_ds4, sysfs_is_ds4)
+from profiles import DS4, classify_node, profile_for
+from input_map import (KIND_BUTTON, KIND_AXIS, KIND_HAT, KIND_TRIGGER, DS4_AXES,
+                       AXIS_LX, AXIS_LY, AXIS_RX, AXIS_RY, HAT_CENTER, map_hat)
 
 # Constants
 GADGET_PATH = "/dev/hidg0"
 
-# Pro Controller Button Map (Bitmask for Report ID 0x30)
-# Byte 0 (Buttons)
-BTN_Y       = 0x01
-BTN_B       = 0x02
-BTN_A       = 0x04
-BTN_X       = 0x08
-BTN_L       = 0x10
-BTN_R       = 0x20
-BTN_ZL      = 0x40
-BTN_ZR      = 0x80
-
-# Byte 1 (Buttons)
-BTN_MINUS   = 0x01
-BTN_PLUS    = 0x02
-BTN_LCLICK  = 0x04
-BTN_RCLICK  = 0x08
-BTN_HOME    = 0x10
-BTN_CAPTURE = 0x20
-
-# Byte 2 (Hat)
-HAT_TOP          = 0x00
-HAT_TOP_RIGHT    = 0x01
-HAT_RIGHT        = 0x02
-HAT_BOTTOM_RIGHT = 0x03
-HAT_BOTTOM       = 0x04
-HAT_BOTTOM_LEFT  = 0x05
-HAT_LEFT         = 0x06
-HAT_TOP_LEFT     = 0x07
-HAT_CENTER       = 0x08
-
-# SPI Response Data (Hardcoded Calibration/ID)
+# Output modes
+# tick:   0x30 on every scheduler tick (classic keepalive stream)
+# change: 0x30 as soon as a SYN_REPORT changed the state (rate limited by
+#         min_gap), plus a keepalive when nothing was sent for a full period
+OUTPUT_MODES = ('tick', 'change')
+
+# Input backends
+# evdev:  the kernel's gamepad, motion and touchpad event nodes
+# hidraw: whole DS4 HID reports from /dev/hidrawN (see hidraw_ds4.py)
+INPUT_BACKENDS = ('evdev', 'hidraw')
+
+# USB host link states
+# detached:    host gone (ESHUTDOWN/EPIPE on write). No 0x30 stream; one
+#              probe report every HOST_PROBE_MS finds out when it is back.
+# handshaking: host is there and talking 0x80 commands; 0x30 keeps flowing
+# streaming:   host started the input stream (0x80 0x04) or sends subcommands
+LINK_DETACHED = 'detached'
+LINK_HANDSHAKING = 'handshaking'
+LINK_STREAMING = 'streaming'
+HOST_PROBE_MS = 500
+
+# SPI Flash Data (Hardcoded Calibration/ID), overlaid on the virtual flash image
 # Derived from NXIC / mzyy94
 SPI_CALIB_DATA = {
-    b'\x00\x60': bytes.fromhex('ffffffffffffffffffffffffffffffff'), # Serial
-    b'\x50\x60': bytes.fromhex('bc1142 75a928 ffffff ffffff ff'), # Color (Splatoon 2 Neon Green/Pink)
-    b'\x80\x60': bytes.fromhex('50fd0000c60f0f30619630f3d41454411554c7799c333663'), # Factory Sensor/Stick
-    b'\x98\x60': bytes.fromhex('0f30619630f3d41454411554c7799c333663'), # Factory Stick 2
-    b'\x3d\x60': bytes.fromhex('ba156211b87f29065bffe77e0e36569e8560ff323232ffffff'), # Factory Config 2
-    b'\x10\x80': bytes.fromhex('ffffffffffffffffffffffffffffffffffffffffffffb2a1'), # User Stick Calib
-    b'\x28\x80': bytes.fromhex('beff3e00f001004000400040fefffeff0800e73be73be73b'), # User 6-Axis Calib
+    0x6000: bytes.fromhex('ffffffffffffffffffffffffffffffff'), # Serial
+    0x6050: bytes.fromhex('bc1142 75a928 ffffff ffffff ff'), # Color (Splatoon 2 Neon Green/Pink)
+    0x6080: bytes.fromhex('50fd0000c60f0f30619630f3d41454411554c7799c333663'), # Factory Sensor/Stick
+    0x6098: bytes.fromhex('0f30619630f3d41454411554c7799c333663'), # Factory Stick 2
+    0x603d: bytes.fromhex('ba156211b87f29065bffe77e0e36569e8560ff323232ffffff'), # Factory Config 2
+    0x8010: bytes.fromhex('ffffffffffffffffffffffffffffffffffffffffffffb2a1'), # User Stick Calib
+    0x8028: bytes.fromhex('beff3e00f001004000400040fefffeff0800e73be73be73b'), # User 6-Axis Calib
 }
 
+# Longest SPI read that fits a 0x21 reply (64 - 15 header - 5 addr/len)
+SPI_READ_MAX = 44
+
 MAC_ADDR = "D4F0578D7423" # Dummy MAC
 
-def map_hat(x, y):
-    if x == 0 and y == -1: return HAT_TOP
-    if x == 1 and y == -1: return HAT_TOP_RIGHT
-    if x == 1 and y == 0:  return HAT_RIGHT
-    if x == 1 and y == 1:  return HAT_BOTTOM_RIGHT
-    if x == 0 and y == 1:  return HAT_BOTTOM
-    if x == -1 and y == 1: return HAT_BOTTOM_LEFT
-    if x == -1 and y == 0: return HAT_LEFT
-    if x == -1 and y == -1: return HAT_TOP_LEFT
-    return HAT_CENTER
+# Evdev nodes of one controller (attribute names on the bridge); which of
+# them a node is comes from its profile (see profiles.py)
+NODE_SLOTS = ('ds4', 'motion', 'touchpad')
+
+def device_key(dev):
+    # hid-sony/hid-playstation nodes of one controller share uniq (the MAC)
+    # and the phys prefix (".../input0", ".../input1", ...)
+    return dev.uniq or dev.phys.rsplit('/', 1)[0]
+
+def open_controller_node(path):
+    # -> (slot, InputDevice) for a node of a supported controller; anything
+    # else is closed again
+    try:
+        dev = evdev.InputDevice(path)
+    except OSError:
+        return None # Gone already, or udev has not fixed permissions yet (IN_ATTRIB follows)
+    try:
+        found = classify_node(dev)
+    except OSError:
+        found = None
+    if found is None:
+        dev.close()
+        return None
+    return found[0], dev
+
+
+class DeviceRouter:
+    # Hotplug for one or more bridges on one scheduler. A new DS4 node goes
+    # to the bridge already serving that controller (same device_key), else
+    # to the first bridge with nothing attached; unused nodes are closed.
+    #
+    # hidraw: the DS4's calibration feature report is a blocking ioctl, so
+    # it is read on a thread and the node only attached once it is in; the
+    # loop keeps ticking meanwhile. A DS4 whose hidraw node cannot be opened
+    # at startup, or takes no feature reports, switches every bridge to the
+    # evdev backend instead of leaving the pad unattached.
+
+    def __init__(self, bridges, scheduler, backend='evdev'):
+        self.bridges = bridges
+        self.scheduler = scheduler
+        self.pending = {} # hidraw path -> node whose calibration is being read
+        self.calibrated = deque() # (path, node, OSError or None) from the threads
+        self.wake_r, self.wake_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        scheduler.register(self.wake_r, self.on_calibrated)
+        self.watch(backend)
+
+    def watch(self, backend):
+        self.backend = backend
+        if backend == 'hidraw':
+            self.open_node = open_hidraw_ds4
+            self.watcher = InputWatcher(HIDRAW_DIR, 'hidraw')
+            paths = list_hidraw()
+        else:
+            self.open_node = open_controller_node
+            self.watcher = InputWatcher()
+            paths = evdev.list_devices()
+        self.scheduler.register(self.watcher.fileno(), self.on_hotplug)
+        for path in paths:
+            self.attach(path)
+            if backend == 'hidraw' and path not in self.pending and sysfs_is_ds4(path):
+                # Not a permissions race (that is what IN_ATTRIB covers on
+                # hotplug): this DS4 is present and its node is unusable
+                print(f"{path}: cannot open, using the evdev backend")
+                self.use_evdev()
+                return
+
+    def use_evdev(self):
+        self.scheduler.unregister(self.watcher.fileno())
+        self.watcher.close()
+        self.pending.clear() # Nodes still being read are closed when their thread reports
+        for bridge in self.bridges:
+            if bridge.ds4 is not None:
+                bridge.detach_device('ds4')
+            bridge.input_backend = 'evdev'
+        self.watch('evdev')
+
+    def on_hotplug(self, fd, mask):
+        for added, path in self.watcher.read():
+            if added:
+                self.attach(path)
+                continue
+            self.pending.pop(path, None)
+            for bridge in self.bridges:
+                slot = bridge.owns(path)
+                if slot:
+                    bridge.detach_device(slot)
+
+    def attach(self, path):
+        if path in self.pending:
+            return
+        for bridge in self.bridges:
+            if bridge.owns(path):
+                return # IN_ATTRIB after IN_CREATE
+        node = self.open_node(path)
+        if node is None:
+            return
+        slot, dev = node
+        if self.backend == 'hidraw':
+            self.pending[path] = dev
+            threading.Thread(target=self.read_calibration, args=(path, dev),
+                             name='calibration', daemon=True).start()
+            return
+        self.assign(slot, dev)
+
+    def read_calibration(self, path, dev):
+        # Calibration thread: hand the result to the loop through the pipe
+        try:
+            dev.read_calibration()
+            error = None
+        except OSError as e:
+            error = e
+        self.calibrated.append((path, dev, error))
+        try:
+            os.write(self.wake_w, b'\0')
+        except OSError:
+            pass # Router closed, or the pipe is full and a wakeup is pending anyway
+
+    def on_calibrated(self, fd, mask):
+        try:
+            os.read(fd, 4096)
+        except BlockingIOError:
+            pass
+        while self.calibrated:
+            path, dev, error = self.calibrated.popleft()
+            if self.pending.get(path) is not dev:
+                dev.close() # Removed, or replaced by evdev, while being read
+                continue
+            del self.pending[path]
+            if error is None:
+                self.assign('ds4', dev)
+                continue
+            dev.close()
+            if error.errno == errno.ENODEV:
+                continue # Unplugged mid-read; the removal event follows
+            print(f"{path}: no calibration report ({error.strerror}), using the evdev backend")
+            self.use_evdev()
+
+    def assign(self, slot, dev):
+        bridge = self.pick(slot, dev)
+        if bridge is None:
+            dev.close()
+            return
+        bridge.attach_device(slot, dev)
+
+    def pick(self, slot, dev):
+        key = device_key(dev)
+        for bridge in self.bridges:
+            if getattr(bridge, slot) is not None:
+                continue
+            for other in NODE_SLOTS:
+                node = getattr(bridge, other)
+                if node is not None and device_key(node) == key:
+                    return bridge
+        for bridge in self.bridges:
+            if all(getattr(bridge, other) is None for other in NODE_SLOTS):
+                return bridge
+        return None
+
+    def close(self):
+        self.watcher.close()
+        self.scheduler.unregister(self.wake_r)
+        os.close(self.wake_r)
+        os.close(self.wake_w)
+
 
 class ProControllerBridge:
-    def __init__(self, gadget_path):
+    def __init__(self, gadget_path, period_ms=15, stats_interval=0, output_mode='tick', min_gap_ms=4,
+                 stats_socket=None, stats_file=None, record_path=None, motion_profile=None,
+                 spi_dump=None, stick_profile=None, macro=None, realtime=None, realtime_baseline=0,
+                 rumble_interval_ms=RUMBLE_MIN_INTERVAL_MS, lightbar=True, input_backend='evdev',
+                 udp=None, mouse=None):
         self.gadget_path = gadget_path
         self.gadget_fd = -1
-        self.packet_counter = 0
+        self.period_ms = period_ms
+        self.output_mode = output_mode
+        self.min_gap_ns = int(min_gap_ms * 1000000)
+        self.last_send = 0
+        self.send_pending = False
+        # Output queue: replies (report id, build()) go out first, FIFO;
+        # at most one 0x30 is pending and it is built when written
+        self.replies = deque()
+        self.frame_pending = False
+        self.output_blocked = False # Waiting for EPOLLOUT after EAGAIN
+        self.link = LINK_HANDSHAKING
+        self.next_probe = 0
+        self.host_back_at = 0 # Host returned, first streamed 0x30 not written yet
+        self.stats_interval = stats_interval # Seconds between jitter prints (0 = exit only)
+        self.stats_socket = stats_socket
+        self.stats_file = stats_file
+        self.stats = LatencyStats()
+        self.stats_server = None
+        self.recorder = Recorder(record_path) if record_path else None
+        self.next_flush = 0
+        # Realtime mode (see realtime.py). With a baseline the loop first runs
+        # that many seconds normally, so the tick lateness before and after
+        # applying it can be compared.
+        self.realtime = realtime
+        self.realtime_baseline = realtime_baseline
+        self.realtime_at = 0
+        self.baseline_summary = None
+        self.scheduler = None
+        self.ds4 = None
+        self.motion = None
+        self.touchpad = None
+        self.input_backend = input_backend
+        self.motion_profile = motion_profile
+        self.router = None
+        self.detached_at = 0 # When the DS4 main node went away (reconnect metric)
+        self.encoder = ReportEncoder()
+        self.flash = SpiFlash(spi_dump, SPI_CALIB_DATA)
+        # HD rumble -> DS4 force feedback, uploaded off the loop (0 = ignore rumble)
+        self.rumble = RumbleForwarder(rumble_interval_ms) if rumble_interval_ms else None
+        # Player lights -> lightbar color, written off the loop
+        self.lightbar = Lightbar() if lightbar else None
         self.mac_bytes = bytes.fromhex(MAC_ADDR)[::-1] # Little Endian for some fields, Big for others? NXIC uses standard.
+        self.set_stick_profile(stick_profile)
+        # Controller state from the network, merged with the DS4 (see udp_input.py)
+        self.udp = udp
+        # Mouse as gyro, mixed into every 0x30 (see mouse_gyro.py)
+        self.mouse = mouse
+        # Macro/turbo overlay, advanced per written 0x30 (see macro.py)
+        self.macro = macro if macro is not None else MacroEngine()
         
-        # State
-        self.btns = 0
+        # State (hat lives in bits 16-19, 0 there would be D-pad up)
+        self.btns = HAT_CENTER << 16
         self.hat = HAT_CENTER
-        self.lx = 0x800 # 12-bit Center (0-4095) => 2048
-        self.ly = 0x800
-        self.rx = 0x800
-        self.ry = 0x800
+        self.hat_xy = [0, 0]
+        self.axes = self.stick_centers() # LX LY RX RY, raw evdev 0-255 (shaped at commit)
+        self.syn_dropped = set() # Slots ('ds4', 'touchpad') waiting for a resync
+
+        # Motion: raw sample being assembled, committed to the ring on SYN_REPORT
+        self.acc = [0, 0, 0]
+        self.gyro = [0, 0, 0]
+        self.motion_ring = MotionRing()
+        self.motion_clock = MotionTimestamp()
+        self.motion_raw_ts = None # MSC_TIMESTAMP of the current packet
+        self.imu_out = [0] * 18
+        self.calibration = MotionCalibration()
+        self.sensor_clock = SensorClock() # hidraw backend: report sensor timestamps
+
+        # Latency tracking (CLOCK_MONOTONIC ns)
+        # clock() is replaced by replay.py to run on the recording's timeline
+        self.clock = time.monotonic_ns
+        # clock_offset converts event timestamps if the device stays on CLOCK_REALTIME
+        self.clock_offset = 0
+        self.read_ts = 0
+        self.packet_ts = 0 # First mapped event of the current evdev packet
+        self.packet_read_ts = 0
+        self.input_ts = 0 # Oldest committed change not yet written
+        self.input_read_ts = 0
         
-        # Safe Button Access
-        self.BTN_SHARE = getattr(evdev.ecodes, 'BTN_SHARE', getattr(evdev.ecodes, 'BTN_SELECT', 314))
-        self.BTN_OPTIONS = getattr(evdev.ecodes, 'BTN_OPTIONS', getattr(evdev.ecodes, 'BTN_START', 315))
-        self.BTN_MODE = getattr(evdev.ecodes, 'BTN_MODE', 316)
+        # Axes stay raw here: inversion (Switch Y axis points up), scaling to
+        # 12 bit and shaping are all baked into the stick tables
+        # (absinfo ranges other than 0-255 are rescaled by the input map).
+        # Both maps are recompiled from the profile of each attached controller.
+        self.axis_transform = lambda invert: (lambda v: v)
+        self.profile = DS4
+        self.input_map = DS4.input_map(self.axis_transform)
+        self.touchpad_map = DS4.touchpad_map(self.axis_transform)
 
     def open_gadget(self):
+        if self.gadget_fd >= 0:
+            return # Inherited fd (--gadget-fd)
         try:
             self.gadget_fd = os.open(self.gadget_path, os.O_RDWR | os.O_NONBLOCK)
             print(f"Opened {self.gadget_path}")
@@ -94,124 +343,216 @@ class ProControllerBridge:
             sys.exit(1)
 
     def send_report(self, report):
+        # Returns True if the report was written, False if it was dropped.
+        # BlockingIOError propagates so the caller can keep the report queued.
         try:
             os.write(self.gadget_fd, report)
         except BlockingIOError:
-            pass
+            raise
         except Exception as e:
              if isinstance(e, OSError) and e.errno in [108, 32]: # Disconnected
-                 pass
+                 self.stats.dropped_disconnected += 1
+                 self.set_link(LINK_DETACHED)
              else:
+                 self.stats.write_errors += 1
                  print(f"Write Error: {e}")
+             return False
+        self.stats.writes += 1
+        if self.recorder:
+            self.recorder.gadget_in(report)
+        return True
+
+    def queue_reply(self, report_id, build):
+        # build() returns the report; it runs when the reply is actually written
+        self.replies.append((report_id, build))
+        if not self.output_blocked:
+            self.flush_output()
+
+    def flush_output(self):
+        # Write what is pending, replies first. On EAGAIN everything stays
+        # queued and the gadget fd is polled for EPOLLOUT.
+        replies = self.replies
+        while replies or self.frame_pending:
+            if replies:
+                report_id, build = replies[0]
+                report = build()
+            else:
+                report_id = 0x30
+                report = self.create_input_report_0x30()
+            built = self.clock()
+            try:
+                written = self.send_report(report)
+            except BlockingIOError:
+                self.stats.deferred_eagain += 1
+                if not self.output_blocked:
+                    self.output_blocked = True
+                    self.scheduler.modify(self.gadget_fd, select.EPOLLIN | select.EPOLLOUT)
+                return
+            if self.link == LINK_DETACHED:
+                return # set_link() dropped the queue
+
+            if report_id != 0x30:
+                replies.popleft()
+                if report_id != 0x21 or not self.frame_pending:
+                    continue
+                # A 0x21 carries the current input state too: it takes the
+                # slot of the pending 0x30
+                self.stats.replaced += 1
+            self.frame_pending = False
+            if written and report_id == 0x30 and self.macro.active and self.macro.frame_written():
+                # Next macro/turbo frame: goes into the next 0x30 (in change
+                # mode as soon as min_gap allows)
+                if self.commit_state() and self.output_mode == 'change' and not self.send_pending:
+                    self.send_pending = True
+                    self.scheduler.set_alarm(self.last_send + self.min_gap_ns, self.on_send_alarm)
+            if self.host_back_at and self.link == LINK_STREAMING:
+                self.stats.host_reconnect.record(self.clock() - self.host_back_at)
+                self.host_back_at = 0
+            if self.input_ts:
+                if written:
+                    self.stats.record_input(self.input_ts, self.input_read_ts, built, self.clock())
+                self.input_ts = 0
 
     def create_input_report_0x30(self):
-        # 0x30 Input Report Structure (Standard)
-        # Byte 0: 0x30 (ID)
-        # Byte 1: Timer (Counter)
-        # Byte 2: Battery/Connection (0x91 = Charging/USB?) NXIC uses 00 80 00... initial_input='81008000...'
-        # Let's match NXIC initial_input header: 81 00 80 00 ... ?
-        # NXIC 'buf' sent to response(0x30...):
-        # response() adds [0x30, counter].
-        # buf starts with 00 00 ...
-        # NXIC initial_input = '81008000f8d77a22c87b0c' -> 11 bytes.
-        # But 'buf' in input_response starts with buf[2]=0x00...
-        
-        # Re-reading NXIC:
-        # initial_input = '81 00 80 00 f8 d7 7a 22 c8 7b 0c'
-        # response(0x30, counter, buf) -> buffer becomes [0x30, counter] + buf
-        # Payload:
-        # 0x30
-        # Counter
-        # 81 (Byte 0 of buf) -> Battery/Conn?
-        # 00 (Byte 1) -> Buttons Low? -> NXIC modifies buf[1] for keys.
-        # 80 (Byte 2) -> Buttons High? -> NXIC modifies buf[2] for Home/Plus.
-        # 00 (Byte 3) -> Sticks/Hat? -> NXIC modifies buf[3] for Sticks/Hat.
-        # ...
-        
-        self.packet_counter = (self.packet_counter + 1) & 0xFF
-        
-        # Buttons
-        b0 = self.btns & 0xFF
-        b1 = (self.btns >> 8) & 0xFF
-        b2 = (self.btns >> 16) & 0xFF # Hat + Sticks shared?
-        
-        # NXIC Logic Mapping:
-        # buf[1] (Buttons Low): Y=01, X=02, B=04, A=08, R=40, ZR=80
-        # buf[2] (Buttons Mid): Minus=01, Plus=02, LClick=08, Home=10, Capture=20
-        # buf[3] (Buttons High/Stick/Hat): DDown=01, DUp=02, DRight=04, DLeft=08, L=40, ZL=80
-        # Stick encoding is 12-bit packed into bytes 4-9.
-        
-        # Re-pack correctly based on my BTN constants (which match NXIC roughly)
-        # My constants: Y=01, B=02, A=04, X=08... differ slightly from NXIC?
-        # NXIC: L='A' key -> buf[1] |= 0x08. So A is 0x08.
-        # Standard Pro Con:
-        # Byte 2 (0-based from 0x30, so Byte 0 of data): Y(01), B(02), A(04), X(08), L(10), R(20), ZL(40), ZR(80)
-        # Byte 3: Minus(01), Plus(02), L3(04), R3(08), Home(10), Cap(20)
-        # Byte 4: Stick data starts...
-        
-        # Let's use Standard Pro Controller Layout used by NintendoSwitchControlLibrary:
-        # 0x30, Counter, Battery(0x81), 
-        # Buttons[0] (Y B A X L R ZL ZR)
-        # Buttons[1] (Min Pls L3 R3 Hom Cap)
-        # Buttons[2] (Hat? Stick?)
-        
-        # Stick Data (12-bit):
-        # Byte 0: LX (Low 8)
-        # Byte 1: LX (High 4) | LY (Low 4)
-        # Byte 2: LY (High 8)
-        # Byte 3: RX (Low 8) ...
-        
-        # Build Packet
-        msg = bytearray(64)
-        msg[0] = 0x30
-        msg[1] = self.packet_counter
-        msg[2] = 0x81 # Battery High/USB
-        
-        # Buttons
-        msg[3] = self.btns & 0xFF
-        msg[4] = (self.btns >> 8) & 0xFF
-        msg[5] = (self.btns >> 16) & 0xFF # Hat usually here
-        
-        # Hat (Nibble 0? or Byte 5?)
-        # Standard: Byte 5 is "Wired/Vendor" + Hat?
-        # NXIC uses logic:
-        # stick_l_flg = lh | (lv << 12) ...
-        # buf[4], buf[5], buf[6] ...
-        # This matches 12-bit packing.
-        
-        # 12-bit packing
-        # LX (12), LY (12), RX (12), RY (12)
-        # Bytes needed: 1.5 * 4 = 6 bytes.
-        
-        l_packed = self.lx | (self.ly << 12)
-        r_packed = self.rx | (self.ry << 12)
-        
-        msg[6] = l_packed & 0xFF
-        msg[7] = (l_packed >> 8) & 0xFF
-        msg[8] = (l_packed >> 16) & 0xFF
-        
-        msg[9] = r_packed & 0xFF
-        msg[10] = (r_packed >> 8) & 0xFF
-        msg[11] = (r_packed >> 16) & 0xFF
-        
-        # 6-Axis Data (Bytes 12-47)
-        # Fill with Center values (00 80 usually? or signed 0?)
-        # Pro Con 6-axis is 16-bit signed. 
-        # 0 is still, but gravity applies.
-        # Just leave as 0 for now (flat).
-        
-        return msg
+        # Layout and buffers live in ReportEncoder (shared with 0x21 replies).
+        # It holds the state committed at the last SYN_REPORT.
+        # IMU: the newest motion resampled to 3 samples 5 ms apart, plus
+        # the mouse's rotation over the same windows. With neither, a
+        # controller at rest: the last real sample must not repeat forever.
+        imu = self.imu_out
+        motion = self.motion_ring.resample(imu)
+        if motion:
+            self.calibration.apply(imu)
+        if self.mouse:
+            self.mouse.fill(imu, self.clock(), motion)
+        elif not motion:
+            return self.encoder.build_0x30(REST_IMU)
+        return self.encoder.build_0x30(imu)
+
+    def commit_state(self):
+        # Called on SYN_REPORT: the events of one evdev packet become visible
+        # to reports together. Returns True if the state changed.
+        axes = self.axes
+        btns = self.btns
+        left = (axes[AXIS_LX] << 8) | axes[AXIS_LY]
+        right = (axes[AXIS_RX] << 8) | axes[AXIS_RY]
+        udp = self.udp
+        if udp is not None and udp.active:
+            # Buttons add up; hat and sticks are the network's when not neutral
+            udp_btns = udp.btns
+            btns |= udp_btns & ~HAT_MASK
+            if udp_btns & HAT_MASK != HAT_CENTER << 16:
+                btns = (btns & ~HAT_MASK) | (udp_btns & HAT_MASK)
+            if udp.left != NEUTRAL_STICK:
+                left = udp.left
+            if udp.right != NEUTRAL_STICK:
+                right = udp.right
+        # Axial profiles: one table per axis; radial: one 2D table
+        lut = self.left_lut
+        lstick = lut[left] if lut is not None else self.left_xs[left >> 8] | self.left_ys[left & 0xFF]
+        lut = self.right_lut
+        rstick = lut[right] if lut is not None else self.right_xs[right >> 8] | self.right_ys[right & 0xFF]
+        macro = self.macro
+        if macro.active:
+            macro.update(btns)
+            btns = (btns & macro.keep) | macro.press
+            if macro.hat >= 0:
+                btns = (btns & ~HAT_MASK) | macro.hat
+            if macro.lstick >= 0:
+                lstick = macro.lstick
+            if macro.rstick >= 0:
+                rstick = macro.rstick
+        return self.encoder.set_state(btns, lstick, rstick)
+
+    def set_stick_profile(self, path=None):
+        # Compile deadzone/curve/calibration into lookup tables (see sticks.py).
+        # Only the table references change, so this is safe between events.
+        left, right = load_stick_profile(path) if path else ({}, {})
+        invert = {target: inv for _, target, inv in DS4_AXES}
+        self.left_table = StickTable(left, invert['LX'], invert['LY'])
+        self.right_table = StickTable(right, invert['RX'], invert['RY'])
+        self.left_lut = self.left_table.table
+        self.left_xs = self.left_table.xs
+        self.left_ys = self.left_table.ys
+        self.right_lut = self.right_table.table
+        self.right_xs = self.right_table.xs
+        self.right_ys = self.right_table.ys
+
+    def stick_centers(self):
+        return [*self.left_table.center, *self.right_table.center]
+
+    def send_input_report(self, now):
+        self.send_pending = False
+        self.last_send = now
+        if self.link == LINK_DETACHED:
+            self.input_ts = 0 # Nobody to deliver to
+            return
+        if self.frame_pending:
+            self.stats.coalesced += 1
+        self.frame_pending = True
+        if not self.output_blocked:
+            self.flush_output()
+
+    def report_changed(self):
+        # change mode: send right away unless we are inside min_gap
+        now = self.clock()
+        due = self.last_send + self.min_gap_ns
+        if now >= due:
+            self.send_input_report(now)
+        elif not self.send_pending:
+            self.send_pending = True
+            self.scheduler.set_alarm(due, self.on_send_alarm)
+
+    def on_send_alarm(self, now):
+        if self.send_pending:
+            self.send_input_report(now)
+
+    def set_link(self, state):
+        if state == self.link:
+            return
+        now = self.clock()
+        if state == LINK_DETACHED:
+            # Drop everything queued for the old session and stop streaming
+            self.replies.clear()
+            self.frame_pending = False
+            self.send_pending = False
+            self.input_ts = 0
+            self.host_back_at = 0
+            self.next_probe = now + HOST_PROBE_MS * 1000000
+            if self.output_blocked:
+                self.output_blocked = False
+                self.scheduler.modify(self.gadget_fd, select.EPOLLIN)
+            if self.rumble:
+                self.rumble.stop()
+        elif self.link == LINK_DETACHED:
+            self.host_back_at = now
+        print(f"USB host: {self.link} -> {state}")
+        self.link = state
+
+    def probe_host(self, now):
+        # Detached: a single 0x30 tells whether the endpoint is enabled again
+        self.next_probe = now + HOST_PROBE_MS * 1000000
+        try:
+            if self.send_report(self.create_input_report_0x30()):
+                self.set_link(LINK_HANDSHAKING)
+        except BlockingIOError:
+            self.set_link(LINK_HANDSHAKING) # Enabled, just not read yet
 
     def handle_output_report(self, data):
         # data[0] is Report ID
         cmd = data[0]
         subcmd = data[1] if len(data) > 1 else 0
+        if self.link == LINK_DETACHED:
+            self.set_link(LINK_HANDSHAKING) # Host is back
         
         if cmd == 0x80:
             # Status Request
+            if subcmd in (0x01, 0x02, 0x03):
+                self.set_link(LINK_HANDSHAKING)
+
             if subcmd == 0x01: # Handshake 1
-                 self.send_response(0x81, 0x01, bytes.fromhex('0003')) # + MAC?
                  # NXIC: response(0x81, data[1], bytes.fromhex('0003' + mac_addr))
+                 # One reply only, like a real Pro Controller
                  payload = bytes.fromhex('0003') + bytes.fromhex(MAC_ADDR)
                  self.send_response(0x81, 0x01, payload)
                  
@@ -219,14 +560,27 @@ class ProControllerBridge:
                  self.send_response(0x81, 0x02, b'')
                  
             elif subcmd == 0x04: # Handshake 3? (Start Inputs)
-                 # Just acknowledge, keepalive loop handles 0x30 sending
-                 pass
+                 # Keepalive loop handles 0x30 sending; the first one goes
+                 # out right away instead of waiting for the next tick
+                 if self.link != LINK_STREAMING:
+                     self.set_link(LINK_STREAMING)
+                     self.send_input_report(self.clock())
                  
         elif cmd == 0x01: # Subcommand/Rumble
+             if self.link != LINK_STREAMING:
+                 self.set_link(LINK_STREAMING)
              # Rumble data is at data[2:10], Subcmd at data[10]
+             if self.rumble and len(data) >= 10:
+                 self.rumble.frame(data)
              if len(data) > 10:
                  real_subcmd = data[10]
                  self.handle_subcommand(real_subcmd, data[11:])
+
+        elif cmd == 0x10: # Rumble only
+             if self.link != LINK_STREAMING:
+                 self.set_link(LINK_STREAMING)
+             if self.rumble and len(data) >= 10:
+                 self.rumble.frame(data)
                  
     def handle_subcommand(self, subcmd, data):
         # Acknowledge Subcommand (ID 0x21)
@@ -251,21 +605,18 @@ class ProControllerBridge:
             pass # Empty reply OK
             
         elif subcmd == 0x10: # SPI Read
-            # Addr is first 2 bytes of data (Little Endian?)
-            # NXIC data[11:13] is addr
-            addr = data[0:2]
-            length = data[4] if len(data) > 4 else 0
-            
-            # Find data
-            if addr in SPI_CALIB_DATA:
-                 read_data = SPI_CALIB_DATA[addr]
-            else:
-                 read_data = b'\xFF' * length # Default FF
-                 
-            # Reply: Addr(2) + Len(2? No 00 00) + Len + Data
-            # NXIC: buf = addr + 00 00 + len + data
-            reply_data = addr + b'\x00\x00' + bytes([len(read_data)]) + read_data
-            
+            # Request: Addr (uint32 LE) + Len
+            # Reply echoes Addr + Len, followed by the flash bytes, copied
+            # into the reply buffer straight from the flash image. Len is
+            # clamped to what fits in one reply, and the echo carries the
+            # clamped value so it matches the bytes that follow.
+            if len(data) < 5:
+                return
+            addr = data[0] | (data[1] << 8) | (data[2] << 16) | (data[3] << 24)
+            length = min(data[4], SPI_READ_MAX)
+            self.send_subcmd_reply(subcmd, bytes(data[0:4]) + bytes((length,)), self.flash.read(addr, length))
+            return
+
         elif subcmd == 0x21: # NFC Config
             reply_data = bytes.fromhex('0100ff0003000501')
             
@@ -281,6 +632,8 @@ class ProControllerBridge:
             # Reply should contain Subcmd + Data.
             # If no data needed, just empty.
             reply_data = b'\x01' # 1?
+            if self.lightbar:
+                self.lightbar.set_player(data[0] if data else 0)
         
         # Send Reply (ID 0x21)
         self.send_subcmd_reply(subcmd, reply_data)
@@ -292,73 +645,20 @@ class ProControllerBridge:
         msg[1] = subcmd
         if data:
             msg[2:2+len(data)] = data
-        self.send_report(msg)
+        self.queue_reply(id, lambda: msg)
 
-    def send_subcmd_reply(self, subcmd, data):
+    def send_subcmd_reply(self, subcmd, data, more=None):
         # 0x21 Input Report + Ack
-        # 0x21, Counter, [Standard Input Report ~47 bytes?], AckCmd, Data
-        
-        msg = bytearray(64)
-        msg[0] = 0x21
-        msg[1] = self.packet_counter
+        # 0x21, Timer, Input Data (11 bytes: 81 00 ...), Ack Code, Subcmd (Echo), Data
+        # (NXIC uart_response)
         
-        # Standard Input Data (Battery, Buttons, Sticks, 6-Axis)
-        # Just use current state logic roughly
-        msg[2] = 0x81
-        msg[3] = self.btns & 0xFF
-        msg[4] = (self.btns >> 8) & 0xFF
-        msg[5] = (self.btns >> 16) & 0xFF
-        
-        l_packed = self.lx | (self.ly << 12)
-        r_packed = self.rx | (self.ry << 12)
-        msg[6] = l_packed & 0xFF
-        msg[7] = (l_packed >> 8) & 0xFF
-        msg[8] = (l_packed >> 16) & 0xFF
-        msg[9] = r_packed & 0xFF
-        msg[10] = (r_packed >> 8) & 0xFF
-        msg[11] = (r_packed >> 16) & 0xFF
-        
-        # 6-Axis (12-47) - Zeros
-        
-        # ACK Format @ Byte 13 (0-indexed? No wait)
-        # 0x21 (0)
-        # Timer (1)
-        # Bat/Btn/Sticks/6Axis (2-47) -> ~46 bytes?
-        # Ack Subcmd is usually at Byte 13 or 14?
-        # Standard: 
-        # Header (2) + Bat(1) + Btn(3) + Stick(6) + Vib(1) + 6Axis(36) = 49 bytes data?
-        # Wait, 6Axis is 36 bytes.
-        # 1+3+6 = 10 bytes basic data.
-        # Ack starts after basic data + vibration report?
-        
-        # Looking at NXIC uart_response:
-        # buf = initial_input (11 bytes: 81 00 ... sticks)
-        # buf.extend([code, subcmd]) -> code is output report ID? No.
-        # NXIC uart_response(0x21, counter, buf)
-        # buf starts with initial_input (11 bytes).
-        # buf.extend([ack_code, subcmd])
-        # buf.extend(data)
-        
-        # So structure:
-        # 0x21
-        # Counter
-        # Input Data (11 bytes: 81 00 ...)
-        # Code (Ack Result? 0x80/0x82...)
-        # Subcmd (Echo)
-        # Data
-        
-        # msg[2:13] is Input (11 bytes).
-        msg[13] = 0x80 # ACK? NXIC uses arg 'code'. Successful ack is usually 0x80 or 0x81?
-                       # NXIC calls uart_response(0x82...) for Device Info.
-                       # I should check standard.
-                       # 0x82 seems to be Device Info ACK. 0x80 is simple ACK?
-        
-        # Let's infer from subcmd logic above:
+        # Ack codes:
         # Pair -> 0x81
         # Info -> 0x82
         # Trigger -> 0x83
         # SPI -> 0x90
         # NFC -> 0xA0
+        # Others -> 0x80 (simple ACK)
         
         ack_code = 0x80
         if subcmd == 0x01: ack_code = 0x81
@@ -367,121 +667,463 @@ class ProControllerBridge:
         elif subcmd == 0x10: ack_code = 0x90
         elif subcmd == 0x21: ack_code = 0xA0
         
-        msg[13] = ack_code
-        msg[14] = subcmd
-        if data:
-            msg[15:15+len(data)] = data
-            
-        self.send_report(msg)
+        self.queue_reply(0x21, lambda: self.encoder.build_0x21(ack_code, subcmd, data, more))
 
     def run(self):
-        print("Waiting for DS4...")
-        ds4 = None
-        while ds4 is None:
-            for path in evdev.list_devices():
-                dev = evdev.InputDevice(path)
-                if "Sony" in dev.name or "Wireless Controller" in dev.name:
-                    if "Touchpad" not in dev.name:
-                        ds4 = dev
-                        print(f"Found {dev.name}")
-                        break
-            if not ds4: time.sleep(1)
-            
+        # The gadget (and with it the Switch session) comes up right away;
+        # DS4 nodes are attached and detached as they come and go.
         self.open_gadget()
-        print("Pro Controller Emulation Running...")
-        
-        while True:
-            start = time.time()
-            
-            # Read Gadget (for Handshake)
-            r, _, _ = select.select([self.gadget_fd, ds4], [], [], 0)
-            
-            if self.gadget_fd in r:
-                try:
-                    data = os.read(self.gadget_fd, 64)
-                    if data:
-                         self.handle_output_report(data)
-                except:
-                    pass
-                    
-            if ds4 in r:
-                for event in ds4.read():
-                    self.process_ds4_event(event)
-
-            # Send Keepalive (Input Report 0x30) ~60Hz
-            # Only send 0x30 if we are NOT replying to a subcommand in this frame?
-            # Actually standard is to strictly interval 0x30 approx 15ms.
-            # Replies (0x21) replace 0x30 for that frame or are sent immediately?
-            # For simplicity, just send 0x30 every loop for now.
-            # Real Pro Con sends 0x30 continuously.
-            
-            self.send_report(self.create_input_report_0x30())
-
-            # Sleep remainder
-            elapsed = time.time() - start
-            if elapsed < 0.015:
-                time.sleep(0.015 - elapsed)
-
-    def process_ds4_event(self, event):
-        if event.type == evdev.ecodes.EV_KEY:
-            val = event.value
-            if event.code == evdev.ecodes.BTN_SOUTH: # B
-                if val: self.btns |= BTN_B
-                else:   self.btns &= ~BTN_B
-            elif event.code == evdev.ecodes.BTN_EAST: # A
-                if val: self.btns |= BTN_A
-                else:   self.btns &= ~BTN_A
-            elif event.code == evdev.ecodes.BTN_NORTH: # X
-                if val: self.btns |= BTN_X
-                else:   self.btns &= ~BTN_X
-            elif event.code == evdev.ecodes.BTN_WEST: # Y
-                if val: self.btns |= BTN_Y
-                else:   self.btns &= ~BTN_Y
-            elif event.code == evdev.ecodes.BTN_TL: # L
-                if val: self.btns |= BTN_L
-                else:   self.btns &= ~BTN_L
-            elif event.code == evdev.ecodes.BTN_TR: # R
-                if val: self.btns |= BTN_R
-                else:   self.btns &= ~BTN_R
-            elif event.code == evdev.ecodes.BTN_TL2: # ZL
-                if val: self.btns |= BTN_ZL
-                else:   self.btns &= ~BTN_ZL
-            elif event.code == evdev.ecodes.BTN_TR2: # ZR
-                if val: self.btns |= BTN_ZR
-                else:   self.btns &= ~BTN_ZR
-            elif event.code == self.BTN_SHARE: # Minus
-                if val: self.btns |= (BTN_MINUS << 8)
-                else:   self.btns &= ~(BTN_MINUS << 8)
-            elif event.code == self.BTN_OPTIONS: # Plus
-                if val: self.btns |= (BTN_PLUS << 8)
-                else:   self.btns &= ~(BTN_PLUS << 8)
-            elif event.code == self.BTN_MODE: # Home
-                if val: self.btns |= (BTN_HOME << 8)
-                else:   self.btns &= ~(BTN_HOME << 8)
-            elif event.code == evdev.ecodes.BTN_THUMBL: # L3
-                if val: self.btns |= (BTN_LCLICK << 8)
-                else:   self.btns &= ~(BTN_LCLICK << 8)
-            elif event.code == evdev.ecodes.BTN_THUMBR: # R3
-                if val: self.btns |= (BTN_RCLICK << 8)
-                else:   self.btns &= ~(BTN_RCLICK << 8)
-                
-        elif event.type == evdev.ecodes.EV_ABS:
-            # Scale 0-255 -> 0-4095
-            if event.code == evdev.ecodes.ABS_X:
-                self.lx = int(event.value * 16)
-            elif event.code == evdev.ecodes.ABS_Y:
-                self.ly = int((255 - event.value) * 16) # Invert Y?
-            elif event.code == evdev.ecodes.ABS_RX:
-                self.rx = int(event.value * 16)
-            elif event.code == evdev.ecodes.ABS_RY:
-                self.ry = int((255 - event.value) * 16)
-            elif event.code == evdev.ecodes.ABS_HAT0X:
-                self.hat_x = event.value
-                self.update_hat()
-            elif event.code == evdev.ecodes.ABS_HAT0Y:
-                self.hat_y = event.value
-                self.update_hat()
+        self.setup(None)
+        print("Waiting for DS4...")
+        self.router = DeviceRouter([self], self.scheduler, self.input_backend)
+        self.serve()
+
+    def owns(self, path):
+        for slot in NODE_SLOTS:
+            dev = getattr(self, slot)
+            if dev is not None and dev.path == path:
+                return slot
+        return None
+
+    def attach_device(self, slot, dev):
+        if self.input_backend == 'hidraw':
+            self.attach_hidraw(dev)
+            return
+        setattr(self, slot, dev)
+        if not use_monotonic_timestamps(dev.fd):
+            self.clock_offset = time.time_ns() - time.monotonic_ns()
+        handler = {'ds4': self.on_ds4_readable,
+                   'motion': self.on_motion_readable,
+                   'touchpad': self.on_touchpad_readable}[slot]
+        self.scheduler.register(dev.fd, handler)
+        profile = profile_for(dev)
+        print(f"Found {dev.name} ({profile.name})")
+
+        if slot == 'motion':
+            self.calibration = MotionCalibration.from_device(dev, self.motion_profile)
+        elif slot == 'touchpad':
+            self.touchpad_map = profile.touchpad_map(self.axis_transform)
+        elif slot == 'ds4':
+            self.profile = profile
+            self.input_map = profile.input_map(self.axis_transform, dev)
+            # Siblings picked up before the main node must be from the same controller
+            for other in ('motion', 'touchpad'):
+                sibling = getattr(self, other)
+                if sibling is not None and device_key(sibling) != device_key(dev):
+                    self.detach_device(other)
+            if self.detached_at:
+                elapsed = self.clock() - self.detached_at
+                self.stats.reconnect.record(elapsed)
+                self.detached_at = 0
+                print(f"DS4 reconnected after {elapsed / 1e9:.3f} s")
+            if self.rumble:
+                self.rumble.attach(dev.path)
+            if self.lightbar:
+                self.lightbar.attach(dev.path)
+            # Pick up whatever is already held on the new device
+            self.resync_node('ds4')
+            self.process_ds4_event(evdev.InputEvent(0, 0, evdev.ecodes.EV_SYN, evdev.ecodes.SYN_REPORT, 0))
+
+    def attach_hidraw(self, dev):
+        # One node carries buttons, sticks, touchpad click and motion
+        self.ds4 = dev
+        # DeviceRouter has read the calibration (which also switches a
+        # Bluetooth DS4 to full 0x11 reports) off the loop
+        self.calibration = dev.motion_calibration(self.motion_profile)
+        self.sensor_clock = SensorClock()
+        self.scheduler.register(dev.fd, self.on_hidraw_readable)
+        print(f"Found {dev.name} ({dev.path})")
+        if self.detached_at:
+            elapsed = self.clock() - self.detached_at
+            self.stats.reconnect.record(elapsed)
+            self.detached_at = 0
+            print(f"DS4 reconnected after {elapsed / 1e9:.3f} s")
+        if self.rumble and dev.ff_path:
+            self.rumble.attach(dev.ff_path)
+        if self.lightbar:
+            self.lightbar.attach(dev.path)
+        # No resync needed: the next report (within a few ms) is the full state
+
+    def detach_device(self, slot):
+        # Node removed or read failed (Bluetooth drop). The gadget keeps
+        # streaming neutral input so the Switch session survives.
+        dev = getattr(self, slot)
+        setattr(self, slot, None)
+        self.syn_dropped.discard(slot)
+        self.scheduler.unregister(dev.fd)
+        try:
+            dev.close()
+        except OSError:
+            pass
+        print(f"Lost {dev.name}")
+        if slot == 'ds4':
+            self.detached_at = self.clock()
+            if self.rumble:
+                self.rumble.detach()
+            if self.lightbar:
+                self.lightbar.detach()
+        self.release_inputs(slot)
+
+    def release_inputs(self, slot):
+        # Nothing fed by a lost node stays held down (or turning)
+        motion_lost = slot != 'touchpad'
+        if motion_lost:
+            # Empty ring: frames carry a resting IMU batch from now on
+            self.acc = [0, 0, 0]
+            self.gyro = [0, 0, 0]
+            self.motion_raw_ts = None
+            self.motion_ring = MotionRing()
+        if slot == 'ds4':
+            self.btns = HAT_CENTER << 16
+            self.hat_xy = [0, 0]
+            self.update_hat()
+            self.axes = self.stick_centers()
+        elif slot == 'touchpad':
+            for entry in self.touchpad_map.table[evdev.ecodes.EV_KEY]:
+                if entry is not None:
+                    self.btns &= ~entry[3]
+        self.packet_ts = 0
+        # The neutral frame (a resting IMU included) goes out right away
+        if (self.commit_state() or motion_lost) and self.output_mode == 'change':
+            self.report_changed()
+
+    def setup(self, ds4, motion=None, touchpad=None, scheduler=None):
+        # Build the event loop around an open gadget fd: one epoll set, one
+        # handler per evdev node. Nodes may also be attached later (hotplug)
+        # or never, when input is injected another way (replay).
+        # Several bridges can share one scheduler (multi_bridge.py).
+        self.scheduler = scheduler or TickScheduler(self.period_ms)
+        self.scheduler.register(self.gadget_fd, self.on_gadget_readable)
+        for slot, dev in (('ds4', ds4), ('motion', motion), ('touchpad', touchpad)):
+            if dev is not None:
+                self.attach_device(slot, dev)
+        if self.stats_socket:
+            self.stats_server = StatsServer(self.stats_socket, self.stats_snapshot)
+            self.scheduler.register(self.stats_server.fileno(), self.stats_server.on_readable)
+        if self.udp:
+            self.scheduler.register(self.udp.fileno(), self.on_udp_readable)
+            print(f"UDP input on {self.udp.address[0]}:{self.udp.address[1]}")
+        if self.mouse:
+            self.scheduler.register(self.mouse.fd, self.on_mouse_readable)
+            print(f"Mouse gyro: {self.mouse.dev.name}")
+        self.next_stats = time.monotonic_ns() + self.stats_interval * 1000000000
+
+    def serve(self):
+        if self.realtime:
+            if self.realtime_baseline:
+                self.realtime_at = time.monotonic_ns() + int(self.realtime_baseline * 1000000000)
+                print(f"Measuring {self.realtime_baseline:g} s without realtime settings...")
+            else:
+                self.realtime.apply()
+        print(f"Pro Controller Emulation Running... ({self.period_ms} ms tick, {self.output_mode} mode)")
+        try:
+            self.scheduler.run(self.on_tick)
+        except KeyboardInterrupt:
+            print("Stopping...")
+        finally:
+            if self.baseline_summary:
+                print(f"before realtime: {self.baseline_summary}")
+                print(f"after realtime:  {self.scheduler.jitter_summary()}")
+            else:
+                print(self.scheduler.jitter_summary())
+            print(f"latency: {self.stats.total.summary()}, writes: {self.stats.snapshot()['writes']}")
+            if self.rumble:
+                print(f"rumble: {self.rumble.snapshot()}")
+            if self.realtime:
+                print(f"realtime: {self.realtime.snapshot()}")
+            if self.udp:
+                print(f"udp: {self.udp.snapshot()}")
+            if self.mouse:
+                print(f"mouse: {self.mouse.snapshot()}")
+            self.close()
+            self.scheduler.close()
+
+    def close(self):
+        if self.stats_server:
+            self.stats_server.close()
+        if self.router:
+            self.router.close()
+        if self.recorder:
+            self.recorder.close()
+        if self.rumble:
+            self.rumble.close()
+        if self.lightbar:
+            self.lightbar.close()
+        if self.udp:
+            self.udp.close()
+        if self.mouse:
+            self.mouse.close()
+
+    def stats_snapshot(self):
+        snapshot = self.stats.snapshot()
+        snapshot['tick'] = self.scheduler.jitter_summary()
+        snapshot['link'] = self.link
+        if self.rumble:
+            snapshot['rumble'] = self.rumble.snapshot()
+        if self.lightbar:
+            snapshot['lightbar'] = self.lightbar.snapshot()
+        if self.udp:
+            snapshot['udp'] = self.udp.snapshot()
+        if self.mouse:
+            snapshot['mouse'] = self.mouse.snapshot()
+        if self.realtime:
+            snapshot['realtime'] = self.realtime.snapshot()
+            snapshot['realtime']['baseline'] = self.baseline_summary
+        return snapshot
+
+    def on_gadget_readable(self, fd, mask):
+        if mask & select.EPOLLOUT:
+            # Host is reading again: resume queued writes
+            self.output_blocked = False
+            self.scheduler.modify(self.gadget_fd, select.EPOLLIN)
+            self.flush_output()
+            if mask == select.EPOLLOUT:
+                return
+        # Read Gadget (for Handshake)
+        try:
+            data = os.read(self.gadget_fd, 64)
+            if data:
+                 if self.recorder:
+                     self.recorder.gadget_out(data)
+                 self.handle_output_report(data)
+        except:
+            pass
+
+    def on_ds4_readable(self, fd, mask):
+        self.read_ts = self.clock()
+        recorder = self.recorder
+        try:
+            for event in self.ds4.read():
+                if recorder:
+                    recorder.evdev(event)
+                self.process_ds4_event(event)
+        except OSError:
+            self.detach_device('ds4') # ENODEV: controller dropped
+
+    def on_hidraw_readable(self, fd, mask):
+        # One read() is one whole input report
+        self.read_ts = self.clock()
+        recorder = self.recorder
+        try:
+            while True:
+                report = os.read(fd, REPORT_MAX)
+                if recorder:
+                    recorder.hidraw(report)
+                self.process_hid_report(report)
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.detach_device('ds4') # ENODEV: controller dropped
+
+    def on_udp_readable(self, fd, mask):
+        # Everything queued since the last wakeup, newest packet wins
+        read_ts = self.read_ts = self.clock()
+        if self.udp.read(read_ts) and self.commit_state():
+            if not self.input_ts:
+                self.input_ts = read_ts
+                self.input_read_ts = read_ts
+            if self.output_mode == 'change':
+                self.report_changed()
+
+    def on_mouse_readable(self, fd, mask):
+        # Only stored here; the rotation rides along with the next 0x30
+        try:
+            self.mouse.read()
+        except OSError:
+            mouse = self.mouse
+            self.mouse = None
+            self.scheduler.unregister(fd)
+            try:
+                mouse.close()
+            except OSError:
+                pass
+            print(f"Lost {mouse.dev.name}")
+            # Zero rate from now on: without motion a resting IMU batch
+            if self.output_mode == 'change':
+                self.report_changed()
+
+    def on_motion_readable(self, fd, mask):
+        recorder = self.recorder
+        try:
+            for event in self.motion.read():
+                if recorder:
+                    recorder.evdev(event, REC_MOTION)
+                self.process_motion_event(event)
+        except OSError:
+            self.detach_device('motion')
+
+    def on_touchpad_readable(self, fd, mask):
+        self.read_ts = self.clock()
+        recorder = self.recorder
+        table = self.touchpad_map.table
+        try:
+            for event in self.touchpad.read():
+                if recorder:
+                    recorder.evdev(event, REC_TOUCHPAD)
+                self.process_ds4_event(event, table, 'touchpad')
+        except OSError:
+            self.detach_device('touchpad')
+
+    def on_tick(self, now):
+        # Send Keepalive (Input Report 0x30)
+        # Real Pro Con sends 0x30 continuously.
+        # In change mode only when nothing went out during the last period.
+        # Detached: only the periodic host probe.
+        if self.link == LINK_DETACHED:
+            if now >= self.next_probe:
+                self.probe_host(now)
+        elif (self.output_mode == 'tick' or self.send_pending
+                or now - self.last_send >= self.scheduler.period_ns):
+            self.send_input_report(now)
+
+        if self.udp and self.udp.expire(now):
+            if self.commit_state() and self.output_mode == 'change':
+                self.report_changed()
+
+        if self.stats_interval and now >= self.next_stats:
+            self.next_stats = now + self.stats_interval * 1000000000
+            if self.stats_file:
+                write_stats_file(self.stats_file, self.stats_snapshot())
+            else:
+                print(self.scheduler.jitter_summary())
+
+        if self.recorder and now >= self.next_flush:
+            self.next_flush = now + 1000000000
+            self.recorder.flush()
+
+        if self.realtime:
+            if self.realtime_at and now >= self.realtime_at:
+                self.realtime_at = 0
+                self.baseline_summary = self.scheduler.jitter_summary()
+                print(f"before realtime: {self.baseline_summary}")
+                self.realtime.apply()
+                self.scheduler.reset_stats()
+            if self.realtime.applied:
+                # Baseline: the collector is still automatic, nothing to do
+                self.realtime.idle(now)
+
+    def process_motion_event(self, event):
+        # ABS_X/Y/Z = accel, ABS_RX/RY/RZ = gyro, kept raw (DS4 frame/units).
+        # A finished sample only rides along with the next 0x30; motion alone
+        # never triggers a change-mode send (the node reports at up to 1 kHz).
+        ecodes = evdev.ecodes
+        if event.type == ecodes.EV_ABS:
+            code = event.code
+            if code <= ecodes.ABS_Z:
+                self.acc[code - ecodes.ABS_X] = event.value
+            elif ecodes.ABS_RX <= code <= ecodes.ABS_RZ:
+                self.gyro[code - ecodes.ABS_RX] = event.value
+        elif event.type == ecodes.EV_MSC and event.code == ecodes.MSC_TIMESTAMP:
+            self.motion_raw_ts = event.value
+        elif event.type == ecodes.EV_SYN and event.code == ecodes.SYN_REPORT:
+            # Prefer the controller's sample clock over arrival time
+            # (Bluetooth delivers motion in bursts)
+            kernel_ts = event.sec * 1000000000 + event.usec * 1000
+            if self.motion_raw_ts is not None:
+                ts = self.motion_clock.update(self.motion_raw_ts, kernel_ts)
+            else:
+                ts = kernel_ts
+            acc, gyro = self.acc, self.gyro
+            self.motion_ring.push(ts, acc[0], acc[1], acc[2], gyro[0], gyro[1], gyro[2])
+
+    def process_hid_report(self, report):
+        # hidraw backend: a DS4 input report becomes the whole controller
+        # state at once (the counterpart of a SYN_REPORT on all three nodes).
+        # hidraw has no kernel timestamp, so latency starts at the read.
+        offset = REPORT_OFFSETS.get(report[0])
+        if offset is None or len(report) < offset + DS4_REPORT.size:
+            return # Reduced Bluetooth report or not an input report
+        (lx, ly, rx, ry, b0, b1, b2, _, _, sensor_ts, _,
+         gx, gy, gz, ax, ay, az) = DS4_REPORT.unpack_from(report, offset)
+        read_ts = self.read_ts
+        self.motion_ring.push(self.sensor_clock.update(sensor_ts, read_ts), ax, ay, az, gx, gy, gz)
+
+        axes = self.axes
+        axes[AXIS_LX] = lx
+        axes[AXIS_LY] = ly
+        axes[AXIS_RX] = rx
+        axes[AXIS_RY] = ry
+        self.btns = BUTTONS0[b0] | BUTTONS1[b1] | BUTTONS2[b2]
+        if self.commit_state():
+            if not self.input_ts:
+                self.input_ts = read_ts
+                self.input_read_ts = read_ts
+            if self.output_mode == 'change':
+                self.report_changed()
+
+    def process_ds4_event(self, event, table=None, slot='ds4'):
+        # table: dispatch table of the node the event came from (main by
+        # default), slot: that node's slot. Each node has its own event
+        # stream, so a drop on one is recovered from that node alone.
+        if event.type == evdev.ecodes.EV_SYN:
+            if event.code == evdev.ecodes.SYN_REPORT:
+                if slot in self.syn_dropped:
+                    self.syn_dropped.discard(slot)
+                    self.resync_node(slot)
+                if self.commit_state():
+                    if self.packet_ts and not self.input_ts:
+                        self.input_ts = self.packet_ts
+                        self.input_read_ts = self.packet_read_ts
+                    if self.output_mode == 'change':
+                        self.report_changed()
+                self.packet_ts = 0
+            elif event.code == evdev.ecodes.SYN_DROPPED:
+                # Kernel buffer overrun: ignore until the node's next SYN_REPORT, then resync
+                self.syn_dropped.add(slot)
+            return
+        if slot in self.syn_dropped:
+            return
+
+        if table is None:
+            table = self.input_map.table
+        row = table[event.type]
+        if row is None:
+            return
+        entry = row[event.code]
+        if entry is None:
+            return
+
+        if not self.packet_ts and event.sec:
+            self.packet_ts = event.sec * 1000000000 + event.usec * 1000 - self.clock_offset
+            self.packet_read_ts = self.read_ts
+
+        kind = entry[0]
+        if kind == KIND_BUTTON:
+            if event.value: self.btns |= entry[3]
+            else:           self.btns &= ~entry[3]
+        elif kind == KIND_AXIS:
+            self.axes[entry[1]] = entry[2](event.value)
+        elif kind == KIND_HAT:
+            self.hat_xy[entry[1]] = event.value
+            self.update_hat()
+        elif kind == KIND_TRIGGER:
+            if event.value >= entry[1]: self.btns |= entry[2]
+            else:                       self.btns &= ~entry[2]
                 
+    def resync_node(self, slot):
+        # Rebuild the state fed by one node ('ds4' or 'touchpad') from the
+        # device after SYN_DROPPED, through that node's own table
+        dev = getattr(self, slot)
+        if dev is None:
+            return
+        ecodes = evdev.ecodes
+        table = self.input_map.table if slot == 'ds4' else self.touchpad_map.table
+        try:
+            active = set(dev.active_keys())
+            key_row = table[ecodes.EV_KEY]
+            for code, entry in enumerate(key_row):
+                if entry is not None:
+                    self.process_ds4_event(evdev.InputEvent(0, 0, ecodes.EV_KEY, code, int(code in active)), table, slot)
+            # Only axes the node has: the map may bind codes it lacks
+            # (a generic table on a pad without triggers or a hat)
+            present = set(dev.capabilities(absinfo=False).get(ecodes.EV_ABS, ()))
+            abs_row = table[ecodes.EV_ABS]
+            for code, entry in enumerate(abs_row):
+                if entry is not None and code in present:
+                    self.process_ds4_event(evdev.InputEvent(0, 0, ecodes.EV_ABS, code, dev.absinfo(code).value), table, slot)
+        except OSError:
+            pass # Device going away
+
     def update_hat(self):
         # Update Hat Bits in BTNS
         # Hat is bits 0-3 of Byte 2 (btns >> 16)
@@ -489,9 +1131,90 @@ class ProControllerBridge:
         self.btns &= ~(0xF << 16)
         
         # Calculate new hat
-        h = map_hat(getattr(self, 'hat_x', 0), getattr(self, 'hat_y', 0))
-        self.btns |= (h << 16)
+        self.hat = map_hat(self.hat_xy[0], self.hat_xy[1])
+        self.btns |= (self.hat << 16)
 
 if __name__ == "__main__":
-    bridge = ProControllerBridge(GADGET_PATH)
+    parser = argparse.ArgumentParser(description="DS4 to Switch Pro Controller bridge")
+    parser.add_argument('--gadget', default=GADGET_PATH, help="HID gadget device")
+    parser.add_argument('--gadget-fd', type=int, default=-1,
+                        help="Use an already open gadget fd (test harnesses)")
+    parser.add_argument('--period', type=int, choices=TICK_PERIODS_MS, default=15,
+                        help="Report tick in ms (15 = ~66 Hz, 8 = 125 Hz, 4 = 250 Hz)")
+    parser.add_argument('--stats-interval', type=int, default=0,
+                        help="Print tick jitter every N seconds (0 = only on exit)")
+    parser.add_argument('--stats-socket', metavar='PATH',
+                        help="Serve latency/drop stats as JSON on this UNIX socket")
+    parser.add_argument('--stats-file', metavar='PATH',
+                        help="Rewrite latency/drop stats JSON here every --stats-interval seconds")
+    parser.add_argument('--output-mode', choices=OUTPUT_MODES, default='tick',
+                        help="tick: 0x30 every tick, change: 0x30 on every state change + keepalive")
+    parser.add_argument('--min-gap', type=float, default=4,
+                        help="Minimum ms between 0x30 reports in change mode")
+    parser.add_argument('--record', metavar='PATH',
+                        help="Append evdev input and gadget traffic to a binary log (see replay.py)")
+    parser.add_argument('--motion-profile', metavar='PATH',
+                        help="JSON file overriding motion calibration (axes, bias, resolution)")
+    parser.add_argument('--stick-profile', metavar='PATH',
+                        help="JSON stick profile: deadzone, anti-deadzone, curve, outer, center per stick")
+    parser.add_argument('--macro', metavar='PATH',
+                        help="Frame-accurate input sequence to play (see macro.py for the format)")
+    parser.add_argument('--macro-trigger', metavar='BUTTON',
+                        help="Switch button that starts the macro (default: run once at startup)")
+    parser.add_argument('--turbo', metavar='BUTTON:RATE', action='append', default=[],
+                        help="Turbo for a button while held, RATE presses/s (repeatable)")
+    parser.add_argument('--spi-dump', metavar='PATH',
+                        help="Raw SPI flash dump of a real controller to serve SPI reads from")
+    parser.add_argument('--input-backend', choices=INPUT_BACKENDS, default='evdev',
+                        help="evdev: kernel event nodes, hidraw: raw DS4 HID reports (one unpack per report)")
+    parser.add_argument('--rumble-interval', type=float, default=RUMBLE_MIN_INTERVAL_MS, metavar='MS',
+                        help="Minimum ms between DS4 rumble updates (0 = no rumble passthrough)")
+    parser.add_argument('--no-lightbar', action='store_true',
+                        help="Do not mirror the Switch player lights to the DS4 lightbar")
+    parser.add_argument('--realtime', action='store_true',
+                        help="SCHED_FIFO, mlockall, frozen GC collected at idle (needs root)")
+    parser.add_argument('--rt-priority', type=int, default=DEFAULT_PRIORITY,
+                        help="SCHED_FIFO priority for --realtime (0 = keep the normal policy)")
+    parser.add_argument('--cpu', type=int, help="Pin the loop to this CPU core (--realtime)")
+    parser.add_argument('--udp-listen', metavar='[HOST:]PORT',
+                        help=f"Also take controller state from UDP packets (see udp_input.py), e.g. {DEFAULT_PORT}")
+    parser.add_argument('--udp-max-age', type=float, default=0, metavar='MS',
+                        help="Drop UDP packets older than this (sender clock must match ours; 0 = off)")
+    parser.add_argument('--udp-timeout', type=float, default=SESSION_TIMEOUT_MS, metavar='MS',
+                        help="Release UDP input after this long without packets")
+    parser.add_argument('--mouse', metavar='PATH',
+                        help="Mouse event node driving the gyro ('auto' = first mouse found)")
+    parser.add_argument('--mouse-profile', metavar='PATH',
+                        help="JSON mouse gyro settings: sensitivity, y_ratio, curve, smoothing (see mouse_gyro.py)")
+    parser.add_argument('--realtime-baseline', type=float, default=0, metavar='SECONDS',
+                        help="Run this long without realtime settings first, then compare tick lateness")
+    args = parser.parse_args()
+    if args.stats_file and not args.stats_interval:
+        args.stats_interval = 1
+
+    macro = MacroEngine(parse_macro(args.macro) if args.macro else (),
+                        trigger=args.macro_trigger,
+                        turbo=[parse_turbo(spec) for spec in args.turbo],
+                        period_ms=args.period)
+
+    realtime = Realtime(args.rt_priority, args.cpu) if args.realtime else None
+    udp = (UdpInput(parse_address(args.udp_listen), args.udp_max_age, args.udp_timeout)
+           if args.udp_listen else None)
+    mouse = None
+    if args.mouse:
+        mouse = MouseGyro(open_mouse(args.mouse),
+                          load_mouse_profile(args.mouse_profile) if args.mouse_profile else None)
+
+    bridge = ProControllerBridge(args.gadget, period_ms=args.period,
+                                 stats_interval=args.stats_interval,
+                                 output_mode=args.output_mode, min_gap_ms=args.min_gap,
+                                 stats_socket=args.stats_socket, stats_file=args.stats_file,
+                                 record_path=args.record, motion_profile=args.motion_profile,
+                                 spi_dump=args.spi_dump, stick_profile=args.stick_profile,
+                                 macro=macro, realtime=realtime,
+                                 realtime_baseline=args.realtime_baseline,
+                                 rumble_interval_ms=args.rumble_interval,
+                                 lightbar=not args.no_lightbar, input_backend=args.input_backend,
+                                 udp=udp, mouse=mouse)
+    bridge.gadget_fd = args.gadget_fd
     bridge.run()
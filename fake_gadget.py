@@ -0,0 +1,41 @@
+import socket
+
+
+class FakeGadget:
+    # Stand-in for /dev/hidg0. SOCK_SEQPACKET keeps report boundaries like
+    # the real endpoint: bridge_end goes to the bridge, host_end is the "Switch".
+
+    def __init__(self):
+        self.bridge_end, self.host_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.bridge_end.setblocking(False)
+        self.host_end.setblocking(False)
+        self.counts = {}
+        self.replies = [] # 0x21 / 0x81 reports in order
+        self.on_report = None # Optional callback(report) for every report read
+
+    def fileno(self):
+        return self.bridge_end.fileno()
+
+    def write_output(self, data):
+        # Switch -> bridge
+        self.host_end.send(data)
+
+    def drain(self, fd=None, mask=None):
+        # Reads everything the bridge wrote so far
+        while True:
+            try:
+                report = self.host_end.recv(64)
+            except BlockingIOError:
+                return
+            if not report:
+                return
+            report_id = report[0]
+            self.counts[report_id] = self.counts.get(report_id, 0) + 1
+            if report_id != 0x30:
+                self.replies.append(report)
+            if self.on_report:
+                self.on_report(report)
+
+    def close(self):
+        self.bridge_end.close()
+        self.host_end.close()
@@ -0,0 +1,238 @@
+import fcntl
+import glob
+import json
+import os
+import struct
+
+from input_map import SWITCH_BUTTONS, DS4_HID_BUTTONS, HAT_CENTER
+from motion import MotionCalibration, DS4_ACCEL_PER_G, DS4_GYRO_PER_DPS, DS4_TO_SWITCH_AXES
+from profiles import REGISTRY, DS4, BUS_BLUETOOTH
+
+# DS4 input straight from /dev/hidrawN (--input-backend hidraw).
+#
+# evdev splits every HID report into a dozen or more events spread over
+# three nodes, each one a Python object going through the dispatch table.
+# Here one read() is one whole report, decoded with a single precompiled
+# struct unpack: buttons, sticks and IMU from the same sample instant.
+# Buttons (and the d-pad) go through three 256-entry tables straight into
+# the Switch button word.
+#
+# Report layouts (hid-playstation's dualshock4_input_report_common):
+#   USB 0x01 (64 bytes):       common part from byte 1
+#   Bluetooth 0x11 (78 bytes): common part from byte 3
+# Over Bluetooth the DS4 sends reduced 0x01 reports until a calibration
+# feature report is read, which read_calibration() does before the node is
+# attached. That ioctl blocks, so DeviceRouter runs it on its own thread;
+# a node whose feature reports fail is left to the evdev backend.
+HIDRAW_DIR = '/dev'
+
+DS4_DONGLE = 0x0BA0 # USB wireless adaptor
+
+# LX LY RX RY, buttons[3], L2 R2, sensor timestamp (16/3 us units),
+# temperature, gyro x/y/z, accel x/y/z (raw sensor units)
+DS4_REPORT = struct.Struct('<4B3B2BHB6h')
+REPORT_OFFSETS = {0x01: 1, 0x11: 3}
+REPORT_MAX = 128
+
+# Calibration feature reports: 0x02 over USB, 0x05 over Bluetooth (+CRC)
+CALIBRATION_USB = (0x02, 37)
+CALIBRATION_BT = (0x05, 41)
+# gyro bias x3, gyro plus/minus x6, gyro speed plus/minus, accel plus/minus x3
+CALIBRATION = struct.Struct('<17h')
+
+# Nominal raw gyro units when no calibration report can be read
+RAW_GYRO_PER_DPS = 16
+
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+
+def _ioc(direction, nr, size):
+    return (direction << 30) | (size << 16) | (ord('H') << 8) | nr
+
+
+HIDIOCGRAWINFO = _ioc(_IOC_READ, 0x03, 8)
+RAWINFO = struct.Struct('<Ihh') # bustype, vendor, product
+
+
+def _button_tables():
+    tables = ([0] * 256, [0] * 256, [0] * 256)
+    for byte, bit, name in DS4_HID_BUTTONS:
+        offset, mask = SWITCH_BUTTONS[name]
+        switch_mask = mask << (8 * offset)
+        for value in range(256):
+            if value & bit:
+                tables[byte][value] |= switch_mask
+    # D-pad: same encoding as the Switch hat (0 = up, clockwise, 8+ = released)
+    for value in range(256):
+        hat = value & 0x0F
+        tables[0][value] |= (hat if hat < HAT_CENTER else HAT_CENTER) << 16
+    return tuple(tuple(table) for table in tables)
+
+
+BUTTONS0, BUTTONS1, BUTTONS2 = _button_tables()
+
+
+def list_hidraw():
+    return sorted(glob.glob(os.path.join(HIDRAW_DIR, 'hidraw*')))
+
+
+def _read_sysfs(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+def sysfs_is_ds4(hidraw_path):
+    # True if the node belongs to a DS4, from sysfs (readable even when the
+    # node itself is not)
+    uevent = _read_sysfs(f"/sys/class/hidraw/{os.path.basename(hidraw_path)}/device/uevent")
+    for line in uevent.splitlines():
+        if line.startswith('HID_ID='):
+            try:
+                key = tuple(int(part, 16) for part in line[7:].split(':'))
+            except ValueError:
+                return False
+            return REGISTRY.get(key) is DS4
+    return False
+
+
+def gamepad_event_node(hidraw_path):
+    # evdev node of the gamepad (not motion/touchpad) behind a hidraw node;
+    # force feedback still goes through it
+    base = f"/sys/class/hidraw/{os.path.basename(hidraw_path)}/device/input"
+    for event in sorted(glob.glob(os.path.join(base, 'input*', 'event*'))):
+        name = _read_sysfs(os.path.join(os.path.dirname(event), 'name'))
+        if 'Motion' not in name and 'Touchpad' not in name:
+            return os.path.join('/dev/input', os.path.basename(event))
+    return None
+
+
+class SensorClock:
+    # 16-bit sensor timestamp (16/3 us per unit) unwrapped into ns, starting
+    # at the first read time
+
+    def __init__(self):
+        self.last_raw = None
+        self.now = 0
+
+    def update(self, raw, fallback_ns):
+        if self.last_raw is None:
+            self.now = fallback_ns
+        else:
+            self.now += ((raw - self.last_raw) & 0xFFFF) * 16000 // 3
+        self.last_raw = raw
+        return self.now
+
+
+class HidrawDS4:
+    # Open DS4 hidraw node. fd/path/name/uniq/phys/close() match what the
+    # bridge and DeviceRouter use of an evdev InputDevice.
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_NONBLOCK | os.O_CLOEXEC)
+        try:
+            info = bytearray(RAWINFO.size)
+            fcntl.ioctl(self.fd, HIDIOCGRAWINFO, info)
+        except OSError:
+            os.close(self.fd)
+            raise
+        self.bus, vendor, product = RAWINFO.unpack(info)
+        self.vendor = vendor & 0xFFFF
+        self.product = product & 0xFFFF
+        uevent = dict(line.split('=', 1) for line in
+                      _read_sysfs(f"/sys/class/hidraw/{os.path.basename(path)}/device/uevent").splitlines()
+                      if '=' in line)
+        self.name = uevent.get('HID_NAME', 'Wireless Controller')
+        self.uniq = uevent.get('HID_UNIQ', '')
+        self.phys = uevent.get('HID_PHYS', path)
+        self.ff_path = gamepad_event_node(path)
+        self.calibration_args = None # Set by read_calibration()
+
+    def is_ds4(self):
+        # Only the DS4 report layout is decoded here; other controllers use evdev
+        return REGISTRY.get((self.bus, self.vendor, self.product)) is DS4
+
+    def read_feature(self, report_id, size):
+        buf = bytearray(size)
+        buf[0] = report_id
+        fcntl.ioctl(self.fd, _ioc(_IOC_READ | _IOC_WRITE, 0x07, size), buf)
+        return buf
+
+    def read_calibration(self):
+        # Blocking: reads the controller's factory calibration (nominal
+        # values if it does not decode). OSError means the node takes no
+        # feature reports, and Bluetooth reports would stay reduced.
+        bt = self.bus == BUS_BLUETOOTH
+        report_id, size = CALIBRATION_BT if bt else CALIBRATION_USB
+        report = self.read_feature(report_id, size)
+        try:
+            self.calibration_args = calibration_args(report, alt_order=bt or self.product == DS4_DONGLE)
+        except ValueError:
+            self.calibration_args = {'gyro_res': RAW_GYRO_PER_DPS}
+
+    def motion_calibration(self, profile=None):
+        # MotionCalibration for raw report units (hid-playstation's math).
+        # A JSON motion profile overrides any constructor argument.
+        kwargs = dict(self.calibration_args or {'gyro_res': RAW_GYRO_PER_DPS})
+        if profile:
+            with open(profile) as f:
+                kwargs.update(json.load(f))
+        return MotionCalibration(**kwargs)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def calibration_args(report, alt_order):
+    # Calibration feature report -> MotionCalibration arguments. Per-axis
+    # sensitivity is folded into the axis matrices, so the result maps raw
+    # units exactly like the kernel's evdev values would be mapped.
+    v = CALIBRATION.unpack_from(report, 1)
+    if alt_order: # Bluetooth and the USB adaptor: all plus, then all minus
+        plus, minus = v[3:6], v[6:9]
+    else:
+        plus, minus = v[3:9:2], v[4:9:2]
+    bias = v[0:3]
+    speed_2x = v[9] + v[10]
+    gyro_scale = []
+    for axis in range(3):
+        denom = abs(plus[axis] - bias[axis]) + abs(minus[axis] - bias[axis])
+        if not denom or not speed_2x:
+            raise ValueError("bad gyro calibration")
+        gyro_scale.append(speed_2x * DS4_GYRO_PER_DPS / denom)
+
+    accel_scale = []
+    accel_bias = []
+    for axis in range(3):
+        accel_plus, accel_minus = v[11 + 2 * axis], v[12 + 2 * axis]
+        range_2g = accel_plus - accel_minus
+        if not range_2g:
+            raise ValueError("bad accel calibration")
+        accel_bias.append(accel_plus - range_2g / 2)
+        accel_scale.append(2 * DS4_ACCEL_PER_G / range_2g)
+
+    scaled = lambda scale: tuple(tuple(c * s for c, s in zip(row, scale)) for row in DS4_TO_SWITCH_AXES)
+    # The kernel leaves the gyro bias to the controller firmware; so do we
+    return {
+        'accel_res': DS4_ACCEL_PER_G,
+        'gyro_res': DS4_GYRO_PER_DPS,
+        'accel_axes': scaled(accel_scale),
+        'gyro_axes': scaled(gyro_scale),
+        'accel_bias': tuple(accel_bias),
+    }
+
+
+def open_hidraw_ds4(path):
+    # -> ('ds4', HidrawDS4) for a DS4 hidraw node; anything else is closed again
+    try:
+        dev = HidrawDS4(path)
+    except OSError:
+        return None
+    if not dev.is_ds4():
+        dev.close()
+        return None
+    return 'ds4', dev
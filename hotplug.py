@@ -0,0 +1,98 @@
+import ctypes
+import errno
+import os
+import struct
+
+# Event-driven /dev/input watcher on inotify (no udev bindings needed).
+# The fd goes into the bridge's epoll set; read() turns the pending
+# inotify events into (added, path) pairs for evdev nodes (or, with
+# path='/dev' and prefix='hidraw', for hidraw nodes).
+#
+# A node shows up with IN_CREATE; udev fixes its permissions a moment later
+# (IN_ATTRIB), so both count as "added" and the caller simply retries the open.
+#
+# /dev/input itself only exists once the first input device appeared (a
+# headless Pi with nothing plugged in, containers). Until then the parent
+# directory is watched; when the directory is created the real watch is
+# added and the nodes already in it are reported as added.
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+INOTIFY_EVENT = struct.Struct('iIII') # wd, mask, cookie, len (+ name)
+
+INPUT_DIR = '/dev/input'
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+class InputWatcher:
+    def __init__(self, path=INPUT_DIR, prefix='event'):
+        self.path = path
+        self.prefix = prefix
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.parent_wd = -1
+        try:
+            self.wd = self._add_watch(path, IN_CREATE | IN_ATTRIB | IN_DELETE)
+        except FileNotFoundError:
+            self.wd = -1
+            try:
+                self.parent_wd = self._add_watch(os.path.dirname(path), IN_CREATE)
+            except OSError:
+                os.close(self.fd)
+                raise
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _add_watch(self, path, mask):
+        wd = _libc.inotify_add_watch(self.fd, path.encode(), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def _directory_created(self, changes):
+        # The watched directory appeared: watch it, report what is already there
+        try:
+            self.wd = self._add_watch(self.path, IN_CREATE | IN_ATTRIB | IN_DELETE)
+        except OSError:
+            return # Gone again; a later IN_CREATE retries
+        _libc.inotify_rm_watch(self.fd, self.parent_wd)
+        self.parent_wd = -1
+        for name in sorted(os.listdir(self.path)):
+            if name.startswith(self.prefix):
+                changes.append((True, os.path.join(self.path, name)))
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        # Returns [(added, path), ...] for <prefix>* nodes, in arrival order
+        changes = []
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return changes
+                raise
+            offset = 0
+            while offset + INOTIFY_EVENT.size <= len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0').decode()
+                offset += length
+                if wd == self.parent_wd:
+                    if name == os.path.basename(self.path):
+                        self._directory_created(changes)
+                elif wd == self.wd and name.startswith(self.prefix):
+                    changes.append((not mask & IN_DELETE, os.path.join(self.path, name)))
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,194 @@
+import evdev
+
+# Pro Controller Button Map (Bitmask for Report ID 0x30)
+# Byte 0 (Buttons)
+BTN_Y       = 0x01
+BTN_B       = 0x02
+BTN_A       = 0x04
+BTN_X       = 0x08
+BTN_L       = 0x10
+BTN_R       = 0x20
+BTN_ZL      = 0x40
+BTN_ZR      = 0x80
+
+# Byte 1 (Buttons)
+BTN_MINUS   = 0x01
+BTN_PLUS    = 0x02
+BTN_LCLICK  = 0x04
+BTN_RCLICK  = 0x08
+BTN_HOME    = 0x10
+BTN_CAPTURE = 0x20
+
+# Byte 2 (Hat)
+HAT_TOP          = 0x00
+HAT_TOP_RIGHT    = 0x01
+HAT_RIGHT        = 0x02
+HAT_BOTTOM_RIGHT = 0x03
+HAT_BOTTOM       = 0x04
+HAT_BOTTOM_LEFT  = 0x05
+HAT_LEFT         = 0x06
+HAT_TOP_LEFT     = 0x07
+HAT_CENTER       = 0x08
+
+# Switch button name -> (byte offset, bit mask)
+SWITCH_BUTTONS = {
+    'Y': (0, BTN_Y), 'B': (0, BTN_B), 'A': (0, BTN_A), 'X': (0, BTN_X),
+    'L': (0, BTN_L), 'R': (0, BTN_R), 'ZL': (0, BTN_ZL), 'ZR': (0, BTN_ZR),
+    'MINUS': (1, BTN_MINUS), 'PLUS': (1, BTN_PLUS),
+    'LCLICK': (1, BTN_LCLICK), 'RCLICK': (1, BTN_RCLICK),
+    'HOME': (1, BTN_HOME), 'CAPTURE': (1, BTN_CAPTURE),
+}
+
+# Stick axis slots
+AXIS_LX, AXIS_LY, AXIS_RX, AXIS_RY = 0, 1, 2, 3
+SWITCH_AXES = {'LX': AXIS_LX, 'LY': AXIS_LY, 'RX': AXIS_RX, 'RY': AXIS_RY}
+
+# Table entry kinds
+# (KIND_BUTTON, byte offset, mask, mask << 8*offset)
+# (KIND_AXIS, axis slot, transform(value))
+# (KIND_HAT, 0 = X / 1 = Y)
+# (KIND_TRIGGER, threshold, mask << 8*offset): analog trigger driving a button
+KIND_BUTTON = 0
+KIND_AXIS = 1
+KIND_HAT = 2
+KIND_TRIGGER = 3
+
+# Fraction of an analog trigger's travel that counts as pressed
+TRIGGER_THRESHOLD = 0.25
+
+# DS4 (hid-sony / hid-playstation) bindings.
+# evdev code names are tried in order (older kernels/python-evdev lack BTN_SHARE etc.)
+DS4_BUTTONS = (
+    (('BTN_SOUTH',), 'B'),      # Cross
+    (('BTN_EAST',), 'A'),       # Circle
+    (('BTN_NORTH',), 'X'),      # Triangle
+    (('BTN_WEST',), 'Y'),       # Square
+    (('BTN_TL',), 'L'),
+    (('BTN_TR',), 'R'),
+    (('BTN_TL2',), 'ZL'),
+    (('BTN_TR2',), 'ZR'),
+    (('BTN_SHARE', 'BTN_SELECT'), 'MINUS'),
+    (('BTN_OPTIONS', 'BTN_START'), 'PLUS'),
+    (('BTN_MODE',), 'HOME'),
+    (('BTN_THUMBL',), 'LCLICK'),
+    (('BTN_THUMBR',), 'RCLICK'),
+)
+
+# (evdev code, Switch axis, invert)
+DS4_AXES = (
+    ('ABS_X', 'LX', False),
+    ('ABS_Y', 'LY', True),
+    ('ABS_RX', 'RX', False),
+    ('ABS_RY', 'RY', True),
+)
+
+DS4_HAT = (
+    ('ABS_HAT0X', 0),
+    ('ABS_HAT0Y', 1),
+)
+
+# Touchpad node: the pad click is the only binding
+DS4_TOUCHPAD_BUTTONS = (
+    (('BTN_LEFT',), 'CAPTURE'),
+)
+
+# Raw HID input report buttons (hidraw backend): (buttons byte, bit, Switch button).
+# Byte 0 bits 0-3 are the d-pad (see hidraw_ds4.py).
+DS4_HID_BUTTONS = (
+    (0, 0x10, 'Y'),         # Square
+    (0, 0x20, 'B'),         # Cross
+    (0, 0x40, 'A'),         # Circle
+    (0, 0x80, 'X'),         # Triangle
+    (1, 0x01, 'L'),
+    (1, 0x02, 'R'),
+    (1, 0x04, 'ZL'),
+    (1, 0x08, 'ZR'),
+    (1, 0x10, 'MINUS'),     # Share
+    (1, 0x20, 'PLUS'),      # Options
+    (1, 0x40, 'LCLICK'),
+    (1, 0x80, 'RCLICK'),
+    (2, 0x01, 'HOME'),      # PS
+    (2, 0x02, 'CAPTURE'),   # Touchpad click
+)
+
+# Hat (x, y) -> value, indexed by (x + 1) * 3 + (y + 1)
+HAT_TABLE = (
+    HAT_TOP_LEFT, HAT_LEFT, HAT_BOTTOM_LEFT,
+    HAT_TOP, HAT_CENTER, HAT_BOTTOM,
+    HAT_TOP_RIGHT, HAT_RIGHT, HAT_BOTTOM_RIGHT,
+)
+
+
+def map_hat(x, y):
+    if -1 <= x <= 1 and -1 <= y <= 1:
+        return HAT_TABLE[(x + 1) * 3 + (y + 1)]
+    return HAT_CENTER
+
+
+def resolve_code(names):
+    for name in names:
+        code = getattr(evdev.ecodes, name, None)
+        if code is not None:
+            return code
+    return None
+
+
+def rescaled(transform, lo, hi):
+    span = hi - lo
+    return lambda v: transform((v - lo) * 255 // span)
+
+
+class InputMap:
+    # Bindings compiled once into a direct lookup table:
+    # table[event.type][event.code] -> entry tuple (or None)
+    # Per-event cost is two list indexes no matter how many bindings exist.
+
+    def __init__(self, axis_transform, buttons=DS4_BUTTONS, axes=DS4_AXES, hat=DS4_HAT,
+                 triggers=(), ranges=None):
+        # axis_transform(invert) -> callable(value) for the target report format,
+        # fed 0-255. ranges: {evdev code: (min, max)} from absinfo; axes with
+        # another range are rescaled to 0-255 first.
+        # triggers: ((evdev ABS code name, Switch button), ...)
+        ranges = ranges or {}
+        ecodes = evdev.ecodes
+        self.table = [None] * (ecodes.EV_MAX + 1)
+        self.table[ecodes.EV_KEY] = [None] * (ecodes.KEY_MAX + 1)
+        self.table[ecodes.EV_ABS] = [None] * (ecodes.ABS_MAX + 1)
+
+        for names, target in buttons:
+            code = resolve_code(names)
+            if code is None:
+                continue
+            offset, mask = SWITCH_BUTTONS[target]
+            self.table[ecodes.EV_KEY][code] = (KIND_BUTTON, offset, mask, mask << (8 * offset))
+
+        for name, target, invert in axes:
+            code = resolve_code((name,))
+            if code is None:
+                continue
+            transform = axis_transform(invert)
+            lo, hi = ranges.get(code, (0, 255))
+            if (lo, hi) != (0, 255) and hi > lo:
+                transform = rescaled(transform, lo, hi)
+            self.table[ecodes.EV_ABS][code] = (KIND_AXIS, SWITCH_AXES[target], transform)
+
+        for name, target in triggers:
+            code = resolve_code((name,))
+            if code is None:
+                continue
+            lo, hi = ranges.get(code, (0, 255))
+            offset, mask = SWITCH_BUTTONS[target]
+            self.table[ecodes.EV_ABS][code] = (KIND_TRIGGER, lo + max(1, round((hi - lo) * TRIGGER_THRESHOLD)),
+                                               mask << (8 * offset))
+
+        for name, axis in hat:
+            code = resolve_code((name,))
+            if code is None:
+                continue
+            self.table[ecodes.EV_ABS][code] = (KIND_HAT, axis)
+
+    def lookup(self, type, code):
+        row = self.table[type] if type < len(self.table) else None
+        if row is None or code >= len(row):
+            return None
+        return row[code]
@@ -0,0 +1,140 @@
+import glob
+import os
+
+from workers import LatestValueWorker
+
+# Switch player lights (subcommand 0x30) mirrored to the DS4 lightbar.
+#
+# The subcommand byte is lights on (bits 0-3) and lights flashing (bits
+# 4-7). The player number is the highest light set, which covers both the
+# single light (1, 2, 4, 8) and the bar (1, 3, 7, 15) styles; while only
+# flashing (pairing) the flashing lights count.
+#
+# The lightbar is driven through the kernel's LED class nodes next to the
+# DS4's evdev node:
+#   hid-sony:        <hid>:red, <hid>:green, <hid>:blue (brightness each)
+#   hid-playstation: <input>:rgb:indicator (multi_intensity + brightness)
+# sysfs writes go through a LatestValueWorker; the last color is cached on
+# both sides, so the host repeating 0x30 during the handshake costs no I/O.
+
+# PS4 player colors, 0-255 per channel
+PLAYER_COLORS = {
+    0: (0, 0, 0),
+    1: (0, 0, 64),
+    2: (64, 0, 0),
+    3: (0, 64, 0),
+    4: (32, 0, 32),
+}
+
+
+def player_color(mask):
+    lights = mask & 0x0F or mask >> 4
+    return PLAYER_COLORS[lights.bit_length()]
+
+
+def find_lightbar(node_path):
+    # /dev/input/eventN or /dev/hidrawN -> ('rgb', [red, green, blue] dirs)
+    # or ('multi', dir), or None
+    node = os.path.basename(node_path)
+    if node.startswith('hidraw'):
+        leds = f"/sys/class/hidraw/{node}/device/leds"
+    else:
+        leds = f"/sys/class/input/{node}/device/device/leds"
+    multi = glob.glob(os.path.join(leds, '*:rgb:indicator'))
+    if multi:
+        return 'multi', multi[0]
+    dirs = []
+    for color in ('red', 'green', 'blue'):
+        found = glob.glob(os.path.join(leds, f'*:{color}'))
+        if not found:
+            return None
+        dirs.append(found[0])
+    return 'rgb', dirs
+
+
+def write_sysfs(path, value):
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+def read_max_brightness(led_dir):
+    with open(os.path.join(led_dir, 'max_brightness')) as f:
+        return int(f.read())
+
+
+class Lightbar:
+    # Loop side: set_player(mask) from the 0x30 subcommand, attach/detach
+    # from the DS4 lifecycle. Worker side: resolve the LED nodes, write.
+
+    def __init__(self):
+        self.path = None
+        self.color = PLAYER_COLORS[0]
+        self.requests = 0
+        self.cached = 0
+
+        # Worker side
+        self.leds = None
+        self.leds_path = None
+        self.written = None
+        self.worker = LatestValueWorker(self._apply, name='lightbar')
+
+    def set_player(self, mask):
+        self.requests += 1
+        color = player_color(mask)
+        if color == self.color:
+            self.cached += 1
+            return
+        self.color = color
+        if self.path:
+            self.worker.submit((self.path, color))
+
+    def attach(self, path):
+        # A new controller gets the current player color
+        self.path = path
+        self.worker.submit((path, self.color))
+
+    def detach(self):
+        self.path = None
+        self.worker.submit((None, None))
+
+    def _apply(self, value):
+        # Worker thread
+        path, color = value
+        try:
+            if path != self.leds_path:
+                self.leds_path = path
+                self.written = None
+                self.leds = None
+                found = find_lightbar(path) if path else None
+                if found:
+                    kind, nodes = found
+                    if kind == 'multi':
+                        self.leds = kind, nodes, read_max_brightness(nodes)
+                    else:
+                        self.leds = kind, nodes, [read_max_brightness(led) for led in nodes]
+            if self.leds is None or color == self.written:
+                return
+            kind, nodes, max_brightness = self.leds
+            if kind == 'multi':
+                write_sysfs(os.path.join(nodes, 'multi_intensity'), ' '.join(str(c) for c in color))
+                write_sysfs(os.path.join(nodes, 'brightness'), str(max_brightness))
+            else:
+                for led, c, top in zip(nodes, color, max_brightness):
+                    write_sysfs(os.path.join(led, 'brightness'), str(round(c * top / 255)))
+        except OSError:
+            self.leds_path = None # Controller gone; found again on the next attach
+            raise
+        self.written = color
+
+    def snapshot(self):
+        return {
+            'requests': self.requests,
+            'cached': self.cached,
+            'merged': self.worker.merged,
+            'applied': self.worker.sent,
+            'errors': self.worker.errors,
+        }
+
+    def close(self):
+        self.path = None
+        self.worker.close()
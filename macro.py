@@ -0,0 +1,157 @@
+from input_map import SWITCH_BUTTONS, map_hat
+
+# Frame-accurate macros and turbo, clocked by written 0x30 reports.
+#
+# The engine never looks at wall time: it advances once per 0x30 that was
+# actually written, so a step of N frames is visible in exactly N distinct
+# reports no matter how loaded the system is. The bridge reads the overlay
+# attributes (keep/press/hat/lstick/rstick) when committing state; nothing
+# is allocated per frame.
+#
+# Macro file, one step per line:
+#   <frames> [BUTTON ...] [UP|DOWN|LEFT|RIGHT ...] [L=x,y] [R=x,y]
+#   BUTTON: A B X Y L R ZL ZR MINUS PLUS LCLICK RCLICK HOME CAPTURE
+#   x, y:   -1.0 .. 1.0 (y up); a stick not given is left to the controller
+#   '-' (or nothing after the frame count) is a neutral step
+# e.g.
+#   2 A
+#   4 -
+#   10 B L=0,1
+HAT_MASK = 0xF << 16
+DPAD = {'UP': (0, -1), 'DOWN': (0, 1), 'LEFT': (-1, 0), 'RIGHT': (1, 0)}
+
+
+def button_mask(name):
+    # Bit in the 24-bit btns word (see input_map)
+    offset, mask = SWITCH_BUTTONS[name.upper()]
+    return mask << (8 * offset)
+
+
+def stick_value(spec):
+    x, y = (float(v) for v in spec.split(','))
+    to12 = lambda n: min(0xFFF, max(0, 0x800 + round(max(-1.0, min(1.0, n)) * 0x7FF)))
+    return to12(x) | (to12(y) << 12)
+
+
+def parse_macro(path):
+    # -> [(frames, press mask, hat or -1, lstick or -1, rstick or -1), ...]
+    steps = []
+    with open(path) as f:
+        for lineno, line in enumerate(f, 1):
+            tokens = line.split('#', 1)[0].split()
+            if not tokens:
+                continue
+            try:
+                frames = int(tokens[0])
+                if frames < 1:
+                    raise ValueError("frame count must be >= 1")
+                press = 0
+                dx = dy = 0
+                hat = lstick = rstick = -1
+                for token in tokens[1:]:
+                    upper = token.upper()
+                    if upper == '-':
+                        continue
+                    if upper in DPAD:
+                        dx += DPAD[upper][0]
+                        dy += DPAD[upper][1]
+                        hat = 0
+                    elif upper.startswith('L='):
+                        lstick = stick_value(token[2:])
+                    elif upper.startswith('R='):
+                        rstick = stick_value(token[2:])
+                    else:
+                        press |= button_mask(upper)
+                if hat >= 0:
+                    hat = map_hat(dx, dy) << 16
+            except (KeyError, ValueError) as e:
+                raise ValueError(f"{path}:{lineno}: {e}") from None
+            steps.append((frames, press, hat, lstick, rstick))
+    return steps
+
+
+def parse_turbo(spec):
+    # "A:10" -> (mask, presses per second)
+    name, _, rate = spec.partition(':')
+    return button_mask(name), float(rate or 10)
+
+
+class MacroEngine:
+    def __init__(self, steps=(), trigger=None, turbo=(), period_ms=15):
+        # trigger: Switch button name that starts the macro (it never reaches
+        # the Switch itself). Without one the macro runs once from the first frame.
+        # turbo: [(mask, presses per second)], active while the button is held.
+        self.steps = list(steps)
+        self.trigger = button_mask(trigger) if trigger else 0
+
+        # Turbo: [mask, on frames, cycle frames, frame counter] per button.
+        # One press+release needs at least 2 frames, which caps the rate.
+        self.turbo = []
+        for mask, rate in turbo:
+            cycle = max(2, round(1000 / (rate * period_ms)))
+            self.turbo.append([mask, cycle // 2, cycle, 0])
+
+        self.held = 0 # Physical buttons at the last commit
+        self.turbo_off = 0 # Turbo buttons in their release phase
+        self.running = False
+        self.step_index = 0
+        self.frames_left = 0
+
+        # Overlay read by the bridge
+        self.active = bool(self.steps or self.turbo or self.trigger)
+        self.keep = ~self.trigger
+        self.press = 0
+        self.hat = -1
+        self.lstick = -1
+        self.rstick = -1
+
+        if self.steps and not self.trigger:
+            self.start()
+
+    def start(self):
+        self.running = True
+        self.step_index = 0
+        self._load_step()
+
+    def _load_step(self):
+        self.frames_left, self.press, self.hat, self.lstick, self.rstick = self.steps[self.step_index]
+
+    def _stop(self):
+        self.running = False
+        self.press = 0
+        self.hat = self.lstick = self.rstick = -1
+
+    def update(self, btns):
+        # Physical button state at commit time; starts the macro on a trigger press
+        if btns & self.trigger and not self.held & self.trigger and self.steps:
+            self.start()
+        self.held = btns
+
+    def frame_written(self):
+        # Called after each written 0x30. Returns True if the overlay changed.
+        changed = False
+        if self.running:
+            self.frames_left -= 1
+            if self.frames_left <= 0:
+                self.step_index += 1
+                if self.step_index < len(self.steps):
+                    self._load_step()
+                else:
+                    self._stop()
+                changed = True
+
+        if self.turbo:
+            off = 0
+            held = self.held
+            for t in self.turbo:
+                if held & t[0]:
+                    t[3] += 1
+                    if t[3] % t[2] >= t[1]:
+                        off |= t[0]
+                else:
+                    t[3] = 0
+            if off != self.turbo_off:
+                self.turbo_off = off
+                self.keep = ~(self.trigger | off)
+                changed = True
+        return changed
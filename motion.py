@@ -0,0 +1,174 @@
+import struct
+from array import array
+
+# 0x30 reports carry 3 IMU samples, oldest first, 5 ms apart
+# (accel x/y/z, gyro x/y/z as int16 each)
+IMU_SAMPLES = 3
+IMU_SAMPLE_SPACING_NS = 5000000
+IMU_STRUCT = struct.Struct('<18h')
+
+
+def clamp16(v):
+    return -32768 if v < -32768 else (32767 if v > 32767 else v)
+
+
+class MotionTimestamp:
+    # DS4 MSC_TIMESTAMP is a free running 32-bit microsecond counter.
+    # Unwrap it into a 64-bit ns timeline that starts at the first kernel timestamp.
+
+    def __init__(self):
+        self.last_raw = None
+        self.now = 0
+
+    def update(self, raw_us, fallback_ns):
+        if self.last_raw is None:
+            self.now = fallback_ns
+        else:
+            self.now += ((raw_us - self.last_raw) & 0xFFFFFFFF) * 1000
+        self.last_raw = raw_us
+        return self.now
+
+
+class MotionRing:
+    # Fixed-size ring of timestamped 6-axis samples. Nothing is allocated
+    # after construction: push() writes into preallocated arrays and
+    # resample() fills a caller-owned list.
+
+    def __init__(self, size=32):
+        self.size = size
+        self.ts = array('q', bytes(8 * size))
+        self.values = array('i', bytes(4 * 6 * size))
+        self.head = 0 # Next slot to write
+        self.count = 0
+
+    def push(self, ts, ax, ay, az, gx, gy, gz):
+        i = self.head
+        self.ts[i] = ts
+        v = self.values
+        base = i * 6
+        v[base] = ax
+        v[base + 1] = ay
+        v[base + 2] = az
+        v[base + 3] = gx
+        v[base + 4] = gy
+        v[base + 5] = gz
+        self.head = (i + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def resample(self, out, spacing=IMU_SAMPLE_SPACING_NS):
+        # out: list of 18 ints. Writes IMU_SAMPLES samples ending at the newest
+        # sample, spaced `spacing` apart and linearly interpolated between the
+        # recorded ones. Returns False if the ring is empty.
+        if not self.count:
+            return False
+        newest = (self.head - 1) % self.size
+        t_end = self.ts[newest]
+        for k in range(IMU_SAMPLES):
+            self._sample_at(t_end - (IMU_SAMPLES - 1 - k) * spacing, out, k * 6)
+        return True
+
+    def _sample_at(self, t, out, offset):
+        size = self.size
+        ts = self.ts
+        v = self.values
+        newer = -1
+        i = (self.head - 1) % size
+        for _ in range(self.count):
+            if ts[i] <= t:
+                break
+            newer = i
+            i = (i - 1) % size
+        else:
+            # Older than anything we still have: hold the oldest sample
+            i = newer
+
+        base = i * 6
+        if newer < 0 or newer == i or ts[newer] == ts[i]:
+            for axis in range(6):
+                out[offset + axis] = v[base + axis]
+            return
+
+        frac = (t - ts[i]) / (ts[newer] - ts[i])
+        nbase = newer * 6
+        for axis in range(6):
+            a = v[base + axis]
+            out[offset + axis] = int(a + (v[nbase + axis] - a) * frac)
+
+
+# Switch IMU units (factory calibration defaults): accel +-8 G range,
+# gyro 13371 LSB at 936 dps
+SWITCH_ACCEL_PER_G = 4096.0
+SWITCH_GYRO_PER_DPS = 13371 / 936
+
+# Controller lying flat and still, for frames with nothing feeding the IMU
+REST_ACCEL = (0, 0, int(SWITCH_ACCEL_PER_G))
+REST_IMU = (REST_ACCEL + (0, 0, 0)) * IMU_SAMPLES
+
+# Fallback resolutions (hid-sony / hid-playstation report these via absinfo)
+DS4_ACCEL_PER_G = 8192
+DS4_GYRO_PER_DPS = 1024
+
+# DS4 sensor frame -> Switch sensor frame, rows are Switch X/Y/Z.
+# DS4 evdev: +X right, +Y up, +Z toward the player.
+# Switch:    +X toward the triggers, +Y left, +Z up.
+DS4_TO_SWITCH_AXES = (
+    (0, 0, -1),
+    (-1, 0, 0),
+    (0, 1, 0),
+)
+
+
+def _compose(remap, scale):
+    return tuple(tuple(float(c) * scale for c in row) for row in remap)
+
+
+class MotionCalibration:
+    # Raw sensor triples -> Switch units with one precomputed 3x3 matrix
+    # (axis remap * unit scale) and offset per sensor:
+    #   out = M * (raw - bias) = M * raw + offset
+    # apply() converts a whole resampled IMU batch in place.
+
+    def __init__(self, accel_res=DS4_ACCEL_PER_G, gyro_res=DS4_GYRO_PER_DPS,
+                 accel_axes=DS4_TO_SWITCH_AXES, gyro_axes=DS4_TO_SWITCH_AXES,
+                 accel_bias=(0, 0, 0), gyro_bias=(0, 0, 0)):
+        self.accel = _compose(accel_axes, SWITCH_ACCEL_PER_G / accel_res)
+        self.gyro = _compose(gyro_axes, SWITCH_GYRO_PER_DPS / gyro_res)
+        self.accel_offset = tuple(-sum(m * b for m, b in zip(row, accel_bias)) for row in self.accel)
+        self.gyro_offset = tuple(-sum(m * b for m, b in zip(row, gyro_bias)) for row in self.gyro)
+
+    @classmethod
+    def from_device(cls, dev, profile=None):
+        # Resolutions from the motion node's absinfo; a JSON profile may
+        # override any constructor argument (e.g. measured bias at rest).
+        import evdev
+        kwargs = {}
+        for code, key in ((evdev.ecodes.ABS_X, 'accel_res'), (evdev.ecodes.ABS_RX, 'gyro_res')):
+            try:
+                res = dev.absinfo(code).resolution
+            except (OSError, KeyError):
+                res = 0
+            if res:
+                kwargs[key] = res
+        if profile:
+            import json
+            with open(profile) as f:
+                kwargs.update(json.load(f))
+        return cls(**kwargs)
+
+    def apply(self, out):
+        # out: IMU_SAMPLES * (ax, ay, az, gx, gy, gz) raw values, replaced
+        # by clamped Switch units
+        a0, a1, a2 = self.accel
+        g0, g1, g2 = self.gyro
+        ao0, ao1, ao2 = self.accel_offset
+        go0, go1, go2 = self.gyro_offset
+        for base in range(0, IMU_SAMPLES * 6, 6):
+            x, y, z = out[base], out[base + 1], out[base + 2]
+            out[base] = clamp16(int(a0[0] * x + a0[1] * y + a0[2] * z + ao0))
+            out[base + 1] = clamp16(int(a1[0] * x + a1[1] * y + a1[2] * z + ao1))
+            out[base + 2] = clamp16(int(a2[0] * x + a2[1] * y + a2[2] * z + ao2))
+            x, y, z = out[base + 3], out[base + 4], out[base + 5]
+            out[base + 3] = clamp16(int(g0[0] * x + g0[1] * y + g0[2] * z + go0))
+            out[base + 4] = clamp16(int(g1[0] * x + g1[1] * y + g1[2] * z + go1))
+            out[base + 5] = clamp16(int(g2[0] * x + g2[1] * y + g2[2] * z + go2))
@@ -0,0 +1,261 @@
+import json
+import math
+import os
+import struct
+import time
+from array import array
+
+import evdev
+
+from motion import IMU_SAMPLES, IMU_SAMPLE_SPACING_NS, SWITCH_GYRO_PER_DPS, REST_ACCEL, clamp16
+from stats import use_monotonic_timestamps
+
+# Mouse as gyro (--mouse): relative mouse motion becomes the angular rate
+# of the 0x30 IMU samples, for gyro aiming with a mouse.
+#
+# The mouse reports at 500-1000 Hz, the Switch takes 3 samples 5 ms apart
+# per 0x30. Reading stays cheap at the full polling rate: input_event
+# structs are unpacked straight from a preallocated buffer (no evdev event
+# objects) and each mouse packet (SYN_REPORT) only stores its timestamp and
+# the running count totals in a fixed ring. When a 0x30 is built, one walk
+# back over the ring gives the counts inside each sample's 5 ms window,
+# windows ending at the build time, so motion up to the write is included
+# and the rotation the Switch integrates (rate * 5 ms per sample) is the
+# mouse movement itself, nothing resampled or delayed.
+#
+# Shaping (all per 0x30, not per mouse packet):
+#   tiered smoothing  below smoothing_speed the rate is averaged over
+#                     smoothing_ms (hides sensor jitter on slow aim), fading
+#                     out up to twice that speed, so flicks stay direct
+#   curve             rate * (speed / curve_speed) ** (curve - 1)
+#
+# Mouse right turns right (yaw, -Z), mouse forward aims up (pitch, -Y)
+# in the Switch sensor frame (see DS4_TO_SWITCH_AXES in motion.py).
+DEFAULT_MOUSE = {
+    'sensitivity': 0.05, # Degrees of rotation per mouse count
+    'y_ratio': 1.0, # Vertical sensitivity relative to horizontal
+    'curve': 1.0, # Exponent; > 1 slows small movements and speeds up fast ones
+    'curve_speed': 2000, # Counts/s where the curve is 1:1
+    'smoothing_ms': 0, # Tiered smoothing window (0 = off)
+    'smoothing_speed': 500, # Counts/s below which movement is fully smoothed
+    'invert_y': False,
+}
+
+YAW_SIGN = -1
+PITCH_SIGN = 1
+
+# Kernel struct input_event: timeval (2 longs), type, code, value
+EVENT = struct.Struct('@llHHi')
+READ_EVENTS = 64
+RING_SIZE = 512 # Mouse packets kept: 0.5 s at 1 kHz
+
+EV_SYN = 0x00
+EV_REL = 0x02
+SYN_REPORT = 0
+REL_X = 0x00
+REL_Y = 0x01
+
+
+def load_mouse_profile(path):
+    # JSON object, keys as in DEFAULT_MOUSE
+    with open(path) as f:
+        return json.load(f)
+
+
+def find_mouse():
+    # First node with relative X/Y and a left button, or None
+    ecodes = evdev.ecodes
+    for path in evdev.list_devices():
+        try:
+            dev = evdev.InputDevice(path)
+            caps = dev.capabilities(absinfo=False)
+        except OSError:
+            continue
+        rel = caps.get(ecodes.EV_REL, ())
+        if ecodes.REL_X in rel and ecodes.REL_Y in rel and ecodes.BTN_LEFT in caps.get(ecodes.EV_KEY, ()):
+            return dev
+        dev.close()
+    return None
+
+
+def open_mouse(path):
+    # 'auto' or an event node path -> InputDevice, grabbed so the mouse
+    # does not also drive a desktop cursor
+    dev = find_mouse() if path == 'auto' else evdev.InputDevice(path)
+    if dev is None:
+        raise OSError("no mouse found")
+    try:
+        dev.grab()
+    except OSError:
+        pass
+    return dev
+
+
+class MouseGyro:
+    def __init__(self, dev, profile=None):
+        settings = dict(DEFAULT_MOUSE)
+        settings.update(profile or {})
+        self.dev = dev
+        self.fd = dev.fd
+        self.clock_offset = 0 if use_monotonic_timestamps(self.fd) else time.time_ns() - time.monotonic_ns()
+        self.buf = bytearray(EVENT.size * READ_EVENTS)
+
+        # Ring of mouse packets: kernel time, running totals after the packet
+        self.ts = array('q', bytes(8 * RING_SIZE))
+        self.cum_x = array('q', bytes(8 * RING_SIZE))
+        self.cum_y = array('q', bytes(8 * RING_SIZE))
+        self.head = 0
+        self.count = 0
+        self.total_x = 0
+        self.total_y = 0
+        self.base_x = 0 # Totals before the oldest packet still in the ring
+        self.base_y = 0
+        self.packet_x = 0 # Counts of the packet being read
+        self.packet_y = 0
+
+        # Switch gyro units per (count/s)
+        spacing_s = IMU_SAMPLE_SPACING_NS / 1e9
+        gain = settings['sensitivity'] * SWITCH_GYRO_PER_DPS
+        self.gain_x = YAW_SIGN * gain / spacing_s
+        self.gain_y = PITCH_SIGN * gain * settings['y_ratio'] / spacing_s
+        if settings['invert_y']:
+            self.gain_y = -self.gain_y
+        self.curve = settings['curve'] - 1.0
+        # Curve and smoothing thresholds in counts per sample window
+        self.curve_counts = settings['curve_speed'] * spacing_s
+        smoothing_ns = int(settings['smoothing_ms'] * 1000000)
+        self.smoothing_ns = max(smoothing_ns, IMU_SAMPLE_SPACING_NS) if smoothing_ns else 0
+        self.smooth_lo = settings['smoothing_speed'] * spacing_s
+        self.smooth_hi = 2 * self.smooth_lo
+
+        # Points (ns before the build time) whose totals fill() needs, in
+        # walk order; window ends/starts and smoothing starts index into them
+        offsets = {k * IMU_SAMPLE_SPACING_NS for k in range(IMU_SAMPLES + 1)}
+        if self.smoothing_ns:
+            offsets |= {k * IMU_SAMPLE_SPACING_NS + self.smoothing_ns for k in range(IMU_SAMPLES)}
+        self.offsets = tuple(sorted(offsets))
+        index = {offset: i for i, offset in enumerate(self.offsets)}
+        # Per sample, oldest first: (end, start, smoothing start) mark indexes
+        self.windows = tuple((index[(IMU_SAMPLES - 1 - k) * IMU_SAMPLE_SPACING_NS],
+                              index[(IMU_SAMPLES - k) * IMU_SAMPLE_SPACING_NS],
+                              index.get((IMU_SAMPLES - 1 - k) * IMU_SAMPLE_SPACING_NS + self.smoothing_ns, 0))
+                             for k in range(IMU_SAMPLES))
+        self.mark_x = array('q', bytes(8 * len(self.offsets)))
+        self.mark_y = array('q', bytes(8 * len(self.offsets)))
+
+        self.packets = 0
+        self.reads = 0
+        self.max_batch = 0 # Most events seen in one read
+
+    def read(self):
+        # Drain the node. OSError (ENODEV) means the mouse is gone.
+        fd = self.fd
+        buf = self.buf
+        unpack_from = EVENT.unpack_from
+        size = EVENT.size
+        while True:
+            try:
+                n = os.readv(fd, (buf,))
+            except BlockingIOError:
+                return
+            if not n:
+                return
+            self.reads += 1
+            if n // size > self.max_batch:
+                self.max_batch = n // size
+            for offset in range(0, n - n % size, size):
+                sec, usec, type, code, value = unpack_from(buf, offset)
+                if type == EV_REL:
+                    if code == REL_X:
+                        self.packet_x += value
+                    elif code == REL_Y:
+                        self.packet_y += value
+                elif type == EV_SYN and code == SYN_REPORT and (self.packet_x or self.packet_y):
+                    self.push(sec * 1000000000 + usec * 1000 - self.clock_offset, self.packet_x, self.packet_y)
+                    self.packet_x = self.packet_y = 0
+
+    def push(self, ts, dx, dy):
+        i = self.head
+        if self.count == RING_SIZE:
+            self.base_x = self.cum_x[i]
+            self.base_y = self.cum_y[i]
+        else:
+            self.count += 1
+        self.total_x += dx
+        self.total_y += dy
+        self.ts[i] = ts
+        self.cum_x[i] = self.total_x
+        self.cum_y[i] = self.total_y
+        self.head = (i + 1) % RING_SIZE
+        self.packets += 1
+
+    def fill(self, out, now, motion=False):
+        # out: IMU_SAMPLES * (ax, ay, az, gx, gy, gz) in Switch units. Mouse
+        # rates are added to the gyro; without motion (no motion sensor) the
+        # accel is set to a controller at rest and the gyro to the mouse alone.
+        ts = self.ts
+        cum_x = self.cum_x
+        cum_y = self.cum_y
+        mark_x = self.mark_x
+        mark_y = self.mark_y
+        i = (self.head - 1) % RING_SIZE
+        left = self.count
+        for m, offset in enumerate(self.offsets):
+            t = now - offset
+            while left and ts[i] > t:
+                i = (i - 1) % RING_SIZE
+                left -= 1
+            if left:
+                mark_x[m] = cum_x[i]
+                mark_y[m] = cum_y[i]
+            else:
+                mark_x[m] = self.base_x
+                mark_y[m] = self.base_y
+
+        smoothing_ns = self.smoothing_ns
+        scale = IMU_SAMPLE_SPACING_NS / smoothing_ns if smoothing_ns else 0
+        base = 0
+        for end, start, smooth_start in self.windows:
+            # Counts inside this sample's window
+            x = mark_x[end] - mark_x[start]
+            y = mark_y[end] - mark_y[start]
+            if smoothing_ns:
+                speed = abs(x) if abs(x) > abs(y) else abs(y)
+                if speed < self.smooth_hi:
+                    # Same rate averaged over the smoothing window
+                    sx = (mark_x[end] - mark_x[smooth_start]) * scale
+                    sy = (mark_y[end] - mark_y[smooth_start]) * scale
+                    w = (speed - self.smooth_lo) / self.smooth_lo if speed > self.smooth_lo else 0.0
+                    x = sx + (x - sx) * w
+                    y = sy + (y - sy) * w
+            if self.curve and (x or y):
+                factor = (math.hypot(x, y) / self.curve_counts) ** self.curve
+                x *= factor
+                y *= factor
+
+            gy = int(y * self.gain_y)
+            gz = int(x * self.gain_x)
+            if motion:
+                out[base + 4] = clamp16(out[base + 4] + gy)
+                out[base + 5] = clamp16(out[base + 5] + gz)
+            else:
+                out[base], out[base + 1], out[base + 2] = REST_ACCEL
+                out[base + 3] = 0
+                out[base + 4] = clamp16(gy)
+                out[base + 5] = clamp16(gz)
+            base += 6
+
+    def snapshot(self):
+        return {
+            'name': self.dev.name,
+            'packets': self.packets,
+            'reads': self.reads,
+            'max_batch': self.max_batch,
+        }
+
+    def close(self):
+        try:
+            self.dev.ungrab()
+        except OSError:
+            pass
+        self.dev.close()
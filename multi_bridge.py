@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Several DS4s bridged to several Pro Controller HID functions from one process.
+#
+#   sudo ./setup_gadget.sh 4                  # /dev/hidg0 .. /dev/hidg3
+#   sudo python3 multi_bridge.py --count 4
+#   sudo python3 multi_bridge.py --gadget /dev/hidg0 --gadget /dev/hidg2
+#
+# Every gadget gets its own ProControllerBridge (state, handshake, output
+# queue), all sharing one TickScheduler: one epoll set, one tick, one
+# process. Controllers are handed out in the order they connect.
+import argparse
+
+from bridge_controller import ProControllerBridge, DeviceRouter, GADGET_PATH, OUTPUT_MODES, INPUT_BACKENDS
+from scheduler import TickScheduler, TICK_PERIODS_MS
+
+
+class MultiBridge:
+    def __init__(self, gadgets, period_ms=15, output_mode='tick', min_gap_ms=4, stats_interval=0,
+                 input_backend='evdev'):
+        # gadgets: gadget paths, or already open fds (int) for test harnesses
+        self.scheduler = TickScheduler(period_ms)
+        self.bridges = []
+        for index, gadget in enumerate(gadgets):
+            # The tick is shared: only the first bridge prints its jitter
+            bridge = ProControllerBridge(gadget if isinstance(gadget, str) else GADGET_PATH,
+                                         period_ms=period_ms, output_mode=output_mode,
+                                         min_gap_ms=min_gap_ms,
+                                         stats_interval=stats_interval if index == 0 else 0,
+                                         input_backend=input_backend)
+            if not isinstance(gadget, str):
+                bridge.gadget_fd = gadget
+            self.bridges.append(bridge)
+        self.input_backend = input_backend
+        self.router = None
+
+    def run(self):
+        for bridge in self.bridges:
+            bridge.open_gadget()
+            bridge.setup(None, scheduler=self.scheduler)
+        print(f"Waiting for up to {len(self.bridges)} DS4...")
+        self.router = DeviceRouter(self.bridges, self.scheduler, self.input_backend)
+        print(f"Pro Controller Emulation Running... ({len(self.bridges)} controllers, "
+              f"{self.scheduler.period_ns // 1000000} ms tick)")
+        try:
+            self.scheduler.run(self.on_tick)
+        except KeyboardInterrupt:
+            print("Stopping...")
+        finally:
+            print(self.scheduler.jitter_summary())
+            for index, bridge in enumerate(self.bridges):
+                print(f"[{index}] link {bridge.link}, latency: {bridge.stats.total.summary()}")
+                bridge.close()
+            self.router.close()
+            self.scheduler.close()
+
+    def on_tick(self, now):
+        for bridge in self.bridges:
+            bridge.on_tick(now)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Several DS4s to several Switch Pro Controller gadgets")
+    parser.add_argument('--gadget', action='append', default=[], help="HID gadget device (repeatable)")
+    parser.add_argument('--gadget-fd', type=int, action='append', default=[],
+                        help="Use an already open gadget fd (repeatable, test harnesses)")
+    parser.add_argument('--count', type=int, default=0,
+                        help="Use /dev/hidg0 .. /dev/hidg(N-1)")
+    parser.add_argument('--period', type=int, choices=TICK_PERIODS_MS, default=15)
+    parser.add_argument('--output-mode', choices=OUTPUT_MODES, default='tick')
+    parser.add_argument('--min-gap', type=float, default=4)
+    parser.add_argument('--input-backend', choices=INPUT_BACKENDS, default='evdev')
+    parser.add_argument('--stats-interval', type=int, default=0,
+                        help="Print tick jitter every N seconds (0 = only on exit)")
+    args = parser.parse_args()
+
+    gadgets = args.gadget + [f"/dev/hidg{i}" for i in range(args.count)] + args.gadget_fd
+    if not gadgets:
+        gadgets = [GADGET_PATH]
+    MultiBridge(gadgets, period_ms=args.period, output_mode=args.output_mode,
+                min_gap_ms=args.min_gap, stats_interval=args.stats_interval,
+                input_backend=args.input_backend).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import evdev
+
+from input_map import InputMap, DS4_BUTTONS, DS4_AXES, DS4_HAT, DS4_TOUCHPAD_BUTTONS
+
+# Controller profiles, keyed by the evdev node id (bus, vendor, product).
+#
+# A profile is the bindings for one family of controllers plus which
+# sibling nodes it has; finding it for a new node is one dict lookup.
+# Axis ranges are not part of the profile: they come from the node's
+# absinfo when the map is compiled (ControllerProfile.input_map), so
+# 0-255 (hid-sony), -32768..32767 (xpad) or anything else all end up on
+# the same 0-255 scale the stick tables are indexed by.
+#
+# Supporting another controller means adding a profile to PROFILES.
+# Nodes that are in no profile but look like a gamepad (BTN_SOUTH and
+# ABS_X) get GENERIC, the kernel gamepad API's standard layout. Its analog
+# triggers (ABS_Z/ABS_RZ) are only bound on nodes that also have
+# ABS_RX/ABS_RY; many hid-generic pads put the right stick on Z/Rz instead.
+#
+# Sibling nodes are told apart by input properties, not names:
+#   INPUT_PROP_ACCELEROMETER -> 'motion'
+#   INPUT_PROP_BUTTONPAD     -> 'touchpad'
+#   has ABS_X                -> 'ds4' (the gamepad itself)
+BUS_USB = 0x03
+BUS_BLUETOOTH = 0x05
+
+SONY = 0x054C
+MICROSOFT = 0x045E
+
+# xpad names the face buttons by their Xbox letters instead of by position,
+# so BTN_X (== BTN_NORTH) is the left button and BTN_Y (== BTN_WEST) the top
+XBOX_BUTTONS = (
+    (('BTN_SOUTH',), 'B'),      # A
+    (('BTN_EAST',), 'A'),       # B
+    (('BTN_X',), 'Y'),          # X
+    (('BTN_Y',), 'X'),          # Y
+    (('BTN_TL',), 'L'),
+    (('BTN_TR',), 'R'),
+    (('BTN_SELECT',), 'MINUS'), # View
+    (('BTN_START',), 'PLUS'),   # Menu
+    (('BTN_MODE',), 'HOME'),    # Xbox
+    (('BTN_THUMBL',), 'LCLICK'),
+    (('BTN_THUMBR',), 'RCLICK'),
+    (('KEY_RECORD',), 'CAPTURE'), # Share (Series X|S)
+)
+
+# Analog triggers: (evdev code, Switch button)
+XBOX_TRIGGERS = (
+    ('ABS_Z', 'ZL'),
+    ('ABS_RZ', 'ZR'),
+)
+
+# Over Bluetooth the pad is a plain HID gamepad (hid-generic/hid-microsoft,
+# not xpad): the right stick is on ABS_Z/ABS_RZ and the triggers are the
+# simulation controls. The buttons come out with the same codes as xpad.
+# The axes are also GENERIC's layout for pads without ABS_RX/ABS_RY.
+XBOX_BT_AXES = (
+    ('ABS_X', 'LX', False),
+    ('ABS_Y', 'LY', True),
+    ('ABS_Z', 'RX', False),
+    ('ABS_RZ', 'RY', True),
+)
+
+XBOX_BT_TRIGGERS = (
+    ('ABS_BRAKE', 'ZL'),
+    ('ABS_GAS', 'ZR'),
+)
+
+
+def ids(vendor, products, buses=(BUS_USB, BUS_BLUETOOTH)):
+    return tuple((bus, vendor, product) for bus in buses for product in products)
+
+
+class ControllerProfile:
+    def __init__(self, name, ids=(), buttons=DS4_BUTTONS, axes=DS4_AXES, hat=DS4_HAT,
+                 triggers=(), touchpad_buttons=(), motion=False, z_axes=None):
+        # z_axes: layout for nodes without ABS_RX/ABS_RY (right stick on
+        # Z/Rz); used with no triggers
+        self.name = name
+        self.ids = ids
+        self.buttons = buttons
+        self.axes = axes
+        self.hat = hat
+        self.triggers = triggers
+        self.z_axes = z_axes
+        self.touchpad_buttons = touchpad_buttons
+        self.motion = motion
+
+    def input_map(self, axis_transform, dev=None):
+        # Gamepad node map, axes rescaled by dev's absinfo ranges
+        ecodes = evdev.ecodes
+        ranges = {}
+        if dev is not None:
+            for code, info in dev.capabilities(absinfo=True).get(ecodes.EV_ABS, ()):
+                ranges[code] = (info.min, info.max)
+        axes, triggers = self.axes, self.triggers
+        if self.z_axes is not None and not (ecodes.ABS_RX in ranges and ecodes.ABS_RY in ranges):
+            axes, triggers = self.z_axes, ()
+        return InputMap(axis_transform, self.buttons, axes, self.hat,
+                        triggers=triggers, ranges=ranges)
+
+    def touchpad_map(self, axis_transform):
+        return InputMap(axis_transform, buttons=self.touchpad_buttons, axes=(), hat=())
+
+    def __repr__(self):
+        return f"ControllerProfile({self.name!r})"
+
+
+DS4 = ControllerProfile('DualShock 4', ids(SONY, (0x05C4, 0x09CC)) + ids(SONY, (0x0BA0,), (BUS_USB,)),
+                        touchpad_buttons=DS4_TOUCHPAD_BUTTONS, motion=True)
+# hid-playstation gives the DualSense the same codes as the DS4
+DUALSENSE = ControllerProfile('DualSense', ids(SONY, (0x0CE6, 0x0DF2)),
+                              touchpad_buttons=DS4_TOUCHPAD_BUTTONS, motion=True)
+XBOX = ControllerProfile('Xbox', ids(MICROSOFT, (0x028E, 0x02D1, 0x02DD, 0x02EA, 0x0B00, 0x0B12), (BUS_USB,)),
+                         buttons=XBOX_BUTTONS, triggers=XBOX_TRIGGERS)
+XBOX_BT = ControllerProfile('Xbox (Bluetooth)', ids(MICROSOFT, (0x02E0, 0x02FD, 0x0B05, 0x0B13), (BUS_BLUETOOTH,)),
+                            buttons=XBOX_BUTTONS, axes=XBOX_BT_AXES, triggers=XBOX_BT_TRIGGERS)
+GENERIC = ControllerProfile('Generic gamepad', triggers=XBOX_TRIGGERS, z_axes=XBOX_BT_AXES)
+
+PROFILES = (DS4, DUALSENSE, XBOX, XBOX_BT)
+
+REGISTRY = {}
+for _profile in PROFILES:
+    for _key in _profile.ids:
+        REGISTRY[_key] = _profile
+del _profile, _key
+
+
+def profile_for(dev):
+    # Registered profile for an evdev node, else GENERIC
+    info = dev.info
+    return REGISTRY.get((info.bustype, info.vendor, info.product), GENERIC)
+
+
+def classify_node(dev):
+    # -> (slot, profile) for a node of a supported controller, else None
+    ecodes = evdev.ecodes
+    info = dev.info
+    profile = REGISTRY.get((info.bustype, info.vendor, info.product))
+    if profile is not None:
+        props = dev.input_props()
+        if ecodes.INPUT_PROP_ACCELEROMETER in props:
+            return ('motion', profile) if profile.motion else None
+        if ecodes.INPUT_PROP_BUTTONPAD in props:
+            return ('touchpad', profile) if profile.touchpad_buttons else None
+    caps = dev.capabilities(absinfo=False)
+    if ecodes.ABS_X not in caps.get(ecodes.EV_ABS, ()):
+        return None # Keyboards, mice, a pad's consumer-control keys, ...
+    if profile is None:
+        if ecodes.BTN_SOUTH not in caps.get(ecodes.EV_KEY, ()):
+            return None
+        profile = GENERIC
+    return 'ds4', profile
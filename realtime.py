@@ -0,0 +1,124 @@
+import ctypes
+import gc
+import os
+import time
+
+# Realtime execution for the bridge loop (--realtime).
+#
+# On a Pi Zero 2 W, BlueZ, WiFi and logging share the four cores with us.
+# SCHED_FIFO keeps them from preempting the loop, pinning keeps it on one
+# (ideally isolated) core, mlockall stops page faults in the hot path, and
+# a frozen, disabled GC stops a collection from landing in the middle of a
+# report. Collections run from idle() instead, right after a tick, when the
+# loop has most of a period to spare.
+#
+# Every setting is read back after applying it. A failure (no CAP_SYS_NICE,
+# RLIMIT_MEMLOCK too low, ...) is reported and the rest still applies.
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+# Threaded IRQ handlers run at FIFO 50; staying below them keeps USB and
+# Bluetooth delivering our input while still beating every normal task.
+DEFAULT_PRIORITY = 40
+
+GC_IDLE_PERIOD_NS = 1000000000
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+def locked_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmLck:'):
+                return int(line.split()[1])
+    return 0
+
+
+class Realtime:
+    def __init__(self, priority=DEFAULT_PRIORITY, cpu=None, lock_memory=True, gc_idle=True):
+        # priority 0 leaves the scheduling policy alone, cpu None the affinity
+        self.priority = priority
+        self.cpu = cpu
+        self.lock_memory = lock_memory
+        self.gc_idle = gc_idle
+        self.results = [] # (setting, ok, detail)
+        self.applied = False # apply() has run (not before a baseline ends)
+
+        self.next_gc = 0
+        self.gc_runs = 0
+        self.gc_max_ns = 0
+
+    def apply(self):
+        # Returns True if every requested setting took effect
+        if self.priority:
+            self._check('SCHED_FIFO', self._set_fifo)
+        if self.cpu is not None:
+            self._check('affinity', self._set_affinity)
+        if self.lock_memory:
+            self._check('mlockall', self._lock_memory)
+        if self.gc_idle:
+            self._check('gc', self._freeze_gc)
+        self.applied = True
+        return all(ok for _, ok, _ in self.results)
+
+    def _check(self, name, setter):
+        try:
+            detail = setter()
+            ok = True
+        except OSError as e:
+            ok, detail = False, e.strerror
+        self.results.append((name, ok, detail))
+        print(f"realtime: {name} {'ok' if ok else 'FAILED'} ({detail})")
+
+    def _set_fifo(self):
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+        policy = os.sched_getscheduler(0)
+        priority = os.sched_getparam(0).sched_priority
+        if policy != os.SCHED_FIFO or priority != self.priority:
+            raise OSError(0, f"policy {policy} priority {priority} after setting")
+        return f"priority {priority}"
+
+    def _set_affinity(self):
+        os.sched_setaffinity(0, {self.cpu})
+        cpus = os.sched_getaffinity(0)
+        if cpus != {self.cpu}:
+            raise OSError(0, f"running on cpus {sorted(cpus)}")
+        return f"cpu {self.cpu}"
+
+    def _lock_memory(self):
+        if _libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        kb = locked_kb()
+        if not kb:
+            raise OSError(0, "VmLck is 0 after mlockall")
+        return f"{kb} kB locked"
+
+    def _freeze_gc(self):
+        # Everything alive after startup (modules, tables, buffers) moves to
+        # the permanent generation and is never scanned again
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+        if gc.isenabled():
+            raise OSError(0, "collector still enabled")
+        return f"{gc.get_freeze_count()} objects frozen, collecting at idle"
+
+    def idle(self, now):
+        # Call right after a tick's report went out
+        if not self.gc_idle or now < self.next_gc:
+            return
+        self.next_gc = now + GC_IDLE_PERIOD_NS
+        start = time.monotonic_ns()
+        gc.collect(1)
+        elapsed = time.monotonic_ns() - start
+        self.gc_runs += 1
+        if elapsed > self.gc_max_ns:
+            self.gc_max_ns = elapsed
+
+    def snapshot(self):
+        return {
+            'settings': {name: ok for name, ok, _ in self.results},
+            'gc_runs': self.gc_runs,
+            'gc_max_us': round(self.gc_max_ns / 1000, 1),
+        }
@@ -0,0 +1,80 @@
+import os
+import struct
+import time
+
+# Append-only binary log of everything crossing the bridge.
+#
+# File:   MAGIC, then records
+# Record: RECORD_HEADER (monotonic ns, type, payload length) + payload
+#   REC_SESSION    '<Q' wall clock ns when recording started (sessions may be appended)
+#   REC_EVDEV      EVDEV_PAYLOAD: kernel timestamp ns, type, code, value
+#   REC_GADGET_OUT output report read from the gadget (Switch -> us)
+#   REC_GADGET_IN  input report written to the gadget (us -> Switch)
+#   REC_MOTION     EVDEV_PAYLOAD from the motion sensor node
+#   REC_TOUCHPAD   EVDEV_PAYLOAD from the touchpad node
+#   REC_HIDRAW     raw DS4 input report (hidraw backend)
+MAGIC = b'A2NSREC1'
+RECORD_HEADER = struct.Struct('<QBB')
+EVDEV_PAYLOAD = struct.Struct('<qHHi')
+SESSION_PAYLOAD = struct.Struct('<Q')
+
+REC_SESSION = 0
+REC_EVDEV = 1
+REC_GADGET_OUT = 2
+REC_GADGET_IN = 3
+REC_MOTION = 4
+REC_TOUCHPAD = 5
+REC_HIDRAW = 6
+
+
+class Recorder:
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'ab', buffering=65536)
+        if new:
+            self.file.write(MAGIC)
+        self.records = 0
+        self._write(REC_SESSION, SESSION_PAYLOAD.pack(time.time_ns()))
+
+    def _write(self, rec_type, payload):
+        self.file.write(RECORD_HEADER.pack(time.monotonic_ns(), rec_type, len(payload)))
+        self.file.write(payload)
+        self.records += 1
+
+    def evdev(self, event, rec_type=REC_EVDEV):
+        self._write(rec_type, EVDEV_PAYLOAD.pack(event.sec * 1000000000 + event.usec * 1000,
+                                                  event.type, event.code, event.value))
+
+    def hidraw(self, report):
+        self._write(REC_HIDRAW, report)
+
+    def gadget_out(self, data):
+        self._write(REC_GADGET_OUT, data)
+
+    def gadget_in(self, report):
+        self._write(REC_GADGET_IN, report)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_records(path):
+    # Yields (monotonic ns, type, payload)
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a bridge recording")
+        data = f.read()
+
+    offset = 0
+    size = len(data)
+    view = memoryview(data)
+    while offset + RECORD_HEADER.size <= size:
+        ts, rec_type, length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > size:
+            break # Truncated tail (recording killed mid-write)
+        yield ts, rec_type, view[offset:offset + length]
+        offset += length
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# Replay a --record log through ProControllerBridge against a fake gadget.
+#
+#   python3 replay.py session.bin              # full speed (benchmark the hot loop)
+#   python3 replay.py session.bin --realtime   # recorded timing, real event loop
+#
+# Needs neither a DS4 nor a Switch. Output/subcommand replies produced by the
+# bridge are compared with the ones in the recording.
+import argparse
+import json
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+import evdev
+
+from bridge_controller import ProControllerBridge, GADGET_PATH, OUTPUT_MODES
+from fake_gadget import FakeGadget
+from recorder import (read_records, EVDEV_PAYLOAD, REC_SESSION, REC_EVDEV,
+                      REC_GADGET_OUT, REC_GADGET_IN, REC_MOTION, REC_TOUCHPAD, REC_HIDRAW)
+from scheduler import TICK_PERIODS_MS
+
+# Realtime feed message: type, then payload (evdev payload carries the feed time)
+FEED_HEADER = struct.Struct('<B')
+FEED_END = 0xFF
+
+EVDEV_RECORDS = (REC_EVDEV, REC_MOTION, REC_TOUCHPAD)
+
+
+def feed_event(bridge, rec_type, kernel_ts, ev_type, code, value):
+    # Route a recorded event to the handler of the node it was read from
+    event = evdev.InputEvent(kernel_ts // 1000000000, (kernel_ts % 1000000000) // 1000,
+                             ev_type, code, value)
+    if rec_type == REC_MOTION:
+        bridge.process_motion_event(event)
+    elif rec_type == REC_TOUCHPAD:
+        bridge.process_ds4_event(event, bridge.touchpad_map.table, 'touchpad')
+    else:
+        bridge.process_ds4_event(event)
+
+
+def same_reply(produced, recorded):
+    # Timer and live input state legitimately differ between runs
+    if produced[0] != recorded[0]:
+        return False
+    if produced[0] == 0x21:
+        return produced[13:] == recorded[13:]
+    return produced == recorded
+
+
+def compare_replies(produced, recorded):
+    mismatches = 0
+    for a, b in zip(produced, recorded):
+        if not same_reply(a, b):
+            mismatches += 1
+    return mismatches + abs(len(produced) - len(recorded))
+
+
+def replay_fast(bridge, gadget, records):
+    # Drive the bridge directly on the recording's timeline, as fast as possible
+    period = bridge.scheduler.period_ns
+    sim = [0]
+    bridge.clock = lambda: sim[0]
+    scheduler = bridge.scheduler
+    next_tick = 0
+    events = 0
+    recorded_replies = []
+
+    def advance(ts):
+        nonlocal next_tick
+        while True:
+            due = next_tick
+            if scheduler.alarm_at and scheduler.alarm_at < due:
+                due = scheduler.alarm_at
+            if ts < due:
+                break
+            sim[0] = due
+            if due == scheduler.alarm_at:
+                callback = scheduler.alarm_cb
+                scheduler.cancel_alarm(callback)
+                callback(due)
+            else:
+                bridge.on_tick(due)
+                next_tick += period
+                gadget.drain()
+        sim[0] = ts
+
+    start = time.perf_counter()
+    for ts, rec_type, payload in records:
+        if rec_type == REC_SESSION or not next_tick:
+            next_tick = ts + period
+            scheduler.cancel_alarm()
+            if rec_type == REC_SESSION:
+                continue
+        advance(ts)
+
+        if rec_type in EVDEV_RECORDS:
+            bridge.read_ts = ts
+            feed_event(bridge, rec_type, *EVDEV_PAYLOAD.unpack(payload))
+            events += 1
+        elif rec_type == REC_HIDRAW:
+            bridge.read_ts = ts
+            bridge.process_hid_report(bytes(payload))
+            events += 1
+        elif rec_type == REC_GADGET_OUT:
+            bridge.handle_output_report(bytes(payload))
+            gadget.drain()
+        elif rec_type == REC_GADGET_IN and payload[0] != 0x30:
+            recorded_replies.append(bytes(payload))
+    elapsed = time.perf_counter() - start
+    gadget.drain()
+    return events, elapsed, recorded_replies
+
+
+def feed_realtime(sock, records, speed):
+    # Feeder thread: sends records into the loop at their recorded offsets
+    base_rec = None
+    base_now = 0
+    for ts, rec_type, payload in records:
+        if rec_type == REC_SESSION:
+            base_rec = None
+            continue
+        if rec_type not in (REC_GADGET_OUT, REC_HIDRAW) and rec_type not in EVDEV_RECORDS:
+            continue
+        if base_rec is None:
+            base_rec = ts
+            base_now = time.monotonic_ns()
+        due = base_now + int((ts - base_rec) / speed)
+        delay = due - time.monotonic_ns()
+        if delay > 0:
+            time.sleep(delay / 1e9)
+        if rec_type in EVDEV_RECORDS:
+            # Re-stamp the event with the time it is fed, like the kernel would
+            _, ev_type, code, value = EVDEV_PAYLOAD.unpack(payload)
+            payload = EVDEV_PAYLOAD.pack(time.monotonic_ns(), ev_type, code, value)
+        sock.send(FEED_HEADER.pack(rec_type) + bytes(payload))
+    sock.send(FEED_HEADER.pack(FEED_END))
+
+
+def replay_realtime(bridge, gadget, records, speed):
+    records = list(records)
+    recorded_replies = [bytes(p) for _, t, p in records if t == REC_GADGET_IN and p[0] != 0x30]
+    feed_rx, feed_tx = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    feed_rx.setblocking(False)
+    events = 0
+    outputs = 0 # Output reports forwarded to the gadget
+
+    def on_feed(fd, mask):
+        nonlocal events, outputs
+        bridge.read_ts = bridge.clock()
+        while True:
+            try:
+                msg = feed_rx.recv(128)
+            except BlockingIOError:
+                return
+            rec_type = msg[0]
+            if rec_type in EVDEV_RECORDS:
+                feed_event(bridge, rec_type, *EVDEV_PAYLOAD.unpack_from(msg, 1))
+                events += 1
+            elif rec_type == REC_HIDRAW:
+                bridge.process_hid_report(msg[1:])
+                events += 1
+            elif rec_type == REC_GADGET_OUT:
+                gadget.write_output(msg[1:])
+                outputs += 1
+            elif rec_type == FEED_END:
+                # Output reports written just before the end are still
+                # queued on the gadget: handle them before the loop stops
+                # (one read each, so at most all of them are left)
+                for _ in range(outputs):
+                    if not select.select([bridge.gadget_fd], [], [], 0)[0]:
+                        break
+                    bridge.on_gadget_readable(bridge.gadget_fd, select.EPOLLIN)
+                bridge.scheduler.stop()
+                return
+
+    bridge.scheduler.register(feed_rx.fileno(), on_feed)
+    bridge.scheduler.register(gadget.host_end.fileno(), gadget.drain)
+    feeder = threading.Thread(target=feed_realtime, args=(feed_tx, records, speed), daemon=True)
+
+    start = time.perf_counter()
+    feeder.start()
+    bridge.scheduler.run(bridge.on_tick)
+    elapsed = time.perf_counter() - start
+    feeder.join()
+    gadget.drain()
+    feed_rx.close()
+    feed_tx.close()
+    return events, elapsed, recorded_replies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a bridge recording against a fake gadget")
+    parser.add_argument('log', help="File written by bridge_controller.py --record")
+    parser.add_argument('--realtime', action='store_true',
+                        help="Keep recorded timing and run the real event loop")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="Realtime playback speed factor")
+    parser.add_argument('--period', type=int, choices=TICK_PERIODS_MS, default=15)
+    parser.add_argument('--output-mode', choices=OUTPUT_MODES, default='tick')
+    parser.add_argument('--min-gap', type=float, default=4)
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    gadget = FakeGadget()
+    bridge = ProControllerBridge(GADGET_PATH, period_ms=args.period,
+                                 output_mode=args.output_mode, min_gap_ms=args.min_gap)
+    bridge.gadget_fd = gadget.fileno()
+    bridge.setup(None)
+
+    records = read_records(args.log)
+    if args.realtime:
+        events, elapsed, recorded_replies = replay_realtime(bridge, gadget, records, args.speed)
+    else:
+        events, elapsed, recorded_replies = replay_fast(bridge, gadget, records)
+
+    summary = {
+        'mode': 'realtime' if args.realtime else 'fast',
+        'events': events,
+        'elapsed_s': round(elapsed, 4),
+        'events_per_s': round(events / elapsed) if elapsed else 0,
+        'reports': {f"0x{k:02x}": v for k, v in sorted(gadget.counts.items())},
+        'reply_mismatches': compare_replies(gadget.replies, recorded_replies),
+        'stats': bridge.stats_snapshot(),
+    }
+    bridge.close()
+    bridge.scheduler.close()
+    gadget.close()
+
+    if args.json:
+        print(json.dumps(summary, indent=1))
+    else:
+        print(f"{summary['events']} events in {summary['elapsed_s']} s "
+              f"({summary['events_per_s']} events/s, {summary['mode']})")
+        print(f"reports: {summary['reports']}, reply mismatches: {summary['reply_mismatches']}")
+        print(summary['stats']['tick'])
+        print(f"latency total: {summary['stats']['latency']['total']}")
+    return 1 if summary['reply_mismatches'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
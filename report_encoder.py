@@ -0,0 +1,133 @@
+import struct
+
+from motion import IMU_STRUCT
+
+# Standard input report layout shared by 0x30 (full input) and 0x21 (subcommand reply)
+# 0: Report ID
+# 1: Timer
+# 2: Battery/Connection (0x81 = Battery High/USB)
+# 3-5: Buttons (btns & 0xFFFFFF, hat lives in byte 5)
+# 6-8: Left Stick (12-bit X | 12-bit Y << 12)
+# 9-11: Right Stick
+# 12: Vibrator report
+# 0x30: 13-48 6-Axis data (3 samples)
+# 0x21: 13 Ack, 14 Subcmd echo, 15- Reply data
+REPORT_SIZE = 64
+BATTERY_USB = 0x81
+
+OFS_TIMER = 1
+OFS_BATTERY = 2
+OFS_BUTTONS = 3
+OFS_LSTICK = 6
+OFS_RSTICK = 9
+OFS_VIBRATOR = 12
+OFS_IMU = 13
+OFS_ACK = 13
+OFS_SUBCMD = 14
+OFS_REPLY = 15
+
+STICK_CENTER = 0x800 | (0x800 << 12)
+BUTTONS_NEUTRAL = 0x08 << 16 # Nothing pressed, hat centered
+
+# 24-bit little endian field (buttons, packed sticks)
+U24 = struct.Struct('<HB')
+
+_REPLY_CLEAR = bytes(REPORT_SIZE - OFS_REPLY)
+
+
+def pack_stick(x, y):
+    return x | (y << 12)
+
+
+class ReportEncoder:
+    # Owns the preallocated report buffers and is the single place that knows
+    # the report layout. Only fields that differ from what a buffer already
+    # holds are re-packed, so an idle frame costs one timer byte write.
+    #
+    # 0x30 frames are double buffered: the frame handed out last may still be
+    # waiting to be written while the next one is built.
+
+    def __init__(self):
+        self.timer = 0
+
+        # Current controller state
+        self.btns = BUTTONS_NEUTRAL
+        self.lstick = STICK_CENTER
+        self.rstick = STICK_CENTER
+
+        self.frames = (self._new_buffer(0x30), self._new_buffer(0x30))
+        # Values currently packed in each frame: [btns, lstick, rstick, imu batch]
+        self.frame_state = ([0, STICK_CENTER, STICK_CENTER, None], [0, STICK_CENTER, STICK_CENTER, None])
+        self.frame_index = 0
+
+        self.reply = self._new_buffer(0x21)
+        self.reply_state = [0, STICK_CENTER, STICK_CENTER]
+
+    def _new_buffer(self, report_id):
+        buf = bytearray(REPORT_SIZE)
+        buf[0] = report_id
+        buf[OFS_BATTERY] = BATTERY_USB
+        U24.pack_into(buf, OFS_LSTICK, STICK_CENTER & 0xFFFF, STICK_CENTER >> 16)
+        U24.pack_into(buf, OFS_RSTICK, STICK_CENTER & 0xFFFF, STICK_CENTER >> 16)
+        return buf
+
+    def set_state(self, btns, lstick, rstick):
+        # Sticks are packed 24-bit values (see pack_stick).
+        # Returns True if anything changed since the last call.
+        if btns == self.btns and lstick == self.lstick and rstick == self.rstick:
+            return False
+        self.btns = btns
+        self.lstick = lstick
+        self.rstick = rstick
+        return True
+
+    def _sync(self, buf, state):
+        # Bring the input fields of buf up to date with the current state
+        if state[0] != self.btns:
+            btns = self.btns
+            U24.pack_into(buf, OFS_BUTTONS, btns & 0xFFFF, (btns >> 16) & 0xFF)
+            state[0] = btns
+        if state[1] != self.lstick:
+            stick = self.lstick
+            U24.pack_into(buf, OFS_LSTICK, stick & 0xFFFF, stick >> 16)
+            state[1] = stick
+        if state[2] != self.rstick:
+            stick = self.rstick
+            U24.pack_into(buf, OFS_RSTICK, stick & 0xFFFF, stick >> 16)
+            state[2] = stick
+
+    def build_0x30(self, imu=None):
+        # imu: optional 18 int16 values (3 samples of accel xyz + gyro xyz,
+        # Switch units). Without it the frame keeps the previous IMU bytes.
+        # A tuple (constant batch such as REST_IMU) is only packed into a
+        # frame that does not hold it already.
+        self.timer = (self.timer + 1) & 0xFF
+        index = self.frame_index ^ 1
+        self.frame_index = index
+
+        buf = self.frames[index]
+        buf[OFS_TIMER] = self.timer
+        state = self.frame_state[index]
+        self._sync(buf, state)
+        if imu is not None and not (imu is state[3] and type(imu) is tuple):
+            IMU_STRUCT.pack_into(buf, OFS_IMU, *imu)
+            state[3] = imu
+        return buf
+
+    def build_0x21(self, ack, subcmd, data=b'', more=None):
+        # Subcommand reply carries the current input state plus Ack/Subcmd/Data.
+        # data (and more, placed right after it) may be any bytes-like object
+        # (e.g. a memoryview); they are copied straight into the buffer.
+        buf = self.reply
+        buf[OFS_TIMER] = self.timer
+        self._sync(buf, self.reply_state)
+        buf[OFS_ACK] = ack
+        buf[OFS_SUBCMD] = subcmd
+        buf[OFS_REPLY:] = _REPLY_CLEAR
+        end = OFS_REPLY
+        if data:
+            end += len(data)
+            buf[OFS_REPLY:end] = data
+        if more:
+            buf[end:end + len(more)] = more
+        return buf
@@ -0,0 +1,154 @@
+import evdev
+from evdev import ecodes
+
+from workers import LatestValueWorker
+
+# HD rumble from the Switch (output reports 0x01 and 0x10, data[2:10]) to
+# the DS4's FF_RUMBLE motors.
+#
+# Each 8-byte frame is two 4-byte actuator commands (left, right), each a
+# high band and a low band with their own frequency and amplitude:
+#   b0, b1 bit 0   high band frequency (9 bits)
+#   b1 bits 1-7    high band amplitude code
+#   b2 bits 0-6    low band frequency
+#   b2 bit 7, b3   low band amplitude code (b3 - 0x40) * 2 + bit 7
+# Amplitude codes 0..100 are logarithmic (see amplitude()). Frequencies are
+# dropped: the DS4 has a heavy (strong) and a light (weak) motor, which take
+# the low and the high bands, the louder side of the two winning.
+#
+# Decoding is one table lookup per band in the loop; the effect upload runs
+# on a LatestValueWorker so a slow Bluetooth write never stalls the loop.
+AMP_CODES = 101
+RUMBLE_MIN_INTERVAL_MS = 20 # DS4 output reports over Bluetooth, ~50 Hz is plenty
+
+
+def amplitude(code):
+    # Inverse of the encoder's piecewise log curve, 0.0 .. 1.0
+    if code <= 0:
+        return 0.0
+    if code <= 16:
+        return 0.12 * 2 ** ((code - 16) / 4)
+    if code <= 32:
+        return 2 ** (code / 16) / 17
+    return min(1.0, 2 ** (code / 32) / 8.7)
+
+
+# Amplitude code -> FF magnitude (0..0xFFFF); codes past 100 are clamped
+AMP_TO_MAGNITUDE = tuple(round(amplitude(min(code, AMP_CODES - 1)) * 0xFFFF) for code in range(256))
+
+
+def decode_rumble(frame):
+    # 8-byte HD rumble frame -> (strong, weak) FF magnitudes
+    table = AMP_TO_MAGNITUDE
+    left_hf = table[frame[1] >> 1]
+    right_hf = table[frame[5] >> 1]
+    left_lf = table[max(0, ((frame[3] - 0x40) << 1) | (frame[2] >> 7))]
+    right_lf = table[max(0, ((frame[7] - 0x40) << 1) | (frame[6] >> 7))]
+    return max(left_lf, right_lf), max(left_hf, right_hf)
+
+
+class RumbleForwarder:
+    # Hot path: frame(data) from handle_output_report. Unchanged frames stop
+    # there; changed ones go to the worker as (device path, strong, weak).
+    # The worker opens its own fd on the DS4 node, so the loop closing its
+    # InputDevice on a disconnect never races an upload in flight.
+
+    def __init__(self, min_interval_ms=RUMBLE_MIN_INTERVAL_MS):
+        self.path = None # DS4 main node to rumble, None = no controller
+        self.last_frame = None
+        self.last_value = (0, 0)
+        self.received = 0
+        self.unchanged = 0
+
+        # Worker side
+        self.dev = None
+        self.dev_path = None
+        self.effect_id = -1
+        self.worker = LatestValueWorker(self._apply, int(min_interval_ms * 1000000), name='rumble')
+
+    def frame(self, data):
+        self.received += 1
+        frame = data[2:10]
+        if frame == self.last_frame:
+            self.unchanged += 1
+            return
+        self.last_frame = frame
+        value = decode_rumble(frame)
+        if value == self.last_value:
+            self.unchanged += 1
+            return
+        self.last_value = value
+        if self.path:
+            self.worker.submit((self.path, value[0], value[1]))
+
+    def attach(self, path):
+        self.path = path
+        if self.last_value != (0, 0):
+            self.worker.submit((path, self.last_value[0], self.last_value[1]))
+
+    def detach(self):
+        self.path = None
+        self.worker.submit((None, 0, 0))
+
+    def stop(self):
+        # Host gone: motors off, the next frame starts over
+        self.last_frame = None
+        if self.last_value != (0, 0):
+            self.last_value = (0, 0)
+            if self.path:
+                self.worker.submit((self.path, 0, 0))
+
+    def _apply(self, value):
+        # Worker thread
+        path, strong, weak = value
+        if path != self.dev_path:
+            self._close_dev()
+            self.dev_path = path
+            if path is None:
+                return
+            dev = evdev.InputDevice(path)
+            if ecodes.FF_RUMBLE not in dev.capabilities().get(ecodes.EV_FF, ()):
+                dev.close()
+                return
+            self.dev = dev
+        if self.dev is None:
+            return
+
+        ff = evdev.ff
+        effect = ff.Effect(ecodes.FF_RUMBLE, self.effect_id, 0, ff.Trigger(0, 0), ff.Replay(0, 0),
+                           ff.EffectType(ff_rumble_effect=ff.Rumble(strong_magnitude=strong,
+                                                                    weak_magnitude=weak)))
+        try:
+            # Re-uploading a playing effect updates it in place; length 0 plays
+            # until the next update (a zero effect silences the motors)
+            new = self.effect_id < 0
+            self.effect_id = self.dev.upload_effect(effect)
+            if new:
+                self.dev.write(ecodes.EV_FF, self.effect_id, 1)
+        except OSError:
+            self._close_dev() # Node gone; reopened on the next attach
+            self.dev_path = None
+            raise
+
+    def _close_dev(self):
+        if self.dev is not None:
+            try:
+                self.dev.close() # Also erases our effects
+            except OSError:
+                pass
+        self.dev = None
+        self.effect_id = -1
+
+    def snapshot(self):
+        worker = self.worker
+        return {
+            'received': self.received,
+            'merged': self.unchanged + worker.merged,
+            'sent': worker.sent,
+            'errors': worker.errors,
+        }
+
+    def close(self):
+        self.path = None
+        self.worker.submit((None, 0, 0))
+        self.worker.close()
@@ -0,0 +1,186 @@
+import os
+import select
+import time
+
+# Supported report cadences (ms)
+# 15 ms ~ 66 Hz (original keepalive), 8 ms = 125 Hz, 4 ms = 250 Hz
+TICK_PERIODS_MS = (15, 8, 4)
+
+# Python >= 3.13 exposes timerfd directly. Older interpreters (Pi OS ships 3.11)
+# fall back to waiting on the epoll fd with select(), which takes a microsecond
+# timeout (epoll.poll() rounds its timeout up to whole milliseconds).
+HAVE_TIMERFD = hasattr(os, 'timerfd_create')
+
+
+class TickScheduler:
+    # Periodic tick on absolute CLOCK_MONOTONIC deadlines.
+    # Between ticks we block in epoll on the registered fds, so input is handled
+    # as soon as it arrives and the tick never drifts (deadline += period, not
+    # now + period). Wall clock jumps do not affect it.
+
+    def __init__(self, period_ms=15):
+        self.period_ns = int(period_ms * 1000000)
+        self.epoll = select.epoll()
+        self.handlers = {}
+        self.running = False
+
+        self.timer_fd = -1
+        if HAVE_TIMERFD:
+            self.timer_fd = os.timerfd_create(time.CLOCK_MONOTONIC,
+                                              flags=os.TFD_NONBLOCK | os.TFD_CLOEXEC)
+            self.epoll.register(self.timer_fd, select.EPOLLIN)
+
+        self.next_deadline = 0
+        self.last_tick = 0
+
+        # One-shot alarms between ticks (e.g. a rate limited early report),
+        # at most one pending per callback. alarm_at/alarm_cb is the earliest.
+        self.alarms = {}
+        self.alarm_at = 0
+        self.alarm_cb = None
+
+        # Jitter stats: lateness = actual tick time - deadline
+        self.ticks = 0
+        self.missed = 0
+        self.late_sum = 0
+        self.late_max = 0
+        self.interval_min = 0
+        self.interval_max = 0
+
+    def register(self, fd, handler, mask=select.EPOLLIN):
+        # handler(fd, event_mask) is called from the loop when fd is ready
+        self.handlers[fd] = handler
+        self.epoll.register(fd, mask)
+
+    def modify(self, fd, mask):
+        self.epoll.modify(fd, mask)
+
+    def unregister(self, fd):
+        if self.handlers.pop(fd, None) is not None:
+            try:
+                self.epoll.unregister(fd)
+            except (OSError, ValueError):
+                pass # Already closed
+
+    def set_alarm(self, when_ns, callback):
+        # callback(now_ns) runs once at when_ns. Setting it again for the same
+        # callback moves the pending alarm.
+        self.alarms[callback] = when_ns
+        self._next_alarm()
+
+    def cancel_alarm(self, callback=None):
+        # Cancels the alarm of callback, or all of them
+        if callback is None:
+            self.alarms.clear()
+        else:
+            self.alarms.pop(callback, None)
+        self._next_alarm()
+
+    def _next_alarm(self):
+        alarms = self.alarms
+        if alarms:
+            self.alarm_cb = min(alarms, key=alarms.get)
+            self.alarm_at = alarms[self.alarm_cb]
+        else:
+            self.alarm_at = 0
+            self.alarm_cb = None
+
+    def stop(self):
+        self.running = False
+
+    def run(self, on_tick):
+        # on_tick(now_ns) runs once per period, after pending fd events.
+        period = self.period_ns
+        self.running = True
+        self.next_deadline = time.monotonic_ns() + period
+        self.last_tick = 0
+
+        if self.timer_fd >= 0:
+            os.timerfd_settime_ns(self.timer_fd, flags=os.TFD_TIMER_ABSTIME,
+                                  initial=self.next_deadline, interval=period)
+
+        handlers = self.handlers
+        while self.running:
+            # Next wakeup we have to arrange ourselves (timerfd covers ticks)
+            wake = self.alarm_at
+            if self.timer_fd < 0 and (not wake or self.next_deadline < wake):
+                wake = self.next_deadline
+
+            if wake:
+                remaining = wake - time.monotonic_ns()
+                if remaining > 0:
+                    r, _, _ = select.select([self.epoll], [], [], remaining / 1e9)
+                    events = self.epoll.poll(0) if r else ()
+                else:
+                    events = self.epoll.poll(0)
+            else:
+                events = self.epoll.poll()
+
+            for fd, mask in events:
+                if fd == self.timer_fd:
+                    try:
+                        os.read(self.timer_fd, 8) # Expiration count, tracked below
+                    except BlockingIOError:
+                        pass
+                    continue
+                handler = handlers.get(fd)
+                if handler:
+                    handler(fd, mask)
+
+            now = time.monotonic_ns()
+            if self.alarm_at and now >= self.alarm_at:
+                callback = self.alarm_cb
+                self.cancel_alarm(callback)
+                callback(now)
+
+            if now >= self.next_deadline:
+                self._account(now)
+                on_tick(now)
+
+    def _account(self, now):
+        period = self.period_ns
+        late = now - self.next_deadline
+        self.ticks += 1
+        self.late_sum += late
+        if late > self.late_max:
+            self.late_max = late
+
+        if self.last_tick:
+            interval = now - self.last_tick
+            if not self.interval_min or interval < self.interval_min:
+                self.interval_min = interval
+            if interval > self.interval_max:
+                self.interval_max = interval
+        self.last_tick = now
+
+        # Stay on the original grid. If we stalled for whole periods, skip
+        # them instead of bursting catch-up ticks.
+        self.next_deadline += period
+        if now >= self.next_deadline:
+            skipped = (now - self.next_deadline) // period + 1
+            self.missed += skipped
+            self.next_deadline += skipped * period
+
+    def jitter_summary(self):
+        if not self.ticks:
+            return "tick: no samples"
+        period_ms = self.period_ns / 1e6
+        return (f"tick: {period_ms:g} ms ({1000 / period_ms:.0f} Hz), {self.ticks} ticks, "
+                f"{self.missed} missed, late avg {self.late_sum / self.ticks / 1000:.0f} us "
+                f"max {self.late_max / 1000:.0f} us, interval "
+                f"{self.interval_min / 1e6:.2f}-{self.interval_max / 1e6:.2f} ms")
+
+    def reset_stats(self):
+        self.ticks = 0
+        self.missed = 0
+        self.late_sum = 0
+        self.late_max = 0
+        self.interval_min = 0
+        self.interval_max = 0
+        self.last_tick = 0
+
+    def close(self):
+        self.epoll.close()
+        if self.timer_fd >= 0:
+            os.close(self.timer_fd)
+            self.timer_fd = -1
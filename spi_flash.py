@@ -0,0 +1,41 @@
+import mmap
+import os
+
+# Virtual SPI flash of a Pro Controller (512 KiB, erased bytes read 0xFF).
+#
+# The console reads calibration, colors and pairing data from it with
+# subcommand 0x10 (address '<I', length). The image is either blank or a
+# dump of a real controller; known entries are overlaid on top.
+SPI_SIZE = 0x80000
+
+
+class SpiFlash:
+    def __init__(self, dump=None, overlay=None):
+        # dump: path to a raw flash dump. It is mapped copy-on-write, so
+        # overlays never reach the file and untouched pages are never read.
+        # overlay: {address: bytes}, applied in ascending address order
+        # (a later entry wins where two overlap).
+        self.image = None
+        if dump:
+            with open(dump, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size >= SPI_SIZE:
+                    self.image = mmap.mmap(f.fileno(), SPI_SIZE, access=mmap.ACCESS_COPY)
+                else:
+                    data = f.read()
+        if self.image is None:
+            self.image = bytearray(b'\xFF') * SPI_SIZE
+            if dump:
+                self.image[:len(data)] = data
+        self.view = memoryview(self.image)
+
+        if overlay:
+            for addr in sorted(overlay):
+                data = overlay[addr]
+                self.view[addr:addr + len(data)] = data
+
+    def read(self, addr, length):
+        # Zero-copy slice of the image (clipped at the end of the flash)
+        if addr >= SPI_SIZE:
+            return self.view[0:0]
+        return self.view[addr:min(addr + length, SPI_SIZE)]
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import fcntl
+import socket
+import struct
+from array import array
+
+# evdev timestamps default to CLOCK_REALTIME. EVIOCSCLOCKID switches a
+# device fd to CLOCK_MONOTONIC so they compare directly with time.monotonic_ns().
+EVIOCSCLOCKID = 0x400445a0
+
+# Histogram resolution: 2^SUB_BITS buckets per power of two (~12% wide)
+SUB_BITS = 3
+SUB_COUNT = 1 << SUB_BITS
+BUCKETS = 48 * SUB_COUNT # Covers up to 2^48 ns (~3 days)
+
+# Latency stages, in pipeline order
+STAGES = ('kernel_to_read', 'read_to_build', 'build_to_write', 'total')
+
+
+def use_monotonic_timestamps(fd):
+    try:
+        fcntl.ioctl(fd, EVIOCSCLOCKID, struct.pack('i', time.CLOCK_MONOTONIC))
+        return True
+    except OSError:
+        return False
+
+
+def bucket_index(value):
+    if value < SUB_COUNT:
+        return value if value > 0 else 0
+    exp = value.bit_length() - 1
+    index = (exp - SUB_BITS + 1) * SUB_COUNT + ((value >> (exp - SUB_BITS)) & (SUB_COUNT - 1))
+    return index if index < BUCKETS else BUCKETS - 1
+
+
+def bucket_value(index):
+    # Upper bound of a bucket
+    if index < SUB_COUNT:
+        return index
+    exp = index // SUB_COUNT + SUB_BITS - 1
+    return ((SUB_COUNT + index % SUB_COUNT + 1) << (exp - SUB_BITS)) - 1
+
+
+class LogHistogram:
+    # Fixed memory log-bucket histogram of nanosecond values.
+    # record() is a bit_length + one array increment, no allocation.
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * BUCKETS))
+        self.count = 0
+        self.max = 0
+
+    def record(self, value):
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        target = self.count * p / 100.0
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+    def summary(self):
+        # Microseconds
+        return {
+            'count': self.count,
+            'p50_us': round(self.percentile(50) / 1000, 1),
+            'p99_us': round(self.percentile(99) / 1000, 1),
+            'max_us': round(self.max / 1000, 1),
+        }
+
+    def reset(self):
+        for i in range(BUCKETS):
+            self.counts[i] = 0
+        self.count = 0
+        self.max = 0
+
+
+class LatencyStats:
+    # Input to USB latency per stage plus write outcome counters
+
+    def __init__(self):
+        self.stages = {name: LogHistogram() for name in STAGES}
+        self.kernel_to_read = self.stages['kernel_to_read']
+        self.read_to_build = self.stages['read_to_build']
+        self.build_to_write = self.stages['build_to_write']
+        self.total = self.stages['total']
+
+        self.writes = 0
+        self.deferred_eagain = 0 # BlockingIOError: hidg queue full, retried on EPOLLOUT
+        self.coalesced = 0 # Unwritten 0x30 superseded by a newer one
+        self.replaced = 0 # 0x30 slot taken by a 0x21 reply
+        self.dropped_disconnected = 0 # ESHUTDOWN / EPIPE: host gone
+        self.write_errors = 0
+
+        # DS4 gone -> DS4 attached again (ns)
+        self.reconnect = LogHistogram()
+        # USB host back -> first 0x30 written in the streaming state (ns)
+        self.host_reconnect = LogHistogram()
+
+    def record_input(self, kernel_ts, read_ts, built_ts, written_ts):
+        # All CLOCK_MONOTONIC ns
+        self.kernel_to_read.record(max(0, read_ts - kernel_ts))
+        self.read_to_build.record(built_ts - read_ts)
+        self.build_to_write.record(written_ts - built_ts)
+        self.total.record(max(0, written_ts - kernel_ts))
+
+    def snapshot(self):
+        return {
+            'latency': {name: hist.summary() for name, hist in self.stages.items()},
+            'writes': {
+                'ok': self.writes,
+                'deferred_eagain': self.deferred_eagain,
+                'coalesced': self.coalesced,
+                'replaced_by_reply': self.replaced,
+                'dropped_disconnected': self.dropped_disconnected,
+                'errors': self.write_errors,
+            },
+            'reconnect': self.reconnect.summary(),
+            'host_reconnect': self.host_reconnect.summary(),
+        }
+
+
+def write_stats_file(path, snapshot):
+    # Rewrite atomically so readers never see a partial file
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f, indent=1)
+        f.write('\n')
+    os.replace(tmp, path)
+
+
+class StatsServer:
+    # UNIX stream socket: every connection gets one JSON snapshot, then EOF.
+    #   socat - UNIX-CONNECT:/run/any2nscon.sock
+
+    def __init__(self, path, snapshot_fn):
+        self.path = path
+        self.snapshot_fn = snapshot_fn
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(4)
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def on_readable(self, fd, mask):
+        try:
+            conn, _ = self.sock.accept()
+        except BlockingIOError:
+            return
+        try:
+            conn.settimeout(0.05) # Never let a stuck reader stall the loop
+            conn.sendall(json.dumps(self.snapshot_fn(), indent=1).encode() + b'\n')
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,104 @@
+import json
+import math
+from array import array
+
+# Stick shaping compiled into lookup tables.
+#
+# A stick profile (deadzone, anti-deadzone, response curve, outer
+# saturation, resting center) is turned once into lookup tables indexed by
+# the raw 8-bit evdev position, holding the finished 12-bit Pro Controller
+# stick value, so the hot path costs the same no matter what the profile
+# does. Reloading a profile only swaps tables.
+#
+# axial:  deadzone and curve applied to each axis on its own; one 256-entry
+#         table per axis, xs[x] | ys[y] is the packed value (x | y << 12)
+# radial: applied to the stick vector's length (direction is kept), which
+#         avoids the "snap to axis" feel of axial deadzones; the axes depend
+#         on each other, so one 256 x 256 table indexed by (x << 8) | y
+STICK_MODES = ('axial', 'radial')
+
+RAW_MAX = 255
+OUT_CENTER = 0x800
+OUT_MAX = 0xFFF
+
+DEFAULT_STICK = {
+    'mode': 'axial',
+    'deadzone': 0.0, # Fraction of full deflection treated as center
+    'anti_deadzone': 0.0, # Output jumps to this fraction when leaving the deadzone
+    'curve': 1.0, # Exponent; > 1 gives finer control near the center
+    'outer': 1.0, # Deflection that already counts as full
+    'center': (128, 128), # Raw resting position (evdev units, before inversion)
+}
+
+
+def load_stick_profile(path):
+    # JSON: {"left": {...}, "right": {...}}, keys as in DEFAULT_STICK
+    with open(path) as f:
+        data = json.load(f)
+    return data.get('left', {}), data.get('right', {})
+
+
+def shape(m, deadzone, anti_deadzone, curve, outer):
+    # Deflection magnitude 0..1 -> shaped magnitude 0..1
+    if m <= deadzone:
+        return 0.0
+    m = min(1.0, (m - deadzone) / max(outer - deadzone, 1e-6))
+    return anti_deadzone + (1.0 - anti_deadzone) * (m ** curve)
+
+
+def normalize(v, center, invert):
+    # Raw 0..255 -> -1..1 around the calibrated center (each side scaled
+    # to its own range so both ends still reach full deflection)
+    d = v - center
+    n = d / center if d < 0 else d / (RAW_MAX - center)
+    return -n if invert else n
+
+
+def to_output(n):
+    n = max(-1.0, min(1.0, n))
+    return min(OUT_MAX, max(0, OUT_CENTER + round(n * (OUT_CENTER if n < 0 else OUT_MAX - OUT_CENTER))))
+
+
+class StickTable:
+    # axial:  xs[raw_x] | ys[raw_y] -> packed 12-bit x | y << 12, table None
+    # radial: table[(raw_x << 8) | raw_y] -> the same, xs/ys None
+
+    def __init__(self, profile=None, invert_x=False, invert_y=False):
+        p = dict(DEFAULT_STICK)
+        if profile:
+            p.update(profile)
+        if p['mode'] not in STICK_MODES:
+            raise ValueError(f"stick mode must be one of {STICK_MODES}")
+        self.center = (int(round(p['center'][0])), int(round(p['center'][1])))
+        cx, cy = p['center']
+        params = (p['deadzone'], p['anti_deadzone'], p['curve'], p['outer'])
+
+        if p['mode'] == 'axial':
+            xs = []
+            for v in range(RAW_MAX + 1):
+                n = normalize(v, cx, invert_x)
+                xs.append(to_output(math.copysign(shape(abs(n), *params), n)))
+            ys = []
+            for v in range(RAW_MAX + 1):
+                n = normalize(v, cy, invert_y)
+                ys.append(to_output(math.copysign(shape(abs(n), *params), n)) << 12)
+            self.xs = array('I', xs)
+            self.ys = array('I', ys)
+            self.table = None
+            return
+        self.xs = self.ys = None
+
+        nys = [normalize(v, cy, invert_y) for v in range(RAW_MAX + 1)]
+        table = array('I', bytes(4 * (RAW_MAX + 1) ** 2))
+        i = 0
+        for vx in range(RAW_MAX + 1):
+            nx = normalize(vx, cx, invert_x)
+            for ny in nys:
+                r = math.hypot(nx, ny)
+                if r > 0:
+                    s = shape(min(r, 1.0), *params) / r
+                    table[i] = to_output(nx * s) | (to_output(ny * s) << 12)
+                else:
+                    table[i] = OUT_CENTER | (OUT_CENTER << 12)
+                i += 1
+        self.table = table
@@ -0,0 +1,193 @@
+import socket
+import struct
+import time
+
+from input_map import HAT_CENTER
+from stats import LogHistogram
+
+# Controller state over UDP (--udp-listen HOST:PORT), for bots and remote
+# play. Works alone or on top of the DS4 (see ProControllerBridge.commit_state).
+#
+# One datagram is one complete state, so nothing ever has to be
+# retransmitted or queued: every readable event drains the socket and only
+# the newest packet of the burst is applied.
+#
+# Packet (PACKET, little endian, 22 bytes). All zeros is a neutral controller.
+#   magic     b'NS'
+#   version   PROTOCOL_VERSION
+#   hat       0 = centered, 1..8 = up, up-right, ... clockwise
+#   seq       u32, +1 per packet (wraps)
+#   time_ns   u64, sender CLOCK_MONOTONIC
+#   buttons   u16, Switch buttons: byte 0 | byte 1 << 8 (input_map.py BTN_*)
+#   sticks    LX LY RX RY, s8 each, evdev orientation (+Y is down); shaped
+#             by the stick profile like DS4 input
+#
+# Only one sender is served at a time. A packet whose seq is not newer than
+# the last accepted one (reordered or duplicated on the way) is dropped;
+# gaps are counted as lost (a late packet counts as lost, then reordered).
+# time_ns is only comparable with our clock on loopback or with synced
+# clocks: transit is recorded when it is non-negative, and with max_age_ms
+# older packets are dropped as stale.
+# A sender that goes quiet for timeout_ms is forgotten and its state
+# released, so a restarted client (seq from 0) is accepted right away.
+PACKET = struct.Struct('<2sBBIQH4b')
+MAGIC = b'NS'
+PROTOCOL_VERSION = 1
+DEFAULT_PORT = 5757
+SESSION_TIMEOUT_MS = 500
+
+NEUTRAL_STICK = 0x8080 # (128 << 8) | 128
+
+# Packet hat -> Switch hat bits (bits 16-19 of the button word)
+HAT_BITS = tuple(((h - 1) if 1 <= h <= 8 else HAT_CENTER) << 16 for h in range(256))
+
+
+def parse_address(text, default_host='0.0.0.0'):
+    # "HOST:PORT", ":PORT" or "PORT" -> (host, port)
+    host, _, port = text.rpartition(':')
+    return host or default_host, int(port)
+
+
+class UdpInput:
+    def __init__(self, address, max_age_ms=0, timeout_ms=SESSION_TIMEOUT_MS):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(address)
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.max_age_ns = int(max_age_ms * 1000000)
+        self.timeout_ns = int(timeout_ms * 1000000)
+        self.buf = bytearray(PACKET.size + 1) # One spare byte to spot oversized packets
+
+        # State of the current sender, in the bridge's formats
+        self.active = False
+        self.sender = None
+        self.btns = HAT_CENTER << 16
+        self.left = NEUTRAL_STICK # Stick table index (x << 8) | y
+        self.right = NEUTRAL_STICK
+        self.last_seq = 0
+        self.last_at = 0
+
+        self.received = 0
+        self.applied = 0 # Bursts that changed the state
+        self.superseded = 0 # Valid, but a newer packet came in the same burst
+        self.reordered = 0 # Duplicate or older seq
+        self.stale = 0 # Older than max_age_ms
+        self.lost = 0 # Seq gaps
+        self.malformed = 0
+        self.foreign = 0 # From a second sender while one is active
+        self.sessions = 0
+        self.transit = LogHistogram() # Sender time_ns -> read, ns
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read(self, now):
+        # Drain the socket at time now (CLOCK_MONOTONIC ns); True if the
+        # newest valid packet was applied
+        sock = self.sock
+        buf = self.buf
+        accepted = 0
+        while True:
+            try:
+                size, sender = sock.recvfrom_into(buf)
+            except BlockingIOError:
+                break
+            except OSError:
+                break
+            self.received += 1
+            if size != PACKET.size:
+                self.malformed += 1
+                continue
+            magic, version, hat, seq, sent_ns, buttons, lx, ly, rx, ry = PACKET.unpack_from(buf)
+            if magic != MAGIC or version != PROTOCOL_VERSION:
+                self.malformed += 1
+                continue
+
+            if sender != self.sender or not self.active:
+                if self.active and now - self.last_at < self.timeout_ns:
+                    self.foreign += 1
+                    continue
+                self.sender = sender
+                self.sessions += 1
+                self.active = True
+            else:
+                gap = (seq - self.last_seq) & 0xFFFFFFFF
+                if gap == 0 or gap >= 0x80000000:
+                    self.reordered += 1
+                    continue
+                self.lost += gap - 1
+            self.last_seq = seq
+            self.last_at = now
+
+            transit = now - sent_ns
+            if transit >= 0:
+                self.transit.record(transit)
+                if self.max_age_ns and transit > self.max_age_ns:
+                    self.stale += 1
+                    continue
+
+            accepted += 1
+            self.btns = buttons | HAT_BITS[hat]
+            self.left = ((lx + 128) << 8) | (ly + 128)
+            self.right = ((rx + 128) << 8) | (ry + 128)
+
+        if not accepted:
+            return False
+        self.superseded += accepted - 1
+        self.applied += 1
+        return True
+
+    def expire(self, now):
+        # Release the state of a sender that went quiet; True if it did
+        if not self.active or now - self.last_at < self.timeout_ns:
+            return False
+        self.active = False
+        self.btns = HAT_CENTER << 16
+        self.left = self.right = NEUTRAL_STICK
+        return True
+
+    def snapshot(self):
+        return {
+            'address': f"{self.address[0]}:{self.address[1]}",
+            'active': self.active,
+            'received': self.received,
+            'applied': self.applied,
+            'superseded': self.superseded,
+            'reordered': self.reordered,
+            'stale': self.stale,
+            'lost': self.lost,
+            'malformed': self.malformed,
+            'foreign': self.foreign,
+            'sessions': self.sessions,
+            'transit': self.transit.summary(),
+        }
+
+    def close(self):
+        self.sock.close()
+
+
+class UdpSender:
+    # Client side: UdpSender(('127.0.0.1', DEFAULT_PORT)).send(buttons=BTN_A)
+
+    def __init__(self, address):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect(address)
+        self.seq = 0
+        self.buf = bytearray(PACKET.size)
+
+    def send(self, buttons=0, hat=0, lx=0, ly=0, rx=0, ry=0, seq=None, sent_ns=None):
+        # seq/sent_ns are normally filled in; tests pass them to reorder
+        if seq is None:
+            self.seq = (self.seq + 1) & 0xFFFFFFFF
+            seq = self.seq
+        PACKET.pack_into(self.buf, 0, MAGIC, PROTOCOL_VERSION, hat, seq,
+                         time.monotonic_ns() if sent_ns is None else sent_ns,
+                         buttons, lx, ly, rx, ry)
+        try:
+            self.sock.send(self.buf)
+        except ConnectionRefusedError:
+            pass # Nobody listening (yet); ICMP from an earlier packet
+        return seq
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,72 @@
+import threading
+import time
+
+# Background workers for slow, lossy side effects (force feedback, LEDs).
+# The event loop only hands over the newest value; anything blocking
+# (a Bluetooth output report, a sysfs write) happens on the worker thread
+# and can never delay an input read or a report write.
+
+
+class LatestValueWorker:
+    # Calls fn(value) on its own thread for the newest submitted value only,
+    # at most once per min_interval_ns. A value still waiting when a newer one
+    # is submitted is dropped (counted in merged). fn may raise OSError
+    # (counted in errors); the worker keeps going.
+
+    def __init__(self, fn, min_interval_ns=0, name='worker'):
+        self.fn = fn
+        self.min_interval_ns = min_interval_ns
+        self.cond = threading.Condition()
+        self.pending = None
+        self.has_pending = False
+        self.running = True
+
+        self.submitted = 0
+        self.merged = 0
+        self.sent = 0
+        self.errors = 0
+
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, value):
+        # Never blocks on fn; only takes the lock for the handover
+        with self.cond:
+            self.submitted += 1
+            if self.has_pending:
+                self.merged += 1
+            self.pending = value
+            self.has_pending = True
+            self.cond.notify()
+
+    def _run(self):
+        last = 0
+        while True:
+            with self.cond:
+                while self.running and not self.has_pending:
+                    self.cond.wait()
+                if not self.has_pending:
+                    return # Closed and drained
+
+            # Rate limit: values arriving meanwhile replace the pending one
+            wait = last + self.min_interval_ns - time.monotonic_ns()
+            if wait > 0:
+                time.sleep(wait / 1e9)
+
+            with self.cond:
+                value = self.pending
+                self.pending = None
+                self.has_pending = False
+            try:
+                self.fn(value)
+                self.sent += 1
+            except OSError:
+                self.errors += 1
+            last = time.monotonic_ns()
+
+    def close(self, timeout=1.0):
+        # A value still pending is delivered before the thread exits
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join(timeout)